@@ -0,0 +1,91 @@
+#coding: utf-8
+"""
+Compare the heuristic and the ml html extractors on speed and output
+
+    python -m benchmarks.compare_extractors [html files or directories...]
+
+Defaults to the labelled pages under test/fixtures/labelled, whose labels.json
+has a sentence of the main content of every page. A summary is right when it has it.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import codecs
+import logging
+from timeit import default_timer
+
+from page_content_extractor.html import HtmlContentExtractor
+from page_content_extractor.ml import MLContentExtractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'test', 'fixtures', 'labelled')
+
+def load_labels(fixtures_dir=FIXTURES_DIR):
+    """Paths of the labelled pages and a sentence of their main content"""
+    with codecs.open(os.path.join(fixtures_dir, 'labels.json'), encoding='utf-8') as fp:
+        labels = json.load(fp)
+    return dict((os.path.join(fixtures_dir, name), label) for name, label in labels.iteritems())
+
+def is_right(summary, label):
+    return label is not None and label in re.sub(r'\s+', ' ', summary)
+
+def collect_files(paths):
+    files = []
+    for path in paths or [FIXTURES_DIR]:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.htm*'))))
+        else:
+            files.append(path)
+    return files
+
+def describe(node):
+    attrs = ' '.join('%s=%s' % (k, ' '.join(v) if isinstance(v, list) else v)
+                     for k, v in sorted(node.attrs.items())) if node.attrs else ''
+    return '<%s %s>' % (node.name, attrs)
+
+def timed(func, repeat):
+    start = default_timer()
+    for _ in xrange(repeat):
+        ret = func()
+    return ret, (default_timer() - start) / repeat
+
+def main(argv):
+    repeat = 5
+    labels = load_labels()
+    files = collect_files(argv)
+    docs = [codecs.open(f, encoding='utf-8', errors='replace').read() for f in files]
+    total = {'heuristic': 0, 'ml': 0}
+    right = {'heuristic': 0, 'ml': 0}
+    same = labelled = 0
+    for fname, html in zip(files, docs):
+        heuristic, ht = timed(lambda: HtmlContentExtractor(html), repeat)
+        ml, mt = timed(lambda: MLContentExtractor(html), repeat)
+        total['heuristic'] += ht
+        total['ml'] += mt
+        hs, ms = heuristic.get_summary(), ml.get_summary()
+        same += hs == ms
+        label = labels.get(fname)
+        labelled += label is not None
+        right['heuristic'] += is_right(hs, label)
+        right['ml'] += is_right(ms, label)
+        print '%s\n  heuristic %.1fms %s %s\n  ml        %.1fms %s %s\n  same summary: %s' % (
+            os.path.basename(fname),
+            ht*1000, describe(heuristic.article), 'right' if is_right(hs, label) else '',
+            mt*1000, describe(ml.article), 'right' if is_right(ms, label) else '', hs == ms)
+        if hs != ms:
+            print '    heuristic: %r\n    ml:        %r' % (hs[:120], ms[:120])
+
+    def batch():
+        return MLContentExtractor.score_batch([MLContentExtractor(html, defer=True) for html in docs])
+    _, bt = timed(batch, repeat)
+    print '\n%d pages, same summary on %d' % (len(docs), same)
+    if labelled:
+        print 'right on %d labelled: heuristic %d, ml %d' % (labelled, right['heuristic'], right['ml'])
+    print 'heuristic %.1fms, ml %.1fms, ml batched %.1fms' % (
+        total['heuristic']*1000, total['ml']*1000, bt*1000)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,68 @@
+#coding: utf-8
+"""
+Concurrent page requests on one gevent worker, with psycopg2 blocking the hub
+and with it waiting through gevent, see dbpool.make_green
+
+    DATABASE_URL=postgresql://localhost/hndigest python -m benchmarks.db_concurrency [concurrency]
+
+Only reads, any database created by `make initdb` will do.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import logging
+from timeit import default_timer
+
+import gevent
+import requests
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from psycopg2 import extensions
+
+import dbpool
+from index import app, db
+
+def sleep_queries(concurrency, delay=0.1):
+    """Each greenlet waits `delay` seconds in the database"""
+    def query():
+        with db.engine.connect() as conn:
+            conn.execute('SELECT pg_sleep(%s)', delay)
+    start = default_timer()
+    gevent.joinall([gevent.spawn(query) for _ in xrange(concurrency)], raise_error=True)
+    return default_timer() - start
+
+def page_requests(url, concurrency, total):
+    waits = []
+    def get(_):
+        resp = requests.get(url)
+        resp.raise_for_status()
+        waits.append(float(resp.headers['X-DB-Wait'].rstrip('ms')))
+    start = default_timer()
+    Pool(concurrency).map(get, xrange(total))
+    return total / (default_timer() - start), sum(waits) / len(waits)
+
+def main(concurrency):
+    # For X-DB-Wait
+    app.config['EXPOSE_INTERNALS'] = True
+    server = WSGIServer(('127.0.0.1', 0), app, log=None)
+    server.start()
+    url = 'http://127.0.0.1:%s/' % server.server_port
+    size, overflow = db.engine.pool.size(), db.engine.pool._max_overflow
+    print 'Pool size %s, overflow %s, %s concurrent greenlets' % (size, overflow, concurrency)
+    try:
+        for name, callback in (('blocking', None), ('green', dbpool.gevent_wait_callback)):
+            extensions.set_wait_callback(callback)
+            db.engine.dispose()
+            dbpool.stats.reset()
+            elapsed = sleep_queries(concurrency)
+            rps, wait = page_requests(url, concurrency, concurrency*10)
+            stats = dbpool.stats.snapshot(db.engine.pool)
+            print '%-8s %d x pg_sleep(0.1) in %.2fs, / at %.1f req/s, checkout wait avg %.1fms max %.1fms' % (
+                name, concurrency, elapsed, rps, wait, stats['wait_max_ms'])
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
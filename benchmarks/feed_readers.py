@@ -0,0 +1,56 @@
+#coding: utf-8
+"""
+Feed readers polling /feed with their own gte, contain and limit, and the
+If-None-Match of their last response, across updates of the site, see index.feed
+
+    DATABASE_URL=postgresql://localhost/hndigest python -m benchmarks.feed_readers [readers] [updates]
+
+Updates only bump models.LastUpdated, any database created by `make initdb` will do.
+"""
+import sys
+import random
+import logging
+from collections import Counter
+from timeit import default_timer
+
+import models
+from index import app
+
+PARAMS = ['', 'gte=100', 'gte=200', 'gte=500', 'contain=python', 'contain=rust',
+          'limit=10', 'gte=100&limit=50']
+
+def main(readers, updates):
+    random.seed(42)
+    # For X-Query-Count
+    app.config['EXPOSE_INTERNALS'] = True
+    client = app.test_client()
+    # Popular settings are shared by many readers
+    subscriptions = [random.choice(PARAMS[:random.randint(1, len(PARAMS))]) for _ in xrange(readers)]
+    etags = {}
+    outcomes, queries = Counter(), 0
+    start = default_timer()
+    for _ in xrange(updates):
+        models.LastUpdated.update('hackernews')
+        # Readers poll a few times between updates
+        for _ in xrange(3):
+            for reader, params in enumerate(subscriptions):
+                headers = {'Accept-Encoding': 'gzip'}
+                if reader in etags:
+                    headers['If-None-Match'] = etags[reader]
+                resp = client.get('/feed?' + params, headers=headers)
+                resp.get_data()
+                etags[reader] = resp.headers['ETag']
+                outcomes[resp.headers.get('X-Cache', resp.status_code)] += 1
+                queries += int(resp.headers.get('X-Query-Count', 0))
+    elapsed = default_timer() - start
+    total = sum(outcomes.values())
+    print '%d readers of %d distinct feeds, %d updates, %d requests in %.2fs' % (
+        readers, len(set(subscriptions)), updates, total, elapsed)
+    for outcome in (304, 'hit', 'miss'):
+        print '%-5s %6.1f%%' % (outcome, 100.0 * outcomes[outcome] / total)
+    print '%.2f queries per request' % (float(queries) / total)
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
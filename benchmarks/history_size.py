@@ -0,0 +1,92 @@
+#coding: utf-8
+"""
+Storage and memory of a month of 10-minute samples of score, comment count
+and rank, delta-encoded as in models.ItemHistory versus one row per sample
+
+    python -m benchmarks.history_size [stories]
+    DATABASE_URL=postgresql://localhost/scratch python -m benchmarks.history_size --pg [stories]
+
+With --pg, tables prefixed by bench_ are created in, and dropped from, that
+database to measure what postgres really takes. Do not point it at the production one.
+"""
+import sys
+import random
+import logging
+from datetime import datetime, timedelta
+
+import history
+
+SAMPLES = 30 * 24 * 6
+
+def trajectory(n, start):
+    """A story climbing the front page and falling off, sampled every 10 minutes"""
+    score, comments, rank = 1, 0, 30
+    samples = []
+    for i in xrange(n):
+        score += random.randint(0, 8 if i < 100 else 1)
+        comments += random.randint(0, 3 if i < 100 else 1)
+        rank = max(1, min(30, rank + random.randint(-2, 2))) if i < 300 else None
+        # Cron is never on time
+        samples.append((start + timedelta(seconds=600*i + random.randint(0, 5)), score, comments, rank))
+    return samples
+
+def deep_size(samples):
+    """Bytes of the decoded list, its tuples, datetimes and ints"""
+    seen = set()
+    total = sys.getsizeof(samples)
+    for sample in samples:
+        for obj in (sample,) + sample:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+    return total
+
+def measure_pg(stories):
+    from sqlalchemy import create_engine
+    from config import SQLALCHEMY_DATABASE_URI
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS bench_sample, bench_history')
+        conn.execute('CREATE TABLE bench_sample (site VARCHAR, url VARCHAR, at TIMESTAMP, score INTEGER, '
+                     'comment_cnt INTEGER, rank INTEGER, PRIMARY KEY (site, url, at))')
+        conn.execute('CREATE TABLE bench_history (site VARCHAR, url VARCHAR, data BYTEA, '
+                     'PRIMARY KEY (site, url))')
+    try:
+        start = datetime(2015, 1, 1)
+        with engine.begin() as conn:
+            for i in xrange(stories):
+                url = 'https://news.ycombinator.com/item?id=%s' % (9000000 + i)
+                samples = trajectory(SAMPLES, start)
+                conn.execute('INSERT INTO bench_sample VALUES (%s, %s, %s, %s, %s, %s)',
+                             [('hackernews', url) + sample for sample in samples])
+                conn.execute('INSERT INTO bench_history VALUES (%s, %s, %s)',
+                             'hackernews', url, history.encode(samples))
+        with engine.connect() as conn:
+            conn.execute('VACUUM ANALYZE bench_sample')
+            conn.execute('VACUUM ANALYZE bench_history')
+            for name in ('bench_sample', 'bench_history'):
+                size = conn.execute("SELECT pg_total_relation_size('%s')" % name).scalar()
+                print 'postgres %-14s %10d bytes, %6.1f per sample' % (name, size, float(size) / (stories*SAMPLES))
+    finally:
+        with engine.begin() as conn:
+            conn.execute('DROP TABLE IF EXISTS bench_sample, bench_history')
+
+def main(argv):
+    pg = '--pg' in argv
+    argv = [arg for arg in argv if arg != '--pg']
+    stories = int(argv[0]) if argv else 30
+    random.seed(42)
+    samples = trajectory(SAMPLES, datetime(2015, 1, 1))
+    data = history.encode(samples)
+    assert [s[1:] for s in history.decode(data)] == [s[1:] for s in samples]
+    print '%d samples of a story in a month' % SAMPLES
+    print 'delta-encoded  %8d bytes, %5.2f per sample' % (len(data), float(len(data)) / SAMPLES)
+    # timestamp and three int4, in arrays or as columns
+    print 'raw values     %8d bytes, %5.2f per sample' % (SAMPLES*20, 20.0)
+    print 'decoded list   %8d bytes in memory' % deep_size(history.decode(data))
+    if pg:
+        measure_pg(stories)
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+#coding: utf-8
+"""
+Count the rows scanned by list and feed queries, on the old per-site layout
+(url as the only index) and on the unified item table with its indexes
+
+    DATABASE_URL=postgresql://localhost/scratch python -m benchmarks.item_scans [rows per site]
+
+Tables prefixed by bench_ are created in, and dropped from, that database.
+Do not point it at the production one.
+"""
+import sys
+import time
+import random
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from config import SQLALCHEMY_DATABASE_URI
+
+SITES = ('hackernews', 'startupnews')
+
+COLUMNS = '''
+    url VARCHAR NOT NULL,
+    rank INTEGER,
+    title VARCHAR,
+    score INTEGER,
+    submit_time TIMESTAMP WITHOUT TIME ZONE,
+    summary VARCHAR
+'''
+
+OLD_SCHEMA = ['CREATE TABLE bench_%s (%s, PRIMARY KEY (url))' % (site, COLUMNS) for site in SITES]
+
+NEW_SCHEMA = [
+    'CREATE TABLE bench_item (site VARCHAR NOT NULL, %s, PRIMARY KEY (site, url))' % COLUMNS,
+    'CREATE INDEX bench_ix_item_site_rank ON bench_item (site, rank)',
+    'CREATE INDEX bench_ix_item_site_submit_time_score ON bench_item (site, submit_time DESC, score)',
+]
+
+# (name, old query, new query), see index.py
+QUERIES = [
+    ('list', 'SELECT * FROM bench_hackernews ORDER BY rank',
+     "SELECT * FROM bench_item WHERE site = 'hackernews' ORDER BY rank"),
+    ('feed', "SELECT * FROM bench_hackernews WHERE score >= 100 AND title ILIKE '%%' "
+             "ORDER BY submit_time DESC",
+     "SELECT * FROM bench_item WHERE site = 'hackernews' AND score >= 100 AND title ILIKE '%%' "
+     "ORDER BY submit_time DESC"),
+]
+
+def seed(conn, rows_per_site):
+    now = datetime.utcnow()
+    for site in SITES:
+        rows = [dict(site=site, url='http://%s/%s' % (site, i), rank=i, title='title %s' % i,
+                     score=random.randint(0, 500), submit_time=now - timedelta(minutes=i),
+                     summary='summary ' * 20)
+                for i in xrange(rows_per_site)]
+        conn.execute('INSERT INTO bench_item (site, url, rank, title, score, submit_time, summary) '
+                     'VALUES (%(site)s, %(url)s, %(rank)s, %(title)s, %(score)s, %(submit_time)s, %(summary)s)',
+                     rows)
+        conn.execute('INSERT INTO bench_%s SELECT url, rank, title, score, submit_time, summary '
+                     'FROM bench_item WHERE site = %%s' % site, site)
+    conn.execute('ANALYZE')
+
+def plan(conn, query):
+    """Rows read by all scan nodes, and the shared buffers touched"""
+    result = conn.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query).scalar()
+    rows = [0]
+    scans = []
+
+    def walk(node):
+        if node['Node Type'].endswith('Scan'):
+            scans.append(node['Node Type'])
+            # rows returned plus rows thrown away by filters, per loop
+            rows[0] += (node['Actual Rows'] + node.get('Rows Removed by Filter', 0)) * node['Actual Loops']
+        for child in node.get('Plans', []):
+            walk(child)
+    top = result[0]['Plan']
+    walk(top)
+    buffers = top.get('Shared Hit Blocks', 0) + top.get('Shared Read Blocks', 0)
+    # Called Total Runtime before 9.4
+    ms = result[0].get('Execution Time', result[0].get('Total Runtime'))
+    return scans, rows[0], buffers, ms
+
+def main(rows_per_site):
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    with engine.begin() as conn:
+        for site in SITES:
+            conn.execute('DROP TABLE IF EXISTS bench_%s' % site)
+        conn.execute('DROP TABLE IF EXISTS bench_item')
+        for stmt in OLD_SCHEMA + NEW_SCHEMA:
+            conn.execute(stmt)
+    try:
+        start = time.time()
+        with engine.begin() as conn:
+            seed(conn, rows_per_site)
+        print 'Seeded %s rows per site in %.1fs' % (rows_per_site, time.time() - start)
+        with engine.connect() as conn:
+            for name, old, new in QUERIES:
+                for layout, query in (('per-site', old), ('item', new)):
+                    scans, rows, buffers, ms = plan(conn, query)
+                    print '%-5s %-9s %-32s %8s rows scanned %6s buffers %8.2fms' % (
+                        name, layout, '+'.join(scans), rows, buffers, ms)
+    finally:
+        with engine.begin() as conn:
+            for site in SITES:
+                conn.execute('DROP TABLE IF EXISTS bench_%s' % site)
+            conn.execute('DROP TABLE IF EXISTS bench_item')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
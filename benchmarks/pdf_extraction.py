@@ -0,0 +1,67 @@
+#coding: utf-8
+"""
+Time PdfExtractor.get_summary on test/fixtures/cpi.pdf and a large synthetic pdf
+
+    python -m benchmarks.pdf_extraction [number of synthetic pages]
+"""
+import os
+import sys
+import logging
+from timeit import default_timer
+
+from page_content_extractor.pdf import PdfExtractor
+from config import summary_length
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'test', 'fixtures', 'cpi.pdf')
+
+def synthetic_pdf(pages, lines_per_page=45):
+    """A plain pdf with `pages` pages full of text, no external deps needed"""
+    sentence = 'Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor'
+    objs = ['<< /Type /Catalog /Pages 2 0 R >>', None,
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for p in xrange(pages):
+        lines = ['BT /F1 10 Tf 12 TL 50 780 Td']
+        for l in xrange(lines_per_page):
+            lines.append('(%s %d %d) Tj T*' % (sentence, p, l))
+        lines.append('ET')
+        stream = '\n'.join(lines)
+        objs.append('<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objs.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                    '/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objs))
+        kids.append('%d 0 R' % len(objs))
+    objs[1] = '<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join(kids), pages)
+    out = ['%PDF-1.4\n']
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(sum(len(s) for s in out))
+        out.append('%d 0 obj\n%s\nendobj\n' % (i+1, obj))
+    xref_at = sum(len(s) for s in out)
+    out.append('xref\n0 %d\n0000000000 65535 f \n' % (len(objs)+1))
+    out.extend('%010d 00000 n \n' % o for o in offsets)
+    out.append('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs)+1, xref_at))
+    return ''.join(out)
+
+def bench(name, raw_data, **kwargs):
+    start = default_timer()
+    parser = PdfExtractor(raw_data, **kwargs)
+    summary = parser.get_summary(summary_length)
+    elapsed = default_timer() - start
+    print '%-28s %8d bytes  %3d pages extracted  %7.1fms  %r' % (
+        name, len(raw_data), len(parser.page_texts), elapsed*1000, (summary or '')[:40])
+
+def main(argv):
+    pages = int(argv[0]) if argv else 500
+    bench('cpi.pdf', open(FIXTURE, 'rb').read())
+    big = synthetic_pdf(pages)
+    bench('synthetic(%d pages)' % pages, big)
+    start = default_timer()
+    parser = PdfExtractor(big, max_pages=pages, max_seconds=3600)
+    parser.article
+    print '%-28s %8d bytes  %3d pages extracted  %7.1fms  (the old eager way)' % (
+        'synthetic, all pages', len(big), len(parser.page_texts), (default_timer() - start)*1000)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,87 @@
+#coding: utf-8
+"""
+Latency of searching an archive-sized corpus with search.SearchIndex versus
+matching every title and summary like ILIKE '%...%' does, plus the time to
+build the index, to catch up with an update and the memory it takes
+
+    python -m benchmarks.search_latency [items]
+
+No database is needed, items are made up from a skewed vocabulary.
+"""
+import sys
+import time
+import random
+import logging
+from datetime import datetime, timedelta
+
+from search import SearchIndex
+from page_content_extractor.utils import peak_rss
+
+WORDS = [u'python', u'rust', u'startup', u'google', u'apple', u'linux', u'database', u'show',
+         u'ask', u'hn', u'javascript', u'security', u'open', u'source', u'release', u'why', u'how',
+         u'the', u'of', u'a', u'new', u'postgres', u'kernel', u'compiler', u'funding', u'yc']
+WORDS += [u'word%d' % i for i in xrange(5000)]
+CJK = u'我的你是中文学习笔记创业公司开源数据库'
+
+QUERIES = [u'python', u'the', u'show hn', u'rust compiler', u'word4321', u'学习', u'创业公司', u'nothing']
+
+def text(n):
+    # Zipf-like, common words are much more common
+    words = [WORDS[min(int(random.paretovariate(0.8)) - 1, len(WORDS) - 1)] for _ in xrange(n)]
+    if random.random() < 0.1:
+        words.append(u''.join(random.sample(CJK, 4)))
+    return u' '.join(words)
+
+def corpus(n, start):
+    for i in xrange(n):
+        yield (i, u'http://example.com/%d' % i, text(8), text(40), random.randint(1, 1000),
+               start - timedelta(minutes=i), None, start)
+
+def scan(rows, query, gte, limit):
+    """What `title ILIKE '%query%'` does, on summaries too"""
+    query = query.lower()
+    found = [row for row in rows if row[4] >= gte and
+             (query in row[2].lower() or query in row[3].lower())]
+    return sorted(found, key=lambda row: row[5], reverse=True)[:limit]
+
+def timed(func, repeat):
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[-1] * 1000
+
+def main(items):
+    random.seed(42)
+    now = datetime.utcnow()
+    rows = list(corpus(items, now))
+    rss = peak_rss()
+    index = SearchIndex()
+    start = time.time()
+    index.add_archived(rows)
+    print '%d items indexed in %.2fs, %d terms, %.1fMB more peak RSS' % (
+        items, time.time() - start, len(index.postings), (peak_rss() - rss) / 1024.0)
+
+    # An update changes scores of the front page, and a few titles
+    live = [(row[1], row[2], row[3], row[4], row[5], row[6]) for row in rows[:60]]
+    index.sync_items(live)
+    live = [(url, title if random.random() < 0.9 else text(8), summary, score + 10, submit_time, None)
+            for url, title, summary, score, submit_time, _ in live]
+    start = time.time()
+    changed, gone = index.sync_items(live)
+    print 'Caught up with an update in %.2fms, %d texts tokenized again' % ((time.time() - start) * 1000, changed)
+
+    print '%-14s %5s %7s %12s %12s' % ('query', 'gte', 'found', 'index ms', 'scan ms')
+    for query in QUERIES:
+        for gte in (0, 500):
+            found = len(index.search(query, gte, 30))
+            indexed = timed(lambda: index.search(query, gte, 30), 20)
+            scanned = timed(lambda: scan(rows, query, gte, 30), 3)
+            print u'%-14s %5d %7d %5.2f/%5.2f %5.1f/%5.1f' % ((query, gte, found) + indexed + scanned)
+    print '(median/max)'
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60000)
@@ -0,0 +1,58 @@
+#coding: utf-8
+"""
+Image bytes of a front page view, with the originals served as they were and
+with the thumbnails of thumbnail.py, in WebP and in the JPEG/PNG fallback
+
+    python -m benchmarks.thumbnail_bytes [image files]
+
+Without files, 30 made-up illustrations of typical sizes are used. Needs Pillow.
+"""
+import sys
+import random
+import logging
+from io import BytesIO
+from timeit import default_timer
+
+import thumbnail
+
+SIZES = [(1200, 630), (1600, 900), (2048, 1365), (800, 600), (1024, 512)]
+
+def made_up(n):
+    """Photo-like JPEGs, shapes with noise so they don't compress unrealistically well"""
+    from PIL import Image, ImageDraw, ImageFilter
+    for _ in xrange(n):
+        size = random.choice(SIZES)
+        img = Image.effect_noise(size, 40).convert('RGB')
+        draw = ImageDraw.Draw(img)
+        for _ in xrange(20):
+            x, y = random.randint(0, size[0]), random.randint(0, size[1])
+            draw.ellipse((x, y, x + random.randint(50, 600), y + random.randint(50, 400)),
+                         fill=tuple(random.randint(0, 255) for _ in xrange(3)))
+        img = img.filter(ImageFilter.GaussianBlur(1))
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=90)
+        yield out.getvalue()
+
+def main(paths):
+    if not thumbnail.enabled:
+        sys.exit('Install Pillow first')
+    random.seed(42)
+    images = [open(path, 'rb').read() for path in paths] or list(made_up(30))
+    totals = {'original': 0, 'image/webp': 0, 'fallback': 0}
+    start = default_timer()
+    for raw_data in images:
+        derivatives = dict(thumbnail.make(raw_data))
+        totals['original'] += len(raw_data)
+        # What /img/<id>/thumbnail sends, the original if no derivative is smaller
+        totals['image/webp'] += len(derivatives.get('image/webp', raw_data))
+        fallback = [data for content_type, data in derivatives.iteritems() if content_type != 'image/webp']
+        totals['fallback'] += len(fallback[0] if fallback else raw_data)
+    elapsed = default_timer() - start
+    print '%d images, %.0fms to make the thumbnails of each' % (len(images), elapsed * 1000 / len(images))
+    for name in ('original', 'fallback', 'image/webp'):
+        print '%-10s %10d bytes per page view, %5.1fx smaller' % (
+            name, totals[name], float(totals['original']) / totals[name])
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main(sys.argv[1:])
@@ -18,9 +18,11 @@ except KeyError:
 
 # Fail fast
 HN_UPDATE_KEY = os.environ.get('HN_UPDATE_KEY')
+# Send X-Query-Count and the like, and serve /metrics/*, which tell how workers are doing
+EXPOSE_INTERNALS = DEBUG or 'EXPOSE_INTERNALS' in os.environ
 
 # Free account on heroku
-DB_CONNECTION_LIMIT = 20
+DB_CONNECTION_LIMIT = int(os.environ.get('DB_CONNECTION_LIMIT', 20))
 # Database
 try:
     vcap_services = os.environ['VCAP_SERVICES']
@@ -28,16 +30,19 @@ try:
 except Exception:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", 'postgres://postgres@localhost:5432/hndigest')
 SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace('postgres://', 'postgresql://')
-SQLALCHEMY_POOL_SIZE = 5
-SQLALCHEMY_MAX_OVERFLOW = 5
 SQLALCHEMY_ECHO = DEBUG
+# Optional, a streaming replica of the primary for the read-only pages, see index.read_only
+REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+if REPLICA_DATABASE_URL:
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL.replace('postgres://', 'postgresql://')}
+# Seconds between checks that the replica has caught up with the last update
+REPLICA_CHECK_INTERVAL = int(os.environ.get('REPLICA_CHECK_INTERVAL', 5))
 
 # Gunicorn
 # As suggested by nginx-buildpack
 bind = "unix:/tmp/nginx.socket"
 # Each worker occupies 25M memory
-# workers = multiprocessing.cpu_count()*2
-# workers = 3
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
 # needs restarting or something wired will happen
 max_requests = 100
 # threads = SQLALCHEMY_POOL_SIZE
@@ -47,6 +52,40 @@ preload_app = True
 worker_class = "gevent"
 timeout = 10*60
 
+# Workers share DB_CONNECTION_LIMIT, greenlets of a worker share its pool
+from dbpool import pool_size
+SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW = pool_size(DB_CONNECTION_LIMIT, workers)
+# Greenlets queue up for a connection rather than failing, but not forever
+SQLALCHEMY_POOL_TIMEOUT = 10
+
+def post_fork(server, worker):
+    import dbpool
+    dbpool.make_green()
+    # Never share connections opened before the fork by the preloaded app
+    from index import db
+    db.engine.dispose()
+
 summary_length = 250
+# heuristic or ml, the latter needs numpy
+extractor_mode = os.environ.get('EXTRACTOR_MODE', 'heuristic')
+# Cap page sizes and free parse trees as soon as possible
+low_memory_extraction = 'LOW_MEMORY_EXTRACTION' in os.environ
 sites_for_users = ('github.com', 'medium.com')
+# When sites were last updated, shared by workers of this machine, see generation.py
+GENERATION_FILE = os.environ.get('GENERATION_FILE', '/tmp/hndigest-generations')
+# Seconds to trust it before checking with the database, e.g. for updates from other machines
+GENERATION_RESYNC = int(os.environ.get('GENERATION_RESYNC', 60))
+# Keep compressed bodies of fetched pages here to re-run extractors offline
+raw_store_dir = os.environ.get('RAW_STORE_DIR')
+raw_store_max_bytes = int(os.environ.get('RAW_STORE_MAX_BYTES', 1024**3))
+# Days to keep items off the page in the archive, at least today's
+archive_retention_days = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 30))
+if archive_retention_days < 1:
+    raise ValueError('ARCHIVE_RETENTION_DAYS must be at least 1, got %s' % archive_retention_days)
+# Keep image blobs in this directory instead of the database, see imagestore.py
+IMAGE_STORE_DIR = os.environ.get('IMAGE_STORE_DIR')
+# Let nginx send stored images, should match the internal location in config/nginx.conf.erb
+IMAGE_X_ACCEL_PREFIX = os.environ.get('IMAGE_X_ACCEL_PREFIX')
+# Bytes of hot images kept by every worker, see imagecache.py
+IMAGE_CACHE_BYTES = int(os.environ.get('IMAGE_CACHE_BYTES', 32*1024*1024))
 
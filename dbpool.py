@@ -0,0 +1,175 @@
+"""
+Database connections under gevent: psycopg2 waits for its sockets through the
+gevent hub instead of blocking the whole worker, and the connection pool keeps
+metrics of how long checkouts wait, see index.db_metrics.
+
+Reads of requests marked by use_replica go to the optional replica bind,
+as long as it has caught up with the primary.
+"""
+import logging
+import threading
+from time import time
+from timeit import default_timer
+
+from flask import g, has_request_context
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+def gevent_wait_callback(conn, timeout=None):
+    """Like psycogreen.gevent, wait for the socket of an async connection cooperatively"""
+    from gevent.socket import wait_read, wait_write
+    import psycopg2
+    from psycopg2 import extensions
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('Bad result from poll: %r' % state)
+
+def make_green():
+    """Make psycopg2 cooperative, in every gevent worker before it connects"""
+    from psycopg2 import extensions
+    extensions.set_wait_callback(gevent_wait_callback)
+    logger.info('psycopg2 waits through gevent')
+
+def pool_size(connection_limit, workers, reserved=2):
+    """
+    (pool_size, max_overflow) of each worker, so that all of them together
+    never open more than `connection_limit` connections, `reserved` ones are
+    left for psql and migrations
+    """
+    per_worker = max((connection_limit - reserved) // max(workers, 1), 2)
+    size = max(per_worker // 2, 1)
+    return size, per_worker - size
+
+class PoolStats(object):
+    """Checkout waits of this process, in seconds"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def observe(self, wait, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.timeouts += timed_out
+        if has_request_context():
+            g.db_wait = getattr(g, 'db_wait', 0) + wait
+
+    def snapshot(self, pool):
+        with self.lock:
+            stats = dict(checkouts=self.checkouts, timeouts=self.timeouts,
+                         wait_total_ms=round(self.wait_total*1000, 1),
+                         wait_avg_ms=round(self.wait_total*1000/self.checkouts, 2) if self.checkouts else 0,
+                         wait_max_ms=round(self.wait_max*1000, 1))
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), max_overflow=pool._max_overflow,
+                         in_use=pool.checkedout(), idle=pool.checkedin(),
+                         # negative until connections beyond the pool size are opened
+                         overflow=max(pool.overflow(), 0))
+        return stats
+
+stats = PoolStats()
+
+class MeteredQueuePool(QueuePool):
+    """Times how long checkouts wait for a connection, including connecting"""
+
+    def _timed_checkout(self, checkout):
+        start = default_timer()
+        try:
+            conn = checkout()
+        except exc.TimeoutError:
+            stats.observe(default_timer() - start, timed_out=True)
+            raise
+        stats.observe(default_timer() - start)
+        return conn
+
+    def connect(self):
+        return self._timed_checkout(super(MeteredQueuePool, self).connect)
+
+    def unique_connection(self):
+        return self._timed_checkout(super(MeteredQueuePool, self).unique_connection)
+
+REPLICA = 'replica'
+# The latest update of any site, see models.LastUpdated
+LAST_UPDATED_SQL = 'SELECT max(time_stamp) FROM last_updated'
+
+class ReplicaGuard(object):
+    """
+    Tells if the replica has caught up with the last update on the primary,
+    checked at most once every REPLICA_CHECK_INTERVAL seconds per process
+    """
+
+    def __init__(self):
+        self.checked_at = 0
+        self.fresh = False
+
+    def is_fresh(self, db, app):
+        now = time()
+        if now - self.checked_at < app.config.get('REPLICA_CHECK_INTERVAL', 5):
+            return self.fresh
+        try:
+            primary = db.get_engine(app).scalar(LAST_UPDATED_SQL)
+            replica = db.get_engine(app, REPLICA).scalar(LAST_UPDATED_SQL)
+            fresh = primary is None or (replica is not None and replica >= primary)
+            if not fresh:
+                logger.info('Replica lags behind, updated at %s, the primary at %s', replica, primary)
+        except exc.SQLAlchemyError:
+            logger.exception('Failed to check the replica')
+            fresh = False
+        self.checked_at, self.fresh = now, fresh
+        return fresh
+
+class RoutingSession(SignallingSession):
+    """Reads go to the replica in requests marked by use_replica, anything else to the primary"""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and getattr(g, 'use_replica', False) \
+                and not self._flushing and not isinstance(clause, UpdateBase):
+            return self.db.get_engine(self.app, REPLICA)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+class MeteredSQLAlchemy(SQLAlchemy):
+    """Meters the postgres pool, and routes reads to the replica, see use_replica"""
+
+    def __init__(self, *args, **kwargs):
+        super(MeteredSQLAlchemy, self).__init__(*args, **kwargs)
+        self.replica_guard = ReplicaGuard()
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def has_replica(self, app=None):
+        return REPLICA in (self.get_app(app).config.get('SQLALCHEMY_BINDS') or ())
+
+    def use_replica(self, app=None):
+        """Send reads of the current request to the replica, if there is a fresh one"""
+        app = self.get_app(app)
+        g.use_replica = self.has_replica(app) and self.replica_guard.is_fresh(self, app)
+        return g.use_replica
+
+    def apply_driver_hacks(self, app, info, options):
+        super(MeteredSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('postgresql') and 'poolclass' not in options:
+            options['poolclass'] = MeteredQueuePool
@@ -0,0 +1,113 @@
+"""
+When each site was last updated, shared by all processes of this machine through
+a memory-mapped file, so workers learn about updates without asking the database,
+see models.LastUpdated
+
+Every site has a fixed slot of (sequence, generation, updated_at, synced_at).
+Writers take an flock and make the sequence odd while they write, readers retry
+until they read the same even sequence before and after the values, so they never
+see half of an update and never wait for a lock.
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import logging
+import calendar
+from datetime import datetime, timedelta
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+SEQ = struct.Struct('=Q')
+# generation, updated_at in microseconds since the epoch, synced_at in seconds
+FIELDS = struct.Struct('=Qqd')
+SLOT_SIZE = SEQ.size + FIELDS.size
+EPOCH = datetime(1970, 1, 1)
+
+Record = namedtuple('Record', 'generation updated_at synced_at')
+
+def to_micros(dt):
+    if dt is None:
+        return 0
+    return calendar.timegm(dt.utctimetuple()) * 1000000 + dt.microsecond
+
+def from_micros(micros):
+    if not micros:
+        return None
+    return EPOCH + timedelta(microseconds=micros)
+
+class SharedGenerations(object):
+    # Readers give up, and ask the database, if a writer never finishes
+    MAX_RETRIES = 10000
+
+    def __init__(self, path, names=('hackernews', 'startupnews')):
+        self.path = path
+        self.slots = dict((name, i * SLOT_SIZE) for i, name in enumerate(names))
+        self.size = max(SLOT_SIZE * len(names), mmap.PAGESIZE)
+        self.pid = None
+
+    def open(self):
+        """Opened once per process, an flock is not shared with forked children"""
+        if self.pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size < self.size:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < self.size:
+                    os.ftruncate(fd, self.size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        self.fd = fd
+        self.map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.pid = os.getpid()
+
+    def read(self, name):
+        """Record of `name`, None if it's unknown or has never been written"""
+        if name not in self.slots:
+            return None
+        self.open()
+        offset = self.slots[name]
+        for _ in xrange(self.MAX_RETRIES):
+            seq, = SEQ.unpack_from(self.map, offset)
+            generation, updated_at, synced_at = FIELDS.unpack_from(self.map, offset + SEQ.size)
+            if seq & 1 or SEQ.unpack_from(self.map, offset)[0] != seq:
+                time.sleep(0)  # a writer is halfway through
+                continue
+            if not seq:
+                return None
+            return Record(generation, from_micros(updated_at), synced_at)
+        logger.warning('%s of %s is being written for too long', name, self.path)
+        return None
+
+    def write(self, name, updated_at, bump):
+        if name not in self.slots:
+            return None
+        self.open()
+        offset = self.slots[name]
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            seq, = SEQ.unpack_from(self.map, offset)
+            # Left odd by a writer killed halfway
+            seq -= seq & 1
+            generation, old, _ = FIELDS.unpack_from(self.map, offset + SEQ.size)
+            micros = to_micros(updated_at)
+            if bump or micros != old:
+                generation += 1
+            # The sequence is odd until all fields are written
+            SEQ.pack_into(self.map, offset, seq + 1)
+            FIELDS.pack_into(self.map, offset + SEQ.size, generation, micros, time.time())
+            SEQ.pack_into(self.map, offset, seq + 2)
+            return generation
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def bump(self, name, updated_at):
+        """`name` is updated at `updated_at`, returns the new generation"""
+        return self.write(name, updated_at, True)
+
+    def sync(self, name, updated_at):
+        """`updated_at` is what the database says, the generation moves only if it differs"""
+        return self.write(name, updated_at, False)
@@ -6,69 +6,78 @@ from datetime import datetime, timedelta
 
 from bs4 import BeautifulSoup as BS
 from null import Null
-from page_content_extractor import legendary_parser_factory
+from page_content_extractor import extract_batch, RawStore
 
 logger = logging.getLogger(__name__)
 
-from config import sites_for_users, summary_length
+from config import sites_for_users, summary_length, extractor_mode, low_memory_extraction, \
+    raw_store_dir, raw_store_max_bytes
 import models
 import requests
 
+raw_store = RawStore(raw_store_dir, raw_store_max_bytes) if raw_store_dir else None
+
 class HackerNews(object):
     end_point = 'https://news.ycombinator.com/'
     model_class = models.HackerNews
 
     def update(self, force=False):
-        stats = {'updated': 0, 'added': 0, 'removed': 0, 'errors': []}
+        stats = {'updated': 0, 'added': 0, 'removed': 0, 'errors': [], 'rss_delta': {}}
         if force:
             stats['removed'] += self.model_class.remove_except([])
         news_list = self.parse_news_list()
-        # add new items
+        # Use news url as the key
+        existing = self.model_class.snapshot([news['url'] for news in news_list])
+        pending = []
         for news in news_list:
-            try:
-                # Use news url as the key
-                news_inst = self.model_class.query.get(news['url'])
-                if news_inst:
-                    if news_inst.summary:
-                        logger.info('Updating %s', news['url'])
-                        stats['updated'] += 1
-                        # We need the url so we can't pop it here
-                        _news = news.copy()
-                        self.model_class.update(_news.pop('url'), **_news)
-                        continue
-                    # If we don't find the summary, something has gone wrong,
-                    # just delete the whole and start over again.
-                    self.model_class.delete(news['url'])
-                    stats['removed'] += 1
-                self.insert_news(news, stats)
-            except Exception as e:
-                logger.exception(e)
-                stats['errors'].append(str(e))
-
-        if not force:
-            # clean up old items
-            stats['removed'] += self.model_class.remove_except([n['url'] for n in news_list])
+            stored = existing.get(news['url'])
+            if stored and stored['summary']:
+                # Only ranks, scores etc. may change, see bulk_upsert
+                continue
+            if stored:
+                # If we don't find the summary, something has gone wrong,
+                # just start over again.
+                logger.info('Extracting %s again', news['url'])
+            pending.append(news)
+        # Pages of the cycle are scored together by the ml engine
+        logger.info('Fetching %s pages', len(pending))
+        results = extract_batch([news['url'] for news in pending], summary_length, extractor_mode,
+                                low_memory_extraction, memo=models.ExtractionMemo, store=raw_store)
+        for news, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error('Failed to fetch %s, %s', news['url'], result)
+                stats['errors'].append(str(result))
+                continue
+            self.save_result(news, result, stats)
+
+        # Write them all in one transaction
+        synced = self.model_class.sync(news_list, existing, remove_stale=not force)
+        for key in ('updated', 'added', 'removed', 'errors'):
+            stats[key] += synced[key]
         return stats
 
-    def insert_news(self, news, stats):
+    def save_result(self, news, result, stats):
+        """Fill in the summary, favicon and image of news, the rows are staged, see update"""
         try:
-            logger.info("Fetching %s", news['url'])
-            parser = legendary_parser_factory(news['url'])
-            news['summary'] = parser.get_summary(summary_length)
-            news['favicon'] = parser.get_favicon_url()
-            tm = parser.get_illustration()
+            news['summary'] = result.summary
+            news['favicon'] = result.favicon
+            stats['rss_delta'][news['url']] = result.rss_delta
+            if result.memoized:
+                news['img_id'] = result.img_id
+                return
+            tm = result.illustration
+            # Committed along with the items, see model_class.sync
             if tm:
-                img_id = models.Image.add(
-                    url=tm.url,
-                    content_type=tm.content_type,
-                    raw_data=tm.raw_data)
+                img_id = models.Image.stage(tm.url, tm.content_type, tm.raw_data)
                 news['img_id'] = img_id
+                models.Thumbnail.make(img_id, tm.raw_data, commit=False)
+            # Items without a summary are retried, see update
+            if result.memo_key and result.summary:
+                models.ExtractionMemo.remember(result.memo_key, result.summary,
+                                               result.favicon, news.get('img_id'), commit=False)
         except Exception as e:
-            logger.exception('Failed to fetch %s, %s', news['url'], e)
+            logger.exception('Failed to save %s, %s', news['url'], e)
             stats['errors'].append(str(e))
-        finally:
-            self.model_class.add(**news)
-            stats['added'] += 1
 
     def parse_news_list(self):
         dom = BS(requests.get(self.end_point).text)
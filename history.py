@@ -0,0 +1,58 @@
+"""
+Compact series of (time, score, comment_cnt, rank) samples of an item, see models.ItemHistory
+
+Every sample is four zigzag varints, the seconds since the previous sample and
+the changes of score, comment count and rank. A sample every 10 minutes
+takes about 5 bytes, so appending a sample is appending bytes to the series.
+Missing values are stored as 0, others as value + 1.
+"""
+import calendar
+from datetime import datetime
+
+def to_seconds(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+def zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def unzigzag(z):
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+def encode(samples, last=None):
+    """
+    Encode samples of (datetime, score, comment_cnt, rank) following the `last`
+    sample of the series, None if it's the first one, returns a str
+    """
+    out = bytearray()
+    prev = (to_seconds(last[0]),) + tuple(0 if v is None else v + 1 for v in last[1:]) if last else (0, 0, 0, 0)
+    for sample in samples:
+        values = (to_seconds(sample[0]),) + tuple(0 if v is None else v + 1 for v in sample[1:])
+        for value, before in zip(values, prev):
+            n = zigzag(value - before)
+            while n >= 0x80:
+                out.append(n & 0x7f | 0x80)
+                n >>= 7
+            out.append(n)
+        prev = values
+    return str(out)
+
+def decode(data):
+    """Samples of (datetime, score, comment_cnt, rank) of a series"""
+    data = bytearray(data)
+    samples = []
+    values, sample = [0, 0, 0, 0], []
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        i = len(sample)
+        values[i] += unzigzag(n)
+        sample.append(values[i])
+        n = shift = 0
+        if len(sample) == 4:
+            samples.append((datetime.utcfromtimestamp(sample[0]),) +
+                           tuple(None if v == 0 else v - 1 for v in sample[1:]))
+            sample = []
+    return samples
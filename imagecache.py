@@ -0,0 +1,60 @@
+"""
+Bodies of the images asked for most, kept in every worker within a byte budget,
+so the thumbnails of the front page are not read from the database, or the
+image store, again and again. Images never change under their md5 ids, entries
+are only evicted, least recently used first.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+# body is None when only the content type is worth keeping, e.g. nginx sends the file
+CachedImage = namedtuple('CachedImage', 'content_type body')
+
+# Charged for every entry, with or without a body
+ENTRY_OVERHEAD = 256
+
+class ImageCache(object):
+
+    def __init__(self, max_bytes, max_body_bytes=None):
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        # A few large images should not push all the thumbnails out
+        self.max_body_bytes = max_body_bytes or max_bytes // 8
+        self.size = 0
+        self.hits = self.misses = 0
+
+    def cost(self, image):
+        return ENTRY_OVERHEAD + (len(image.body) if image.body is not None else 0)
+
+    def get(self, img_id):
+        with self.lock:
+            image = self.images.pop(img_id, None)
+            if image is None:
+                self.misses += 1
+                return None
+            # Most recently used last
+            self.images[img_id] = image
+            self.hits += 1
+            return image
+
+    def put(self, img_id, content_type, body):
+        """Returns False if `body` is too large to be kept"""
+        if body is not None and len(body) > self.max_body_bytes:
+            return False
+        image = CachedImage(content_type, body)
+        with self.lock:
+            old = self.images.pop(img_id, None)
+            if old is not None:
+                self.size -= self.cost(old)
+            self.images[img_id] = image
+            self.size += self.cost(image)
+            while self.size > self.max_bytes:
+                _, oldest = self.images.popitem(last=False)
+                self.size -= self.cost(oldest)
+        return True
+
+    def stats(self):
+        with self.lock:
+            return dict(images=len(self.images), bytes=self.size, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses)
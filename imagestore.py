@@ -0,0 +1,75 @@
+"""
+A content-addressed directory tree of images, keyed by their md5 ids, e.g.
+IMAGE_STORE_DIR/d4/1d/d41d8cd98f00b204e9800998ecf8427e
+Only metadata of images stay in the database when it's enabled, see models.Image
+"""
+import os
+import time
+import errno
+import logging
+import tempfile
+
+from config import IMAGE_STORE_DIR
+
+logger = logging.getLogger(__name__)
+
+enabled = bool(IMAGE_STORE_DIR)
+
+def relpath(img_id):
+    return os.path.join(img_id[:2], img_id[2:4], img_id)
+
+def path(img_id, root=None):
+    return os.path.join(root or IMAGE_STORE_DIR, relpath(img_id))
+
+def exists(img_id, root=None):
+    return os.path.isfile(path(img_id, root))
+
+def save(img_id, raw_data, root=None):
+    """Write it once, atomically, so readers never see a partial file"""
+    dest = path(img_id, root)
+    if os.path.isfile(dest):
+        return dest
+    dirname = os.path.dirname(dest)
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(raw_data)
+        os.rename(tmp, dest)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return dest
+
+def load(img_id, root=None):
+    with open(path(img_id, root), 'rb') as fp:
+        return fp.read()
+
+def delete(img_ids, root=None):
+    """Returns the number of files removed, missing ones are ignored"""
+    removed = 0
+    for img_id in img_ids:
+        try:
+            os.unlink(path(img_id, root))
+            removed += 1
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.exception('Failed to remove image %s', img_id)
+    return removed
+
+def stored_before(seconds, root=None):
+    """Ids of images written more than `seconds` ago, temporary files are left out"""
+    oldest = time.time() - seconds
+    for dirpath, _, filenames in os.walk(root or IMAGE_STORE_DIR):
+        for name in filenames:
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(dirpath, name)) < oldest:
+                    yield name
+            except OSError:  # deleted meanwhile
+                pass
@@ -1,58 +1,221 @@
+import os
 import logging
+import hashlib
 from time import time
+from functools import wraps
 from urlparse import urljoin
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from flask import (
     Flask, render_template, abort, request, send_file,
-    Response, jsonify, url_for
+    Response, jsonify, url_for, g, has_request_context, stream_with_context
 )
 from werkzeug.http import is_resource_modified
-from werkzeug.contrib.atom import AtomFeed
-from flask.ext.sqlalchemy import SQLAlchemy
+from werkzeug.contrib.atom import AtomFeed, FeedEntry
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import dbpool
+from pagecache import PageCache
+from search import SearchIndex, WorkerLock
+from imagecache import ImageCache, CachedImage
+from page_content_extractor.utils import ttl_cache
 
 app = Flask(__name__)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = dbpool.MeteredSQLAlchemy(app)
 
 from ago import human
 # Avoid circular imports
 # from models import HackerNews, StartupNews, Image
 import models
+import imagestore
 
 logger = logging.getLogger(__name__)
 
-@app.route("/hackernews")
-@app.route('/')
-def hackernews():
-    dt = models.LastUpdated.get('hackernews')
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_queries(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = getattr(g, 'query_count', 0) + 1
+
+@app.after_request
+def report_query_count(response):
+    query_count = getattr(g, 'query_count', 0)
+    logger.debug('%s queries for %s', query_count, request.path)
+    if not app.config['EXPOSE_INTERNALS']:
+        return response
+    response.headers['X-Query-Count'] = str(query_count)
+    # Time spent waiting for connections from the pool
+    response.headers['X-DB-Wait'] = '%.1fms' % (getattr(g, 'db_wait', 0) * 1000)
+    return response
+
+def internal(view):
+    """Views telling how workers are doing, not found unless EXPOSE_INTERNALS, see config"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['EXPOSE_INTERNALS']:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics/db')
+@internal
+def db_metrics():
+    """Connection pool of this worker, checkout waits are counted since it started"""
+    return jsonify(**dbpool.stats.snapshot(db.engine.pool))
+
+def read_only(view):
+    """Let the view read from the replica, if it's configured and has caught up"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        db.use_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+def news_query(model):
+    """Items with the urls of their images joined in, but not image blobs"""
+    return model.query.options(db.joinedload(model.image).load_only('id', 'url'))
+
+# Rendered once per update, see pagecache.py
+page_cache = PageCache()
+
+def render_front_page(site, last_updated):
+    model = {'hackernews': models.HackerNews, 'startupnews': models.StartupNews}[site]
+    return render_template('%s.html' % site,
+                           news_list=news_query(model).order_by('rank').all(),
+                           last_updated=last_updated)
+
+def front_page(site):
+    dt = models.LastUpdated.get(site)
     if dt and not is_resource_modified(request.environ, None, None, last_modified=dt):
         return Response(status=304)
-    resp = Response(render_template(
-                'hackernews.html',
-                news_list=models.HackerNews.query.order_by('rank').all(),
-                last_updated=dt))
+    # Pages have absolute urls in them
+    page = page_cache.get((site, request.host_url), dt, lambda: render_front_page(site, dt))
+    resp = cached_response(page, 'text/html')
+    resp.set_etag(page.etag_of(resp.headers.get('Content-Encoding', 'identity')))
     set_cache(resp, dt)
+    return resp.make_conditional(request)
+
+def cached_response(page, mimetype):
+    """The variant of a cached page the client accepts, see pagecache.py"""
+    encoding = page.negotiate(request.accept_encodings)
+    resp = Response(page.bodies[encoding], mimetype=mimetype)
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
     return resp
 
+def warm_front_page(site):
+    """Render pages of `site` just updated for the hosts seen, before anyone asks for them"""
+    dt = models.LastUpdated.get(site)
+    for cached_site, host_url in page_cache.keys():
+        if cached_site != site:
+            continue
+        try:
+            with app.test_request_context('/', base_url=host_url):
+                page_cache.get((site, host_url), dt, lambda: render_front_page(site, dt))
+        except Exception:
+            logger.exception('Failed to warm the page of %s for %s', site, host_url)
+
+@app.route("/hackernews")
+@app.route('/')
+@read_only
+def hackernews():
+    return front_page('hackernews')
+
 @app.route("/startupnews")
+@read_only
 def startupnews():
-    dt = models.LastUpdated.get('startupnews')
-    if dt and not is_resource_modified(request.environ, None, None, last_modified=dt):
-        return Response(status=304)
-    resp = Response(render_template(
-                'startupnews.html',
-                news_list=models.StartupNews.query.order_by('rank').all(),
-                last_updated=dt))
-    set_cache(resp, dt)
-    return resp
+    return front_page('startupnews')
+
+# Hot images of this worker, see imagecache.py
+image_cache = ImageCache(app.config['IMAGE_CACHE_BYTES'])
+IMAGE_MAX_AGE = 864000
+
+@app.route('/metrics/images')
+@internal
+def image_metrics():
+    return jsonify(**image_cache.stats())
 
 @app.route('/img/<img_id>')
+@read_only
 def image(img_id):
-    if request.if_none_match or request.if_modified_since:
-        return Response(status=304)
-    img = models.Image.query.get_or_404(img_id)
-    return send_file(img.makefile(), img.content_type, cache_timeout=864000, conditional=True)
+    if image_is_fresh(img_id):
+        return image_not_modified(img_id)
+    return send_image(img_id)
+
+# Pages show them about 220px wide, see thumbnail.py
+@app.route('/img/<img_id>/thumbnail')
+@read_only
+def thumbnail_image(img_id):
+    """The WebP thumbnail if the client accepts it, or the JPEG/PNG one, or the original"""
+    variants = thumbnail_variants(img_id)
+    webp = any(mimetype == 'image/webp' and quality for mimetype, quality in request.accept_mimetypes)
+    variant = variants.get('image/webp') if webp else None
+    variant = variant or next((v for t, v in variants.iteritems() if t != 'image/webp'), img_id)
+    resp = image_not_modified(variant) if image_is_fresh(variant) else send_image(variant)
+    resp.vary.add('Accept')
+    return resp
+
+# Thumbnails are never changed once made, but images may have none until
+# `make thumbnails` runs, so those are looked up again
+@ttl_cache(maxsize=4096, ttl=24*60*60, keep=bool)
+def thumbnail_variants(img_id):
+    return models.Thumbnail.variants(img_id)
+
+def image_is_fresh(img_id):
+    # Ids are md5 of the bytes, an image never changes, so the copy of a client
+    # is fresh if it has our ETag. If-Modified-Since alone is not trusted, we
+    # keep no time to compare it with, it may be of another image at the same url
+    return request.if_none_match.contains_weak(img_id)
+
+def send_image(img_id):
+    cached = image_cache.get(img_id)
+    if cached is None:
+        # Blobs are in the database unless there is an image store
+        options = [] if imagestore.enabled else [db.undefer('raw_data')]
+        img = models.Image.query.options(*options).get_or_404(img_id)
+        stored_path = img.stored_path
+        if stored_path is None:
+            image_cache.put(img_id, img.content_type, img.raw_data)
+            return image_response(img_id, img.content_type, img.raw_data)
+        if app.config['IMAGE_X_ACCEL_PREFIX']:
+            image_cache.put(img_id, img.content_type, None)
+            cached = CachedImage(img.content_type, None)
+        else:
+            size = os.path.getsize(stored_path)
+            if size > image_cache.max_body_bytes:
+                # Too large to keep, sent from the file
+                resp = send_file(stored_path, img.content_type, add_etags=False)
+                return image_headers(resp, img_id).make_conditional(
+                    request, accept_ranges=True, complete_length=size)
+            body = imagestore.load(img_id)
+            image_cache.put(img_id, img.content_type, body)
+            return image_response(img_id, img.content_type, body)
+    if cached.body is None:
+        # nginx sends the file itself
+        resp = Response(mimetype=cached.content_type)
+        # urljoin would drop the last segment of a prefix without a trailing slash
+        resp.headers['X-Accel-Redirect'] = '%s/%s' % (app.config['IMAGE_X_ACCEL_PREFIX'].rstrip('/'),
+                                                      imagestore.relpath(img_id))
+        return image_headers(resp, img_id)
+    return image_response(img_id, cached.content_type, cached.body)
+
+def image_headers(resp, img_id):
+    resp.set_etag(img_id)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = IMAGE_MAX_AGE
+    resp.expires = int(time() + IMAGE_MAX_AGE)
+    return resp
+
+def image_not_modified(img_id):
+    return image_headers(Response(status=304), img_id)
+
+def image_response(img_id, content_type, body):
+    """The body itself is sent, only a Range of it is ever sliced"""
+    resp = Response(body, mimetype=content_type)
+    return image_headers(resp, img_id).make_conditional(
+        request, accept_ranges=True, complete_length=len(body))
 
 @app.route('/update/hackernews', methods=['POST'], defaults={'site': 'hackernews'})
 @app.route('/update/startupnews', methods=['POST'], defaults={'site': 'startupnews'})
@@ -68,54 +231,247 @@ def update(site):
     if site == 'hackernews' or site is None:
         stats['hackernews'] = HackerNews().update(force)
         models.LastUpdated.update('hackernews')
+        warm_front_page('hackernews')
+        warm_search_index('hackernews')
     if site == 'startupnews' or site is None:
         stats['startupnews'] = StartupNews().update(force)
         models.LastUpdated.update('startupnews')
+        warm_front_page('startupnews')
+        warm_search_index('startupnews')
+    if site is None:
+        stats['archives_dropped'] = models.Archive.drop_expired()
+        stats['histories_removed'] = models.ItemHistory.remove_expired()
+        # Only after all sites are updated, so images just saved are referred to
+        stats['images_removed'] = models.Image.collect_garbage()
     return jsonify(**stats)
 
+# e.g. /archive/hackernews/2015-01-01?after=2015-01-01T12:00:00.000000,42
+@app.route('/archive/<site>/<day>')
+@read_only
+def archive(site, day):
+    if site not in ('hackernews', 'startupnews'):
+        abort(404)
+    try:
+        day = datetime.strptime(day, '%Y-%m-%d')
+        after = request.args.get('after')
+        if after:
+            submit_time, id = after.split(',')
+            after = (datetime.strptime(submit_time, ARCHIVE_CURSOR_FORMAT), int(id))
+    except ValueError:
+        abort(400)
+    items = models.Archive.browse(site, day, after)
+    next_url = None
+    if len(items) == models.Archive.PAGE_SIZE:
+        last = items[-1]
+        next_url = url_for('archive', site=site, day=day.strftime('%Y-%m-%d'), _external=True,
+                           after='%s,%s' % (last.submit_time.strftime(ARCHIVE_CURSOR_FORMAT), last.id))
+    return jsonify(day=day.strftime('%Y-%m-%d'), next=next_url, items=[dict(
+        url=item.url,
+        title=item.title,
+        comhead=item.comhead,
+        score=item.score,
+        author=item.author,
+        submit_time=item.submit_time.isoformat(),
+        comment_cnt=item.comment_cnt,
+        comment_url=item.comment_url,
+        summary=item.summary,
+        img_url=item.img_id and url_for('image', img_id=item.img_id, _external=True),
+    ) for item in items])
+
+ARCHIVE_CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# e.g. /history/hackernews?url=http://a.com/&url=http://b.com/
+@app.route('/history/<site>')
+@read_only
+def item_history(site):
+    """Samples of [time, score, comment count, rank] of the items asked for"""
+    if site not in ('hackernews', 'startupnews'):
+        abort(404)
+    urls = request.args.getlist('url')[:100]
+    series = models.ItemHistory.series(site, urls)
+    return jsonify(dict((url, [(at.isoformat(), score, comment_cnt, rank)
+                                 for at, score, comment_cnt, rank in samples])
+                          for url, samples in series.iteritems()))
+
+# First pages of feeds with the default limit, until the site is updated again. Other
+# variants come straight from the query string, caching them would let any client evict
+# the common ones, so they are streamed uncached. Feeds miss more often than front pages,
+# so they are compressed faster.
+feed_cache = PageCache(max_pages=64, brotli_quality=5)
+FEED_PAGE_SIZE = 30
+FEED_MAX_PAGE_SIZE = 100
+FEED_CACHED_SCORES = frozenset((0, 50, 100, 150, 200, 300, 500))
+FEED_TITLES = {'hackernews': 'Hacker News Digest', 'startupnews': 'Startup News Digest'}
+
+# e.g. /feed?gte=100&contain=python&limit=30&before=2015-01-01T12:00:00.000000,http://a.com/
 @app.route('/startupnews/feed', defaults={'site': 'startupnews'})
 @app.route('/feed', defaults={'site': 'hackernews'})
+@read_only
 def feed(site):
-    gte = request.args.get('gte', 0)
     try:
-        gte = int(gte)
+        gte = int(request.args.get('gte', 0))
     except ValueError:
         gte = 0
-    substr = request.args.get('contain', '')
-    substr = '%' + substr + '%'
-    if site == 'hackernews':
-        title = 'Hacker News Digest'
-        news_list = models.HackerNews.query\
-            .filter(models.HackerNews.score>=gte)\
-            .filter(models.HackerNews.title.ilike(substr))\
-            .order_by('submit_time desc').all()
+    contain = request.args.get('contain', '')
+    try:
+        limit = min(max(int(request.args.get('limit', FEED_PAGE_SIZE)), 1), FEED_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = FEED_PAGE_SIZE
+    before = request.args.get('before')
+    if before:
+        try:
+            submit_time, url = before.split(',', 1)
+            before = (datetime.strptime(submit_time, ARCHIVE_CURSOR_FORMAT), url)
+        except ValueError:
+            abort(400)
+
+    dt = models.LastUpdated.get(site)
+    generation = (models.LastUpdated.generation(site), dt)
+    key = (request.host_url, site, gte, contain, limit, before)
+    # Known before anything is queried or rendered, the same for every encoding
+    etag = hashlib.sha1(repr((key, generation))).hexdigest()
+    if not is_resource_modified(request.environ, etag, None, last_modified=dt):
+        resp = Response(status=304)
     else:
-        title = 'Startup News Digest'
-        news_list = models.StartupNews.query\
-            .filter(models.StartupNews.score>=gte)\
-            .filter(models.StartupNews.title.ilike(substr))\
-            .order_by('submit_time desc').all()
-
-    feed = AtomFeed(title,
-                    updated=models.LastUpdated.get(site),
-                    feed_url=request.url,
+        cacheable = (not contain and not before and limit == FEED_PAGE_SIZE
+                     and gte in FEED_CACHED_SCORES)
+        page = feed_cache.peek(key, generation) if cacheable else None
+        if page is not None:
+            resp = cached_response(page, 'application/atom+xml')
+            resp.headers['X-Cache'] = 'hit'
+        else:
+            xml = generate_feed(site, gte, contain, limit, before, dt)
+            body = cache_feed(key, generation, xml) if cacheable else stream_feed(xml)
+            resp = Response(stream_with_context(body), mimetype='application/atom+xml')
+            resp.vary.add('Accept-Encoding')
+            resp.headers['X-Cache'] = 'miss' if cacheable else 'pass'
+    resp.set_etag(etag, weak=True)
+    resp.last_modified = dt
+    set_cache(resp, dt)
+    return resp
+
+def generate_feed(site, gte, contain, limit, before, dt):
+    """Pieces of the atom xml of a page of news, newest first"""
+    model = {'hackernews': models.HackerNews, 'startupnews': models.StartupNews}[site]
+    query = news_query(model).filter(model.score >= gte)
+    if contain:
+        query = query.filter(model.title.ilike('%' + contain + '%'))
+    if before:
+        query = query.filter(db.tuple_(model.submit_time, model.url) < db.tuple_(*before))
+    news_list = query.order_by(model.submit_time.desc(), model.url.desc()).limit(limit).all()
+
+    args = dict(gte=gte or None, contain=contain or None, limit=limit)
+    links = []
+    if len(news_list) == limit and news_list[-1].submit_time:
+        last = news_list[-1]
+        links.append(dict(rel='next', href=url_for(
+            'feed', site=site, _external=True,
+            before='%s,%s' % (last.submit_time.strftime(ARCHIVE_CURSOR_FORMAT), last.url), **args)))
+    feed_url = url_for('feed', site=site, _external=True, **args)
+    feed = AtomFeed(FEED_TITLES[site],
+                    updated=dt or datetime.utcnow(),
+                    feed_url=feed_url,
                     url=urljoin(request.url_root, url_for(site)),
+                    links=links,
                     author={
                         'name': 'polyrabbit',
                         'uri': 'https://github.com/polyrabbit/'}
                     )
-    for news in news_list:
-        feed.add(news.title,
-                 content=news.summary and 
-                 ('<img src="%s" style="width: 220px; float: left" />' % news.image.url if news.img_id else '') 
-                     + news.summary,
-                 author={
-                     'name': news.author,
-                     'uri': news.author_link
-                 } if news.author_link else (),
-                 url=news.url,
-                 updated=news.submit_time,)
-    return feed.get_response()
+    # Entries are turned into xml one by one as the response is sent
+    feed.entries = (FeedEntry(
+        news.title,
+        content=news.summary and
+        ('<img src="%s" style="width: 220px; float: left" />' %
+         url_for('thumbnail_image', img_id=news.img_id, _external=True) if news.img_id else '')
+            + news.summary,
+        author={
+            'name': news.author,
+            'uri': news.author_link
+        } if news.author_link else (),
+        url=news.url,
+        updated=news.submit_time or dt or datetime.utcnow(),
+        feed_url=feed_url) for news in news_list)
+    return feed.generate()
+
+def stream_feed(xml):
+    for piece in xml:
+        yield piece.encode('utf-8')
+
+def cache_feed(key, generation, xml):
+    """Stream the xml, and cache it once it's all sent"""
+    pieces = []
+    for piece in xml:
+        pieces.append(piece)
+        yield piece.encode('utf-8')
+    feed_cache.put(key, generation, u''.join(pieces))
+
+# Every worker searches its own index of each site, see search.py
+search_indexes = {'hackernews': SearchIndex(), 'startupnews': SearchIndex()}
+# One refresh at a time, others wait for it rather than read the same rows
+search_refresh_lock = WorkerLock()
+
+def search_index(site):
+    """The index of `site`, caught up with its last update"""
+    index = search_indexes[site]
+    generation = models.LastUpdated.generation(site)
+    if index.generation == generation:
+        return index
+    with search_refresh_lock:
+        if index.generation == generation:
+            return index
+        model = {'hackernews': models.HackerNews, 'startupnews': models.StartupNews}[site]
+        # Read in full before the index is locked, searches never wait for the database
+        items = model.query.with_entities(
+            model.url, model.title, model.summary, model.score, model.submit_time, model.comment_url).all()
+        archive = models.Archive
+        query = db.session.query(archive.id, archive.url, archive.title, archive.summary, archive.score,
+                                 archive.submit_time, archive.comment_url, archive.archived_at)\
+            .filter(archive.site == site)
+        # Rows archived at the same time as the last ones indexed are indexed again, it's harmless
+        if index.archived_until is not None:
+            query = query.filter(archive.archived_at >= index.archived_until)
+        expired_before = None
+        if models.archive_retention_days:
+            expired_before = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) \
+                - timedelta(days=models.archive_retention_days)
+        archived_rows = query.all()
+        changed, gone = index.sync_items(items)
+        archived, expired = index.add_archived(archived_rows, expired_before)
+        index.generation = generation
+        logger.info('Indexed %s of %s, %s items changed, %s gone, %s archived, %s expired',
+                    len(index), site, changed, gone, archived, expired)
+    return index
+
+def warm_search_index(site):
+    try:
+        search_index(site)
+    except Exception:
+        logger.exception('Failed to index %s', site)
+
+# e.g. /search?q=python&gte=100&limit=30
+@app.route('/startupnews/search', defaults={'site': 'startupnews'})
+@app.route('/search', defaults={'site': 'hackernews'})
+@read_only
+def search(site):
+    """Live and archived items having every word of `q`, newest first"""
+    q = request.args.get('q', '')
+    try:
+        gte = int(request.args.get('gte', 0))
+    except ValueError:
+        gte = 0
+    try:
+        limit = min(max(int(request.args.get('limit', FEED_PAGE_SIZE)), 1), FEED_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = FEED_PAGE_SIZE
+    docs = search_index(site).search(q, gte, limit)
+    return jsonify(q=q, items=[dict(
+        url=doc.url,
+        title=doc.title,
+        score=doc.score,
+        submit_time=doc.submit_time and doc.submit_time.isoformat(),
+        comment_url=doc.comment_url,
+        archived=doc.key[0] == 'archive',
+    ) for doc in docs])
 
 @app.add_template_filter
 def natural_datetime(dt, precisoin):
@@ -0,0 +1,71 @@
+-- Move hackernews and startupnews into one item table, told apart by site.
+-- Run it once with: psql $DATABASE_URL -f migrations/001_unified_items.sql
+-- Fresh databases need not, `make initdb` creates the item table directly.
+-- Running it again, or after `make initdb` has created the item table, is fine:
+-- every step is skipped when done, rows are only copied while the old tables exist.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS item (
+    site VARCHAR NOT NULL,
+    url VARCHAR NOT NULL,
+    rank INTEGER,
+    title VARCHAR,
+    comhead VARCHAR,
+    score INTEGER,
+    author VARCHAR,
+    author_link VARCHAR,
+    submit_time TIMESTAMP WITHOUT TIME ZONE,
+    comment_cnt INTEGER,
+    comment_url VARCHAR,
+    summary VARCHAR,
+    img_id VARCHAR REFERENCES image (id) ON DELETE CASCADE,
+    favicon VARCHAR,
+    PRIMARY KEY (site, url)
+);
+
+-- CREATE INDEX IF NOT EXISTS needs postgres 9.5
+DO $$
+BEGIN
+    -- Pages sort by rank
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = 'ix_item_site_rank') THEN
+        CREATE INDEX ix_item_site_rank ON item (site, rank);
+    END IF;
+    -- Feeds filter by score and sort by submit_time
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = 'ix_item_site_submit_time_score') THEN
+        CREATE INDEX ix_item_site_submit_time_score ON item (site, submit_time DESC, score);
+    END IF;
+
+    -- Once migrated they are views, see below. Rows the app may have written to
+    -- the item table already are kept.
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'hackernews' AND relkind = 'r') THEN
+        INSERT INTO item (site, url, rank, title, comhead, score, author, author_link, submit_time,
+                          comment_cnt, comment_url, summary, img_id, favicon)
+            SELECT 'hackernews', url, rank, title, comhead, score, author, author_link, submit_time,
+                   comment_cnt, comment_url, summary, img_id, favicon FROM hackernews old
+            WHERE NOT EXISTS (SELECT 1 FROM item WHERE site = 'hackernews' AND item.url = old.url);
+        DROP TABLE hackernews;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'startupnews' AND relkind = 'r') THEN
+        INSERT INTO item (site, url, rank, title, comhead, score, author, author_link, submit_time,
+                          comment_cnt, comment_url, summary, img_id, favicon)
+            SELECT 'startupnews', url, rank, title, comhead, score, author, author_link, submit_time,
+                   comment_cnt, comment_url, summary, img_id, favicon FROM startupnews old
+            WHERE NOT EXISTS (SELECT 1 FROM item WHERE site = 'startupnews' AND item.url = old.url);
+        DROP TABLE startupnews;
+    END IF;
+END
+$$;
+
+-- For readers still using the old tables, e.g. reports
+CREATE OR REPLACE VIEW hackernews AS
+    SELECT rank, title, url, comhead, score, author, author_link, submit_time,
+           comment_cnt, comment_url, summary, img_id, favicon
+    FROM item WHERE site = 'hackernews';
+CREATE OR REPLACE VIEW startupnews AS
+    SELECT rank, title, url, comhead, score, author, author_link, submit_time,
+           comment_cnt, comment_url, summary, img_id, favicon
+    FROM item WHERE site = 'startupnews';
+
+ANALYZE item;
+
+COMMIT;
@@ -1,11 +1,19 @@
+import time
 import logging
-# cStringIO won't let me set name attr on it
-from StringIO import StringIO
 import datetime
 from hashlib import md5
+from itertools import islice
 
+from sqlalchemy import event
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.sql import table, column
 from index import db
+from config import archive_retention_days, GENERATION_FILE, GENERATION_RESYNC
+import imagestore
+import history
+import thumbnail
+from generation import SharedGenerations
+from page_content_extractor import ExtractionResult
 
 logger = logging.getLogger(__name__)
 
@@ -13,12 +21,27 @@ session = db.session
 
 class HelperMixin(object):
 
+    @classmethod
+    def key_column(cls):
+        """Column telling rows of this class apart, the primary key unless overridden"""
+        return cls.__mapper__.primary_key[0]
+
+    @classmethod
+    def scope(cls):
+        """Criterion of rows of this class, for statements that do not go through cls.query"""
+        return db.true()
+
+    @classmethod
+    def identity(cls):
+        """Values every new row of this class gets"""
+        return {}
+
     @classmethod
     def add(cls, **kwargs):
         """
         Returns primary_key on success
         """
-        pk_name = cls.__mapper__.primary_key[0].name
+        pk_name = cls.key_column().name
         try:
             obj = cls(**kwargs)
             # TODO should I consider auto_commit?
@@ -35,51 +58,184 @@ class HelperMixin(object):
 
     @classmethod
     def update(cls, pk_value, **kwargs):
-        pk = cls.__mapper__.primary_key[0]
+        pk = cls.key_column()
         try:
             # NOTE should use filter, not filter_by
             cls.query.filter(pk==pk_value).update(kwargs)
             session.commit()
         except SQLAlchemyError:
-            logger.exception('Failed to update %s(%s)', cls.__tablename__, pk.name)
+            logger.exception('Failed to update %s(%s)', cls.__name__, pk.name)
             session.rollback()
 
     @classmethod
     def delete(cls, pk_value):
-        pk = cls.__mapper__.primary_key[0]
+        pk = cls.key_column()
         try:
             cls.query.filter(pk==pk_value).delete()
             session.commit()
         except SQLAlchemyError:
-            logger.exception('Failed to delete %s from %s', pk.name, cls.__tablename__)
+            logger.exception('Failed to delete %s from %s', pk.name, cls.__name__)
             session.rollback()
 
     @classmethod
-    def remove_except(cls, keys):
-        pk = cls.__mapper__.primary_key[0]
+    def remove_except(cls, keys, commit=True):
+        """
+        Removes all rows but `keys` in one statement, their images are left to
+        Image.collect_garbage. Pass `commit=False` to do it in a larger transaction,
+        errors are raised then.
+        """
+        pk = cls.key_column()
         try:
-            rcnt = -1
-            # if not keys:
-                  # TODO query.delete will fire a delete from, which won't delete
-                  # related image, have to delete them one by one
-            #     rcnt = cls.query.delete() - 1
-            # else:
-            for rcnt, obsolete in enumerate(cls.query.filter(~pk.in_(keys))):
-                session.delete(obsolete)
-            logger.info('Removed %s items from %s', rcnt+1, cls.__tablename__)
-            session.commit()
+            query = cls.query.filter(~pk.in_(keys)) if keys else cls.query
+            rcnt = query.delete(synchronize_session=False)
+            logger.info('Removed %s items from %s', rcnt, cls.__name__)
+            if commit:
+                session.commit()
+            return rcnt
         except SQLAlchemyError:
-            logger.exception('Failed to clean old urls in %s', cls.__tablename__)
+            if not commit:
+                raise
+            logger.exception('Failed to clean old urls in %s', cls.__name__)
             session.rollback()
-        finally:
-            return rcnt + 1
+        return 0
 
-class HackerNews(db.Model, HelperMixin):
-    __tablename__ = 'hackernews'
+    # Only written when a row is inserted, e.g. values parsed from "2 hours ago"
+    # get less precise as time goes by
+    insert_only_columns = ()
 
+    @classmethod
+    def snapshot(cls, keys):
+        """
+        Column values (except blobs of relationships) of existing rows in one SELECT,
+        keyed by their primary keys
+        """
+        pk = cls.key_column()
+        if not keys:
+            return {}
+        columns = cls.__table__.columns
+        rows = session.query(*columns).filter(cls.scope(), pk.in_(keys))
+        return dict((getattr(row, pk.name), row._asdict()) for row in rows)
+
+    @staticmethod
+    def coerce(column, value):
+        """Values are parsed as strings, convert them so they can be compared with stored ones"""
+        if isinstance(value, basestring) and isinstance(column.type, db.Integer):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        return value
+
+    @classmethod
+    def diff(cls, row, existing):
+        """Columns of `row` that differ from the `existing` one"""
+        changes = {}
+        for name, value in row.iteritems():
+            if name in cls.insert_only_columns:
+                continue
+            value = cls.coerce(cls.__table__.columns[name], value)
+            if value != existing[name]:
+                changes[name] = value
+        return changes
+
+    @classmethod
+    def bulk_upsert(cls, rows, existing=None):
+        """
+        Insert new rows and write only changed columns of existing ones, all in the
+        current transaction, the caller commits. A failing statement is retried row
+        by row, each in its own savepoint, so one bad row does not fail the others.
+        Returns stats of {'added': n, 'updated': n, 'unchanged': n, 'errors': [...]}
+        """
+        pk = cls.key_column()
+        table = cls.__table__
+        if existing is None:
+            existing = cls.snapshot([row[pk.name] for row in rows])
+        stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+
+        inserts = []
+        # Rows changing the same set of columns share an executemany
+        updates = {}
+        for row in rows:
+            if row[pk.name] not in existing:
+                values = dict((c.name, cls.coerce(c, row.get(c.name))) for c in table.columns)
+                values.update(cls.identity())
+                inserts.append(values)
+                continue
+            changes = cls.diff(row, existing[row[pk.name]])
+            if not changes:
+                stats['unchanged'] += 1
+                continue
+            changes['_pk'] = row[pk.name]
+            updates.setdefault(tuple(sorted(changes)), []).append(changes)
+
+        def write(params, stat, stmt=None):
+            try:
+                with session.begin_nested():
+                    if stmt is None:  # one multi-row INSERT
+                        session.execute(table.insert().values(params))
+                    else:  # executemany
+                        session.execute(stmt, params)
+                stats[stat] += len(params)
+                return
+            except SQLAlchemyError as e:
+                if len(params) == 1:
+                    key = params[0].get('_pk') or params[0].get(pk.name)
+                    logger.exception('Failed to write %s to %s', key, cls.__name__)
+                    stats['errors'].append('%s: %s' % (key, e))
+                    return
+            for param in params:
+                write([param], stat, stmt)
+
+        if inserts:
+            write(inserts, 'added')
+        for names, params in updates.iteritems():
+            # SET clause comes from the keys of params
+            write(params, 'updated', table.update().where(cls.scope()).where(pk == db.bindparam('_pk')))
+        logger.info('Upserted %s: %s', cls.__name__, stats)
+        return stats
+
+    @classmethod
+    def sync(cls, rows, existing=None, remove_stale=True):
+        """
+        Make the table hold exactly `rows` in one transaction, so readers never see
+        a half-updated list. Images, thumbnails and memos staged before, see
+        Image.stage, are committed, or rolled back, with it.
+        Returns stats like bulk_upsert, plus 'removed'.
+        """
+        pk = cls.key_column()
+        try:
+            stats = cls.bulk_upsert(rows, existing)
+            stats['removed'] = 0
+            if remove_stale:
+                stats['removed'] = cls.remove_except([row[pk.name] for row in rows], commit=False)
+            session.commit()
+            return stats
+        except SQLAlchemyError as e:
+            logger.exception('Failed to sync %s', cls.__name__)
+            session.rollback()
+            return {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'errors': [str(e)]}
+
+class SiteQuery(db.Query):
+    """Get items of a site by their urls, as when every site had its own table"""
+
+    def get(self, ident):
+        identity = self._mapper_zero().polymorphic_identity
+        if identity is not None and not isinstance(ident, tuple):
+            ident = (identity, ident)
+        return super(SiteQuery, self).get(ident)
+
+class Item(db.Model, HelperMixin):
+    """
+    News of all sites in one table, told apart by `site`.
+    Query them through the subclass of a site, e.g. HackerNews.query
+    """
+    __tablename__ = 'item'
+    query_class = SiteQuery
+
+    site = db.Column(db.String, primary_key=True)
+    url = db.Column(db.String, primary_key=True)
     rank = db.Column(db.Integer)
     title = db.Column(db.String)
-    url = db.Column(db.String, primary_key=True)
     comhead = db.Column(db.String)
     score = db.Column(db.Integer)
     author = db.Column(db.String)
@@ -91,35 +247,355 @@ class HackerNews(db.Model, HelperMixin):
     img_id = db.Column(db.String, db.ForeignKey('image.id', ondelete='CASCADE'))
     favicon = db.Column(db.String)
 
-    image = db.relationship('Image', cascade='delete')
+    image = db.relationship('Image')
+
+    __mapper_args__ = {'polymorphic_on': site}
+    __table_args__ = (
+        # Pages sort by rank
+        db.Index('ix_item_site_rank', site, rank),
+        # Feeds filter by score and sort by submit_time
+        db.Index('ix_item_site_submit_time_score', site, submit_time.desc(), score),
+    )
+
+    insert_only_columns = ('submit_time',)
+
+    @classmethod
+    def key_column(cls):
+        return cls.__table__.c.url
+
+    @classmethod
+    def scope(cls):
+        return cls.__table__.c.site == cls.__mapper__.polymorphic_identity
+
+    @classmethod
+    def identity(cls):
+        return {'site': cls.__mapper__.polymorphic_identity}
+
+    @classmethod
+    def remove_except(cls, keys, commit=True):
+        """Items off the page are moved to the archive, unless it's disabled"""
+        if archive_retention_days:
+            try:
+                Archive.move_from(cls, keys)
+            except SQLAlchemyError:
+                if not commit:
+                    raise
+                logger.exception('Failed to archive %s', cls.__name__)
+                session.rollback()
+                return 0
+        return super(Item, cls).remove_except(keys, commit)
+
+    @classmethod
+    def bulk_upsert(cls, rows, existing=None):
+        """Appends a sample of every row to its history too, in the same transaction"""
+        stats = super(Item, cls).bulk_upsert(rows, existing)
+        try:
+            with session.begin_nested():
+                ItemHistory.append(cls, [row for row in rows if row.get('url')])
+        except SQLAlchemyError as e:
+            logger.exception('Failed to append history of %s', cls.__name__)
+            stats['errors'].append('history: %s' % e)
+        return stats
 
     def __repr__(self):
         return u"%s<%s>" % (self.title, self.url)
 
-# TODO too verbose to define two times,
-# find a better way
-class StartupNews(db.Model, HelperMixin):
-    __tablename__ = 'startupnews'
+class HackerNews(Item):
+    __mapper_args__ = {'polymorphic_identity': 'hackernews'}
 
+class StartupNews(Item):
+    __mapper_args__ = {'polymorphic_identity': 'startupnews'}
+
+class Archive(db.Model):
+    """
+    Items off the page, the table is empty itself, rows live in tables of
+    their submit days, e.g. archive_20150101, which inherit it. Dropping a
+    day is then cheap, and the CHECK constraint of every day lets postgres
+    skip days out of the range queried.
+    """
+    __tablename__ = 'archive'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    site = db.Column(db.String, nullable=False)
+    url = db.Column(db.String, nullable=False)
     rank = db.Column(db.Integer)
     title = db.Column(db.String)
-    url = db.Column(db.String, primary_key=True)
     comhead = db.Column(db.String)
     score = db.Column(db.Integer)
     author = db.Column(db.String)
     author_link = db.Column(db.String)
-    submit_time = db.Column(db.DateTime)
+    submit_time = db.Column(db.DateTime, nullable=False)
     comment_cnt = db.Column(db.Integer)
     comment_url = db.Column(db.String)
     summary = db.Column(db.String)
-    img_id = db.Column(db.String, db.ForeignKey('image.id', ondelete='CASCADE'))
+    # No foreign key, they are not inherited, see Image.collect_garbage
+    img_id = db.Column(db.String)
     favicon = db.Column(db.String)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    PARTITION_PREFIX = 'archive_'
+    PAGE_SIZE = 30
+
+    @classmethod
+    def partition_name(cls, day):
+        return cls.PARTITION_PREFIX + day.strftime('%Y%m%d')
+
+    @classmethod
+    def partitions(cls):
+        """Names of days in the archive, oldest first"""
+        rows = session.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent ORDER BY c.relname", {'parent': cls.__tablename__})
+        return [row[0] for row in rows]
+
+    @classmethod
+    def ensure_partition(cls, day):
+        name = cls.partition_name(day)
+        if session.execute("SELECT 1 FROM pg_class WHERE relname = :name", {'name': name}).scalar():
+            return name
+        lo, hi = day.strftime('%Y-%m-%d'), (day + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+        # Names and bounds come from dates, safe to be formatted in
+        session.execute("CREATE TABLE IF NOT EXISTS %s (CHECK (submit_time >= '%s' AND submit_time < '%s')) "
+                        "INHERITS (%s)" % (name, lo, hi, cls.__tablename__))
+        # CREATE INDEX IF NOT EXISTS needs postgres 9.5, the table may be made by another process meanwhile
+        index = '%s_site_submit_time_id' % name
+        if not session.execute("SELECT 1 FROM pg_class WHERE relname = :name", {'name': index}).scalar():
+            session.execute("CREATE INDEX %s ON %s (site, submit_time DESC, id DESC)" % (index, name))
+        return name
 
-    image = db.relationship('Image', cascade='delete')
+    @classmethod
+    def move_from(cls, item_class, keys):
+        """
+        Copy items of `item_class` but `keys` to the days they were submitted,
+        in the current transaction, the caller deletes them from the live table.
+        Items back on the page and off it again are archived once.
+        """
+        now = datetime.datetime.utcnow()
+        items = Item.__table__
+        stale = db.and_(item_class.scope(), ~items.c.url.in_(keys)) if keys else item_class.scope()
+        # Items without a submit time are archived as submitted now, they would fall
+        # in no day and be selected again on every update otherwise
+        submit_time = db.func.coalesce(items.c.submit_time, now)
+        undated = session.query(db.func.count()).select_from(items)\
+            .filter(stale, items.c.submit_time == None).scalar()
+        if undated:
+            logger.info('%s items of %s have no submit time, archived as of %s',
+                        undated, item_class.__name__, now)
+        days = session.query(db.func.date_trunc('day', submit_time)).filter(stale).distinct().all()
+        names = [c.name for c in cls.__table__.columns if c.name not in ('id', 'submit_time', 'archived_at')]
+        moved = 0
+        for (day,) in days:
+            partition = table(cls.ensure_partition(day),
+                              *[column(name) for name in names + ['submit_time', 'archived_at']])
+            # submit_time is never updated, so an archived copy is in the same day,
+            # found through its index
+            archived = db.exists().where(partition.c.site == items.c.site)\
+                .where(partition.c.submit_time == submit_time).where(partition.c.url == items.c.url)
+            select = db.select([items.c[name] for name in names] + [submit_time, db.literal(now)])\
+                .where(stale).where(submit_time >= day)\
+                .where(submit_time < day + datetime.timedelta(days=1)).where(~archived)
+            moved += session.execute(partition.insert().from_select(
+                names + ['submit_time', 'archived_at'], select)).rowcount
+        logger.info('Archived %s items of %s', moved, item_class.__name__)
+        return moved
+
+    @classmethod
+    def drop_expired(cls, retention_days=None):
+        """Drop whole days older than `retention_days`, returns their names"""
+        # Never today, items were just moved into it
+        retention_days = max(retention_days or archive_retention_days, 1)
+        oldest = cls.partition_name(datetime.datetime.utcnow() - datetime.timedelta(days=retention_days))
+        dropped = []
+        try:
+            for name in cls.partitions():
+                if name < oldest:
+                    session.execute('DROP TABLE %s' % name)
+                    dropped.append(name)
+            session.commit()
+        except SQLAlchemyError:
+            logger.exception('Failed to drop expired archives')
+            session.rollback()
+            return []
+        logger.info('Dropped archives %s', dropped)
+        return dropped
+
+    @classmethod
+    def browse(cls, site, day, after=None, page_size=None):
+        """
+        Items of `site` submitted in `day`, newest first. Pass the (submit_time, id)
+        of the last item as `after` for the next page, no OFFSET is ever used.
+        """
+        query = cls.query.filter(cls.site == site,
+                                 cls.submit_time >= day,
+                                 cls.submit_time < day + datetime.timedelta(days=1))
+        if after:
+            query = query.filter(db.tuple_(cls.submit_time, cls.id) < db.tuple_(*after))
+        return query.order_by(cls.submit_time.desc(), cls.id.desc())\
+            .limit(page_size or cls.PAGE_SIZE).all()
 
     def __repr__(self):
         return u"%s<%s>" % (self.title, self.url)
 
+class ItemHistory(db.Model):
+    """
+    Score, comment count and rank of an item over time, one row per item,
+    its samples are delta-encoded into `data`, see history.py
+    """
+    __tablename__ = 'item_history'
+
+    site = db.Column(db.String, primary_key=True)
+    url = db.Column(db.String, primary_key=True)
+    samples = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    # The last sample, new ones are encoded relative to it
+    last_at = db.Column(db.DateTime, nullable=False)
+    last_score = db.Column(db.Integer)
+    last_comment_cnt = db.Column(db.Integer)
+    last_rank = db.Column(db.Integer)
+
+    @staticmethod
+    def sample_of(item_class, row):
+        values = []
+        for name in ('score', 'comment_cnt', 'rank'):
+            value = item_class.coerce(item_class.__table__.columns[name], row.get(name))
+            values.append(value if isinstance(value, (int, long)) else None)
+        return values
+
+    @classmethod
+    def append(cls, item_class, rows, now=None):
+        """
+        Append a sample of every row of `item_class`, with one SELECT, one multi-row
+        INSERT and one executemany UPDATE, in the current transaction, the caller commits
+        """
+        if not rows:
+            return 0
+        now = now or datetime.datetime.utcnow()
+        site = item_class.__mapper__.polymorphic_identity
+        t = cls.__table__
+        last = dict((row.url, row) for row in session.query(
+                        t.c.url, t.c.last_at, t.c.last_score, t.c.last_comment_cnt, t.c.last_rank)
+                    .filter(t.c.site == site, t.c.url.in_([row['url'] for row in rows])))
+        inserts, updates = [], []
+        for row in rows:
+            score, comment_cnt, rank = cls.sample_of(item_class, row)
+            prev = last.get(row['url'])
+            chunk = history.encode([(now, score, comment_cnt, rank)], prev and prev[1:])
+            if prev is None:
+                inserts.append(dict(site=site, url=row['url'], samples=1, data=chunk, last_at=now,
+                                    last_score=score, last_comment_cnt=comment_cnt, last_rank=rank))
+            else:
+                updates.append(dict(_url=row['url'], _chunk=chunk, _score=score,
+                                    _comment_cnt=comment_cnt, _rank=rank))
+        if inserts:
+            session.execute(t.insert().values(inserts))
+        if updates:
+            session.execute(t.update().where(t.c.site == site).where(t.c.url == db.bindparam('_url'))
+                            .values(data=t.c.data.op('||')(db.bindparam('_chunk', type_=db.LargeBinary)),
+                                    samples=t.c.samples + 1,
+                                    last_at=now,
+                                    last_score=db.bindparam('_score'),
+                                    last_comment_cnt=db.bindparam('_comment_cnt'),
+                                    last_rank=db.bindparam('_rank')), updates)
+        return len(rows)
+
+    @classmethod
+    def series(cls, site, urls):
+        """{url: [(datetime, score, comment_cnt, rank), ...]} of `urls` of `site`, in one SELECT"""
+        if not urls:
+            return {}
+        t = cls.__table__
+        rows = session.query(t.c.url, t.c.data).filter(t.c.site == site, t.c.url.in_(urls))
+        return dict((url, history.decode(data)) for url, data in rows)
+
+    @classmethod
+    def remove_expired(cls, retention_days=None):
+        """Histories of items not seen for `retention_days`, same as the archive by default"""
+        retention_days = archive_retention_days if retention_days is None else retention_days
+        # Give items on the page a few missed updates
+        oldest = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days, minutes=30)
+        try:
+            removed = session.query(cls).filter(cls.last_at < oldest).delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            logger.exception('Failed to remove expired histories')
+            session.rollback()
+            return 0
+        logger.info('Removed %s histories', removed)
+        return removed
+
+    def __repr__(self):
+        return u"%s<%s>" % (self.url, self.samples)
+
+class Thumbnail(db.Model):
+    """
+    Display-sized derivatives of an image, see thumbnail.py. They are images
+    themselves, content-addressed and stored the same way, kept alive by the
+    rows here, which are gone with the original.
+    """
+    __tablename__ = 'thumbnail'
+
+    image_id = db.Column(db.String, db.ForeignKey('image.id', ondelete='CASCADE'), primary_key=True)
+    content_type = db.Column(db.String, primary_key=True)
+    img_id = db.Column(db.String, db.ForeignKey('image.id', ondelete='CASCADE'), nullable=False)
+
+    @classmethod
+    def make(cls, image_id, raw_data, commit=True):
+        """
+        Make the derivatives of the image `image_id` if there are none yet, returns their
+        number. Pass `commit=False` to leave them in the current transaction, e.g. the one
+        of Item.sync, they are in a savepoint, so failing ones are dropped alone.
+        """
+        if not thumbnail.enabled or cls.query.filter_by(image_id=image_id).first():
+            return 0
+        raw_data = raw_data if isinstance(raw_data, basestring) else raw_data[:]
+        made = 0
+        try:
+            with session.begin_nested():
+                for content_type, data in thumbnail.make(raw_data):
+                    img_id = Image.stage(None, content_type, data)
+                    session.merge(cls(image_id=image_id, content_type=content_type, img_id=img_id))
+                    made += 1
+            if commit:
+                session.commit()
+        except SQLAlchemyError:
+            logger.exception('Failed to save thumbnails of %s', image_id)
+            if commit:
+                session.rollback()
+            return 0
+        return made
+
+    @classmethod
+    def variants(cls, image_id):
+        """Ids of the derivatives of `image_id` by their content types"""
+        return dict(cls.query.with_entities(cls.content_type, cls.img_id).filter_by(image_id=image_id))
+
+    @classmethod
+    def backfill(cls, batch_size=50):
+        """
+        Make derivatives of images items refer to and have none, in batches
+        so that only a few of them are in memory at a time. Returns the number made.
+        """
+        if not thumbnail.enabled:
+            raise RuntimeError('Install Pillow to make thumbnails')
+        referred = db.or_(*[db.exists().where(owner.img_id == Image.id) for owner in (Item, Archive)])
+        made, last = 0, ''
+        while True:
+            ids = [row.id for row in session.query(Image.id).filter(Image.id > last, referred)
+                   .filter(~db.exists().where(cls.image_id == Image.id))
+                   .order_by(Image.id).limit(batch_size)]
+            for img_id in ids:
+                img = Image.query.get(img_id)
+                made += cls.make(img_id, img.read())
+            logger.info('Made %s thumbnails', made)
+            if len(ids) < batch_size:
+                break
+            last = ids[-1]
+        return made
+
+    def __repr__(self):
+        return u"%s<%s %s>" % (self.img_id, self.image_id, self.content_type)
+
 def md5_img(context):
     return md5(context.current_parameters['raw_data']).hexdigest()
 
@@ -129,46 +605,241 @@ class Image(db.Model, HelperMixin):
     id = db.Column(db.String, default=md5_img, primary_key=True)
     url = db.Column(db.String)
     content_type = db.Column(db.String)
-    raw_data = db.Column(db.LargeBinary)
+    # Only loaded when asked for, e.g. by undefer('raw_data'), listing news needs just the url
+    raw_data = db.deferred(db.Column(db.LargeBinary))
 
     def __init__(self, url, content_type, raw_data):
         self.url = url
         self.content_type = content_type
-        self.raw_data = raw_data
+        # psycopg2 only takes str, read memory-mapped bodies in
+        raw_data = raw_data if isinstance(raw_data, basestring) else raw_data[:]
+        self.id = md5(raw_data).hexdigest()
+        if imagestore.enabled:
+            # Only metadata goes to the database, the file is written when the row is
+            # inserted, see store_image, not for images already stored
+            self.data_to_store = raw_data
+        else:
+            self.raw_data = raw_data
 
     def __repr__(self):
         return u"%s<%s>" % (self.id, self.url)
 
-    def makefile(self):
-        file = StringIO(self.raw_data)
-        file.name = __file__
-        return file
+    @classmethod
+    def stage(cls, url, content_type, raw_data):
+        """
+        Add an image to the current transaction unless it is stored already, the
+        caller commits, e.g. Item.sync. Returns its id, errors are raised.
+        """
+        img = cls(url, content_type, raw_data)
+        if session.query(db.exists().where(cls.id == img.id)).scalar():
+            return img.id
+        try:
+            with session.begin_nested():
+                session.add(img)
+        except IntegrityError:
+            # Stored by another process meanwhile
+            pass
+        return img.id
+
+    # Tables whose rows keep images alive, ExtractionMemo does not count,
+    # its rows are gone with their images
+    owners = (Item, Archive, Thumbnail)
+
+    # Seconds a file in the image store may go without a row, e.g. while its
+    # update has not committed yet
+    STORE_GRACE = 60*60
+
+    @classmethod
+    def collect_garbage(cls, batch_size=500):
+        """
+        Delete images no item refers to, in batches so that locks are held shortly,
+        then files of the image store no image refers to, see sweep_store.
+        Should not run in parallel with an update, whose new images are not referred to yet.
+        Returns the number of deleted images.
+        """
+        orphans = session.query(cls.id).filter(db.and_(*[
+            ~db.exists().where(owner.img_id == cls.id) for owner in cls.owners
+        ])).limit(batch_size)
+        removed = 0
+        while True:
+            try:
+                ids = [row.id for row in orphans]
+                if ids:
+                    cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                session.commit()
+            except SQLAlchemyError:
+                logger.exception('Failed to collect garbage images')
+                session.rollback()
+                break
+            if imagestore.enabled:
+                imagestore.delete(ids)
+            removed += len(ids)
+            if len(ids) < batch_size:
+                break
+        logger.info('Removed %s orphan images', removed)
+        if imagestore.enabled:
+            cls.sweep_store(batch_size)
+        return removed
+
+    @classmethod
+    def sweep_store(cls, batch_size=500):
+        """
+        Delete files of the image store without a row, e.g. written by an update that
+        was rolled back. Those younger than STORE_GRACE are left alone. Returns their number.
+        """
+        removed = 0
+        stored = imagestore.stored_before(cls.STORE_GRACE)
+        for ids in iter(lambda: list(islice(stored, batch_size)), []):
+            try:
+                known = set(row.id for row in session.query(cls.id).filter(cls.id.in_(ids)))
+            except SQLAlchemyError:
+                logger.exception('Failed to sweep the image store')
+                session.rollback()
+                break
+            removed += imagestore.delete([img_id for img_id in ids if img_id not in known])
+        logger.info('Removed %s orphan files from %s', removed, imagestore.IMAGE_STORE_DIR)
+        return removed
+
+    @classmethod
+    def move_to_store(cls, batch_size=50):
+        """
+        Move blobs in the database to the image store, in batches so that
+        only a few of them are in memory at a time. Returns the number moved.
+        """
+        if not imagestore.enabled:
+            raise RuntimeError('Set IMAGE_STORE_DIR to move images out of the database')
+        moved = 0
+        while True:
+            images = cls.query.options(db.undefer('raw_data'))\
+                .filter(cls.raw_data != None).limit(batch_size).all()
+            for img in images:
+                imagestore.save(img.id, img.raw_data)
+                img.raw_data = None
+            try:
+                session.commit()
+            except SQLAlchemyError:
+                logger.exception('Failed to move images to %s', imagestore.IMAGE_STORE_DIR)
+                session.rollback()
+                break
+            moved += len(images)
+            logger.info('Moved %s images to %s', moved, imagestore.IMAGE_STORE_DIR)
+            if len(images) < batch_size:
+                break
+        return moved
+
+    @property
+    def stored_path(self):
+        """Path in the image store, None if the blob is in the database"""
+        if imagestore.enabled and imagestore.exists(self.id):
+            return imagestore.path(self.id)
+        return None
+
+    def read(self):
+        """Bytes of the image, wherever they are"""
+        if self.stored_path is None:
+            return self.raw_data
+        return imagestore.load(self.id)
+
+@event.listens_for(Image, 'before_insert')
+def store_image(mapper, connection, img):
+    """Write the file of a new image to the image store, only now its row is being inserted"""
+    raw_data = getattr(img, 'data_to_store', None)
+    if raw_data is not None:
+        imagestore.save(img.id, raw_data)
+        img.data_to_store = None
+
+class ExtractionMemo(db.Model):
+    """
+    Extraction results keyed by the digest of page bodies, so unchanged pages
+    are not parsed again. Entries of an old extractor version are just never hit,
+    and get replaced once the same body is extracted by the new version.
+    """
+    __tablename__ = 'extraction_memo'
+
+    digest = db.Column(db.String, primary_key=True)
+    version = db.Column(db.String, primary_key=True)
+    summary = db.Column(db.String)
+    favicon = db.Column(db.String)
+    # Gone with its image, so we never refer to a deleted one
+    img_id = db.Column(db.String, db.ForeignKey('image.id', ondelete='CASCADE'))
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def lookup(cls, digest, version):
+        try:
+            memo = cls.query.get((digest, version))
+        except SQLAlchemyError:
+            logger.exception('Failed to look up memo %s', digest)
+            session.rollback()
+            return None
+        if memo is None:
+            return None
+        return ExtractionResult(None, memo.summary, memo.favicon, memo_key=(digest, version),
+                                memoized=True, img_id=memo.img_id)
+
+    @classmethod
+    def remember(cls, memo_key, summary, favicon, img_id=None, commit=True):
+        """Pass `commit=False` to leave it in the current transaction, see Thumbnail.make"""
+        digest, version = memo_key
+        try:
+            with session.begin_nested():
+                # Invalidate results of other versions lazily
+                cls.query.filter(cls.digest==digest, cls.version!=version).delete()
+                session.merge(cls(digest=digest, version=version, summary=summary,
+                                  favicon=favicon, img_id=img_id))
+            if commit:
+                session.commit()
+        except SQLAlchemyError:
+            logger.exception('Failed to remember %s', digest)
+            if commit:
+                session.rollback()
+
+    def __repr__(self):
+        return u"%s<%s>" % (self.digest, self.version)
 
 class LastUpdated(db.Model):
+    """
+    When sites were last updated, read through the shared generations of this
+    machine, the database is asked only once every GENERATION_RESYNC seconds
+    """
     __tablename__ = 'last_updated'
 
     table_name = db.Column(db.String, primary_key=True)
     time_stamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+    generations = SharedGenerations(GENERATION_FILE)
+
     def __init__(self, tn, ts):
         self.table_name = tn
         self.time_stamp = ts
 
     @classmethod
     def update(cls, tn):
-       session.merge(cls(tn, datetime.datetime.utcnow()))
+       ts = datetime.datetime.utcnow()
+       session.merge(cls(tn, ts))
        try:
             session.commit()
        except SQLAlchemyError:
            logger.exception('Failed to update %s', tn)
            session.rollback()
+           return
+       cls.generations.bump(tn, ts)
 
     @classmethod
     def get(cls, tn):
+        record = cls.generations.read(tn)
+        if record is not None and time.time() - record.synced_at < GENERATION_RESYNC:
+            return record.updated_at
         obj = cls.query.get(tn)
-        if obj:
-            return obj.time_stamp
-        return None
+        ts = obj.time_stamp if obj else None
+        cls.generations.sync(tn, ts)
+        return ts
+
+    @classmethod
+    def generation(cls, tn):
+        """Moves whenever `tn` is updated, 0 if it's not known yet"""
+        record = cls.generations.read(tn)
+        return record.generation if record else 0
 
     def __repr__(self):
         return u"%s<%s>" % (self.table_name, self.time_stamp)
@@ -176,13 +847,3 @@ class LastUpdated(db.Model):
 # gunicorn causes race condition when spawning multi processes
 # db.create_all()
 
-import threading, time
-def fun():
-    while True:
-        print '-'*10, db.engine.pool, db.engine.pool.status()
-        time.sleep(3)
-
-# t = threading.Thread(target=fun)
-# t.daemon = True
-# t.start()
-
@@ -7,29 +7,83 @@ import logging
 import requests
 
 from .exceptions import ParseError
-from .html import HtmlContentExtractor
+from .utils import read_body, detect_encoding, current_rss, body_digest
+from .html import HtmlContentExtractor, cap_html
+from .webimage import WebImage
+from .result import ExtractionResult, Illustration
 from .embeddable import EmbeddableExtractor
 from .pdf import PdfExtractor
+from .ml import MLContentExtractor
+from .rawstore import RawStore
 
-__all__ = ['ParseError', 'legendary_parser_factory']
+__all__ = ['ParseError', 'legendary_parser_factory', 'extract', 'extract_batch', 'ExtractionResult',
+           'RawStore']
 
 logger = logging.getLogger(__name__)
 
+# Bump it whenever extractors change their outputs, so memoized results are not reused
+EXTRACTOR_VERSION = '1'
+
+def extractor_version(extractor, max_length):
+    """Results of different versions, engines or summary lengths never share a memo"""
+    return '%s/%s/%s' % (EXTRACTOR_VERSION, extractor.__name__, max_length)
+
+# Engines to find the main content of html pages
+html_extractors = {
+    'heuristic': HtmlContentExtractor,
+    'ml': MLContentExtractor,
+}
+
+def get_html_extractor(mode):
+    extractor = html_extractors.get(mode, HtmlContentExtractor)
+    if not getattr(extractor, 'available', True):
+        logger.warning('%s extractor is not available, fall back to the heuristic one', mode)
+        extractor = HtmlContentExtractor
+    return extractor
+
 # dispatcher
-def legendary_parser_factory(url):
+def fetch_page(url):
+    # Sad, urllib2 cannot handle cookie/gzip automatically
+    # Streamed, so large pdfs can be spooled to disk instead of the heap
+    return requests.get(url, stream=True)
+
+def store_body(store, url, resp, body):
+    try:
+        store.put(url, resp, body)
+    except (IOError, OSError):
+        logger.exception('Failed to store the body of %s', url)
+
+def legendary_parser_factory(url, mode='heuristic', low_memory=False, memo=None,
+                             store=None, fetch=fetch_page, defer=False):
     """
         Returns the extracted object, which should have at least two
-        methods `get_summary` and `get_illustration`
+        methods `get_summary` and `get_illustration`,
+        `mode` picks the html engine, see `html_extractors`,
+        `low_memory` caps the size of html pages before parsing,
+        `memo(digest, extractor)` is asked for a result before parsing a body fetched from a url,
+        `store` keeps fetched bodies, see RawStore,
+        `fetch(url)` returns a streamed response, e.g. RawStore.replay to work offline,
+        `defer` leaves html pages of engines with `score_batch` unscored, see extract_batch
     """
-    if not url.startswith('http'):
+    if not url.startswith(('http', 'file://')):
         url = 'http://' + url
-    # Sad, urllib2 cannot handle cookie/gzip automatically
-    resp = requests.get(url)
-
     if EmbeddableExtractor.is_embeddable(url):
-        logger.info('Get an embeddable to parse(%s)', resp.url)
+        logger.info('Get an embeddable to parse(%s)', url)
         try:
-            return EmbeddableExtractor(resp.text, resp.url)
+            # No need to fetch the page, the url is enough
+            return EmbeddableExtractor(None, url)
+        except Exception as e:
+            logger.info('%s is not an embeddable, try another(%s)', url, e)
+
+    resp = fetch(url)
+
+    # Decode the page only once, see utils.my_build_response for how the encoding is found
+    html = None
+    if resp.url != url and EmbeddableExtractor.is_embeddable(resp.url):
+        logger.info('Redirected to an embeddable(%s)', resp.url)
+        try:
+            html = resp.text
+            return EmbeddableExtractor(html, resp.url)
         except Exception as e:
             logger.info('%s is not an embeddable, try another(%s)', resp.url, e)
 
@@ -37,13 +91,128 @@ def legendary_parser_factory(url):
     ct = resp.headers.get('content-type', 'text').lower()
     if ct.startswith('text'):
         logger.info('Get an %s to parse', ct)
-        return HtmlContentExtractor(resp.text, resp.url)
+        if html is None:
+            if resp.encoding is None:  # no content-type at all, never let requests guess on the whole body
+                resp.encoding = detect_encoding(resp.headers, resp.content)
+            html = resp.text
+        if store is not None:
+            store_body(store, url, resp, resp.content)
+        extractor = get_html_extractor(mode)
+        # Favicons and images are resolved against the url, the same bytes elsewhere,
+        # e.g. a parked domain page or a challenge of a CDN, are another result
+        memoized = memo and memo(body_digest(html, resp.url), extractor)
+        if memoized:
+            return memoized
+        if low_memory:
+            html = cap_html(html)
+        if defer and hasattr(extractor, 'score_batch'):
+            return extractor(html, resp.url, defer=True)
+        return extractor(html, resp.url)
     elif ct.startswith('application/pdf'):
         logger.info('Get a pdf to parse, %s', resp.url)
         try:
-            return PdfExtractor(resp.content, resp.url)
-        except ParseError:
+            raw_data = read_body(resp, max_size=PdfExtractor.MAX_BYTES)
+            if store is not None:
+                store_body(store, url, resp, raw_data)
+            memoized = memo and memo(body_digest(raw_data, resp.url), PdfExtractor)
+            if memoized:
+                return memoized
+            return PdfExtractor(raw_data, resp.url)
+        except (ParseError, IOError):
             logger.exception('Failed to parse this pdf file, %s', resp.url)
 
+    resp.close()
     raise TypeError('I have no idea how the %s is formatted' % ct)
 
+
+def open_parser(url, max_length, mode, low_memory, memo, store, fetch, defer=False):
+    """The parser of `url`, or a memoized result, and the memo key looked up"""
+    keys = []
+    def lookup(digest, extractor):
+        keys.append((digest, extractor_version(extractor, max_length)))
+        return memo.lookup(*keys[-1])
+
+    parser = legendary_parser_factory(url, mode, low_memory, memo and lookup, store, fetch, defer)
+    return parser, keys and keys[-1] or None
+
+def finish(url, parser, memo_key, max_length, low_memory, rss_before):
+    """
+        ExtractionResult of a parser whose main content is found, `rss_before`
+        is the current_rss before the page was fetched
+    """
+    if isinstance(parser, ExtractionResult):
+        logger.info('Memoized result of %s is found', url)
+        parser.url = url
+        parser.rss_delta = current_rss() - rss_before
+        return parser
+    try:
+        summary = parser.get_summary(max_length)
+        favicon = parser.get_favicon_url()
+        img = parser.get_illustration()
+        result = ExtractionResult(url, summary, favicon,
+                                  img and Illustration.from_webimage(img),
+                                  memo_key=memo_key)
+    finally:
+        if low_memory:
+            doc = getattr(parser, 'doc', None)
+            if doc is not None:
+                doc.decompose()
+            WebImage.from_attrs.cache_clear()
+        del parser
+    result.rss_delta = current_rss() - rss_before
+    logger.info('RSS grew by %sKB extracting %s', result.rss_delta, url)
+    return result
+
+def extract(url, max_length, mode='heuristic', low_memory=False, memo=None,
+            store=None, fetch=fetch_page):
+    """
+        Returns an ExtractionResult. In the `low_memory` mode the input is capped,
+        and the parse tree and cached images are released right after extraction.
+        `memo.lookup(digest, version)` returns results stored for identical bodies,
+        the key looked up is kept in `memo_key` so the caller can store a new one,
+        see models.ExtractionMemo, see legendary_parser_factory for `store` and `fetch`
+    """
+    rss_before = current_rss()
+    parser, memo_key = open_parser(url, max_length, mode, low_memory, memo, store, fetch)
+    return finish(url, parser, memo_key, max_length, low_memory, rss_before)
+
+def extract_batch(urls, max_length, mode='heuristic', low_memory=False, memo=None,
+                  store=None, fetch=fetch_page):
+    """
+        Extract the pages of a whole update cycle, returns a list of an ExtractionResult,
+        or the exception raised, for every url. Html pages of engines with `score_batch`,
+        e.g. the ml one, are kept until all pages are fetched and scored together at once,
+        others are extracted right away. In the `low_memory` mode no tree is kept, every
+        page is scored by itself. The rss_delta of a deferred page leaves out
+        the batch scoring, which is shared by all of them. See extract for the
+        other arguments.
+    """
+    results, deferred = [], []
+    for i, url in enumerate(urls):
+        try:
+            rss_before = current_rss()
+            parser, memo_key = open_parser(url, max_length, mode, low_memory, memo, store, fetch,
+                                           defer=not low_memory)
+            if getattr(parser, 'defer', False):
+                deferred.append((i, url, parser, memo_key, current_rss() - rss_before))
+                results.append(None)
+            else:
+                results.append(finish(url, parser, memo_key, max_length, low_memory, rss_before))
+        except Exception as e:
+            logger.exception('Failed to extract %s', url)
+            results.append(e)
+    if deferred:
+        parsers = [parser for _, _, parser, _, _ in deferred]
+        type(parsers[0]).score_batch(parsers)
+        logger.info('Scored %s pages in one batch', len(parsers))
+        del parsers
+    while deferred:
+        i, url, parser, memo_key, opened = deferred.pop(0)
+        try:
+            results[i] = finish(url, parser, memo_key, max_length, low_memory,
+                                current_rss() - opened)
+        except Exception as e:
+            logger.exception('Failed to extract %s', url)
+            results[i] = e
+        del parser
+    return results
@@ -0,0 +1,266 @@
+#coding: utf-8
+"""
+Extract summaries of many pages at once, on all cores
+
+    python -m page_content_extractor.batch [options] SOURCE...
+
+A source is a url, an html/pdf file, a directory of them, a WARC archive
+(.warc or .warc.gz, its http responses are extracted), or @FILE listing
+sources one per line (@- for stdin).
+
+Results are written as json lines, one per source, with the summary, favicon,
+illustration url, timings of each stage in ms and the error if any. Sources
+already in the output file are skipped, so an interrupted run can be resumed
+by running it again.
+"""
+import os
+import re
+import sys
+import zlib
+import gzip
+import json
+import signal
+import logging
+import argparse
+import mimetypes
+import multiprocessing
+from StringIO import StringIO
+from collections import deque
+from timeit import default_timer
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import legendary_parser_factory, extractor_version, fetch_page, RawStore
+from .utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+WARC_PATT = re.compile(r'\.warc(\.gz)?$', re.I)
+LOCAL_EXTENSIONS = ('.htm', '.html', '.pdf')
+
+def make_response(url, status, headers, raw):
+    """A streamed response as if it were from requests.get(url, stream=True)"""
+    resp = requests.models.Response()
+    resp.url = url
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers)
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.raw = raw
+    return resp
+
+def read_headers(fp):
+    headers = CaseInsensitiveDict()
+    for line in iter(fp.readline, ''):
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip()] = value.strip()
+    return headers
+
+def read_warc(path):
+    """Yields (record id, target uri, http response block) of response records"""
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    with opener(path, 'rb') as fp:
+        for line in iter(fp.readline, ''):
+            if not line.strip():
+                continue
+            if not line.startswith('WARC/'):
+                raise ValueError('%s is not a WARC file, got %r' % (path, line[:40]))
+            headers = read_headers(fp)
+            block = fp.read(int(headers['Content-Length']))
+            if headers.get('WARC-Type') == 'response' and \
+                    headers.get('Content-Type', '').startswith('application/http'):
+                yield headers['WARC-Record-ID'], headers['WARC-Target-URI'], block
+
+def dechunk(body):
+    chunks = []
+    fp = StringIO(body)
+    for line in iter(fp.readline, ''):
+        size = int(line.split(';', 1)[0].strip() or '0', 16)
+        if not size:
+            break
+        chunks.append(fp.read(size))
+        fp.readline()
+    return ''.join(chunks)
+
+def parse_http_response(url, block):
+    """Parse an http response recorded in a WARC into a response"""
+    fp = StringIO(block)
+    status = int(fp.readline().split()[1])
+    headers = read_headers(fp)
+    body = fp.read()
+    if 'chunked' in headers.pop('Transfer-Encoding', '').lower():
+        body = dechunk(body)
+    encoding = headers.pop('Content-Encoding', '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        body = zlib.decompress(body)
+    return make_response(url, status, headers, StringIO(body))
+
+def local_response(path):
+    content_type = mimetypes.guess_type(path)[0] or 'text/html'
+    return make_response('file://' + os.path.abspath(path), 200,
+                         {'Content-Type': content_type}, open(path, 'rb'))
+
+def expand_sources(sources):
+    """Yields jobs of (source, url, payload), see run_job for payloads"""
+    for source in sources:
+        if source.startswith('@'):
+            fp = sys.stdin if source == '@-' else open(source[1:])
+            lines = (line.strip() for line in fp)
+            for job in expand_sources(line for line in lines if line and not line.startswith('#')):
+                yield job
+        elif source.startswith(('http://', 'https://')):
+            yield source, source, None
+        elif os.path.isdir(source):
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(LOCAL_EXTENSIONS):
+                        path = os.path.join(dirpath, name)
+                        yield path, 'file://' + os.path.abspath(path), ('file', path)
+        elif WARC_PATT.search(source):
+            for record_id, url, block in read_warc(source):
+                yield '%s#%s' % (source, record_id), url, ('http', block)
+        elif os.path.isfile(source):
+            yield source, 'file://' + os.path.abspath(source), ('file', source)
+        else:  # a url without the scheme
+            yield source, source, None
+
+# Set in each worker by init_worker
+options = None
+
+def init_worker(opts):
+    global options
+    options = opts
+    # Let the parent handle ctrl-c
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def run_job(job):
+    """Extract one source, never raises"""
+    source, url, payload = job
+    record = {'source': source, 'url': url, 'extractor': None, 'version': None, 'summary': None,
+              'favicon': None, 'illustration': None, 'timings': {}, 'error': None}
+    timings = record['timings']
+
+    def fetch(url):
+        start = default_timer()
+        if payload is None:
+            resp = RawStore(options.raw_store).replay(url) if options.raw_store else fetch_page(url)
+        elif payload[0] == 'file':
+            resp = local_response(payload[1])
+        else:
+            resp = parse_http_response(url, payload[1])
+        # Pdfs are left streamed, to be spooled by the extractor
+        if resp.headers.get('content-type', 'text').lower().startswith('text'):
+            resp.content
+        timings['fetch'] = round((default_timer() - start) * 1000, 1)
+        return resp
+
+    stage = 'parse'
+    try:
+        start = default_timer()
+        parser = legendary_parser_factory(url, options.mode, options.low_memory, fetch=fetch)
+        timings['parse'] = round((default_timer() - start) * 1000 - timings.get('fetch', 0), 1)
+        record['url'] = getattr(parser, 'url', url)
+        record['extractor'] = type(parser).__name__
+        record['version'] = extractor_version(type(parser), options.max_length)
+        for stage, get in (('summary', lambda: parser.get_summary(options.max_length)),
+                           ('favicon', parser.get_favicon_url),
+                           ('illustration', parser.get_illustration)):
+            start = default_timer()
+            record[stage] = get()
+            timings[stage] = round((default_timer() - start) * 1000, 1)
+        record['illustration'] = record['illustration'] and record['illustration'].url
+    except Exception as e:
+        logger.info('Failed to extract %s', source, exc_info=True)
+        record['error'] = '%s in %s: %s' % (type(e).__name__, stage, e)
+    return record
+
+def load_done(output):
+    """Sources already in the output, a partially written last line is ignored"""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'rb') as fp:
+        for line in fp:
+            try:
+                done.add(json.loads(line)['source'])
+            except (ValueError, KeyError):
+                pass
+    return done
+
+def extract_all(jobs, opts, workers, maxtasksperchild=100):
+    """Yields records of jobs in order, extracted by a pool of `workers` processes"""
+    if workers == 1:  # in this process, easier to debug
+        init_worker(opts)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for job in jobs:
+            yield run_job(job)
+        return
+    pool = multiprocessing.Pool(workers, init_worker, (opts,), maxtasksperchild)
+    # Pool.imap reads its input all at once, keep a bounded window of jobs instead
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(run_job, (job,)))
+            while pending and (len(pending) >= workers*4 or pending[0].ready()):
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def run(sources, output=None, workers=None, mode='heuristic', max_length=250,
+        low_memory=False, raw_store=None):
+    """Returns (number of extracted sources, number of errors, number of skipped ones)"""
+    opts = argparse.Namespace(mode=mode, max_length=max_length, low_memory=low_memory,
+                              raw_store=raw_store)
+    done = load_done(output) if output else set()
+    jobs = (job for job in expand_sources(sources) if job[0] not in done)
+    out = open(output, 'ab') if output else sys.stdout
+    if output and os.path.getsize(output):
+        with open(output, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            if fp.read(1) != '\n':
+                out.write('\n')  # after a partially written line
+    extracted = errors = 0
+    try:
+        for record in extract_all(jobs, opts, workers or multiprocessing.cpu_count()):
+            out.write(json.dumps(record, sort_keys=True) + '\n')
+            out.flush()
+            extracted += 1
+            errors += record['error'] is not None
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info('Extracted %s sources with %s errors, skipped %s done before',
+                extracted, errors, len(done))
+    return extracted, errors, len(done)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract summaries of many pages into json lines')
+    parser.add_argument('sources', nargs='+', metavar='SOURCE',
+                        help='url, html/pdf file, directory, WARC archive or @FILE of sources')
+    parser.add_argument('-o', '--output', help='json lines file to append to and resume from, stdout by default')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes, all cores by default')
+    parser.add_argument('-m', '--mode', default='heuristic', help='html engine, heuristic or ml')
+    parser.add_argument('-l', '--max-length', type=int, default=250, help='summary length')
+    parser.add_argument('--low-memory', action='store_true', help='cap the size of html pages')
+    parser.add_argument('--raw-store', metavar='DIR', help='replay urls from this RawStore, offline')
+    args = parser.parse_args(argv)
+    extracted, errors, skipped = run(args.sources, args.output, args.jobs, args.mode,
+                                     args.max_length, args.low_memory, args.raw_store)
+    return 1 if errors and errors == extracted else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    logger.setLevel(logging.INFO)
+    sys.exit(main())
@@ -6,21 +6,33 @@ from urlparse import urljoin
 from urlparse import urlsplit
 import requests
 
-from bs4 import BeautifulSoup as BS
+from bs4 import BeautifulSoup as BS, SoupStrainer
 from .exceptions import ParseError
+from .utils import ttl_cache
 
 logger = logging.getLogger(__name__)
 
+@ttl_cache(maxsize=256, ttl=24*60*60)
+def fetch_oembed(endpoint, url):
+    r = requests.get(endpoint, params={'url': url, 'format': 'json'})
+    r.raise_for_status()
+    return r.json()
+
 class EmbeddableExtractor(object):
+    # Favicon urls by host, so an embeddable needs no fetching once its host is known
+    favicon_cache = {}
 
     def __init__(self, html, url):
+        """The summary depends on the url alone, `html` can be None"""
         host = urlsplit(url).hostname or ''
         provider = re.sub(r'^www\.', '', host.lower()).replace('.', '_')
         parser = getattr(self, '%s_parser' % provider,
                 self.default_parser)
         self.embed_html = parser(url)
         self.url = url
-        self.doc = BS(html)
+        self.host = host.lower()
+        if html is not None:
+            self._favicon_url = self.favicon_cache[self.host] = self.find_favicon_url(html, url)
 
     def get_summary(self, max_length=300):
         return self.embed_html
@@ -34,11 +46,24 @@ class EmbeddableExtractor(object):
     def get_illustration(self):
         return None
 
+    @staticmethod
+    def find_favicon_url(html, url):
+        # Only <link>s are parsed, not the whole page
+        fa = BS(html, parse_only=SoupStrainer('link')).find('link', rel=re.compile('icon', re.I))
+        favicon_path = fa.get('href', '/favicon.ico') if fa else '/favicon.ico'
+        return urljoin(url, favicon_path)
+
     def get_favicon_url(self):
         if not hasattr(self, '_favicon_url'):
-            fa = self.doc.find('link', rel=re.compile('icon', re.I))
-            favicon_path = fa.get('href', '/favicon.ico') if fa else '/favicon.ico'
-            self._favicon_url = urljoin(self.url, favicon_path)
+            if self.host not in self.favicon_cache:
+                try:
+                    logger.info('Fetching %s for the favicon of %s', self.url, self.host)
+                    resp = requests.get(self.url)
+                    self.favicon_cache[self.host] = self.find_favicon_url(resp.text, resp.url)
+                except IOError as e:
+                    logger.info('Failed to fetch %s, %s', self.url, e)
+                    return urljoin(self.url, '/favicon.ico')
+            self._favicon_url = self.favicon_cache[self.host]
         return self._favicon_url
 
     def default_parser(self, url):
@@ -99,9 +124,7 @@ class EmbeddableExtractor(object):
         return """<object data='http://www.bloomberg.com/video/embed/%s?height=395&width=640' width=640 height=430 style='overflow:hidden;'></object>""" % vid_mat.group(1)
 
     def slideshare_net_parser(self, url):
-        r = requests.get('http://www.slideshare.net/api/oembed/2', params={'url': url, 'format': 'json'})
-        r.raise_for_status()
-        return r.json()['html']
+        return fetch_oembed('http://www.slideshare.net/api/oembed/2', url)['html']
 
     def pdf_yt_parser(self, url):
         if not re.search(r'//pdf.yt/d/\w+', url, re.I):
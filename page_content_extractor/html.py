@@ -29,6 +29,23 @@ negative_patt = re.compile(r'comment|combx|disqus|foot|header|menu|rss|'
 positive_patt = re.compile(r'article|entry|post|column|main|content|'
     'section|text|preview|view|story-body', re.IGNORECASE)
 
+# Caps of the input in the low-memory mode
+MAX_HTML_CHARS = 2*1024*1024
+MAX_HTML_NODES = 30000
+
+def cap_html(html, max_chars=MAX_HTML_CHARS, max_nodes=MAX_HTML_NODES):
+    """Cut a page short before parsing, nodes are roughly counted by '<'"""
+    if max_chars and len(html) > max_chars:
+        logger.info('Html is too long(%s), cut to %s', len(html), max_chars)
+        html = html[:max_chars]
+    if max_nodes and html.count('<') > max_nodes:
+        pos = -1
+        for _ in xrange(max_nodes+1):
+            pos = html.find('<', pos+1)
+        logger.info('Too many nodes in html, cut at %s', pos)
+        html = html[:pos]
+    return html
+
 def tag_equal(self, other):
     return id(self) == id(other)
 # Use tag as keys in dom scores,
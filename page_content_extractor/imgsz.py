@@ -7,136 +7,165 @@ ported by jigloo(phus@live.com)
 add rgbsize rassize pcxsize function
 
 New BSD license
+
+Sizes are read in place from a str, buffer, bytearray, memoryview or mmap,
+only a few header bytes are ever copied. The format is looked up by its
+leading bytes in a dict. When the data is too short, NeedMoreData tells
+how many bytes are wanted, so a stream can be probed chunk by chunk, see Prober.
 '''
 # see https://github.com/phuslu/imgsz
 
-__version__ = '2.1'
-__all__ = ['what', 'size', 'fromstring']
+__version__ = '3.0'
+__all__ = ['what', 'size', 'fromstring', 'NeedMoreData', 'Prober']
+
+
+import re
+import zlib
+from struct import unpack_from, calcsize
+
+class NeedMoreData(ValueError):
+    '''The header is incomplete, at least `needed` bytes are wanted'''
 
+    def __init__(self, needed):
+        ValueError.__init__(self, 'Need at least %d bytes' % needed)
+        self.needed = needed
 
-import re, cStringIO
-from struct import unpack
+def _unpack(fmt, buf, offset=0):
+    end = offset + calcsize(fmt)
+    if len(buf) < end:
+        raise NeedMoreData(end)
+    return unpack_from(fmt, buf, offset)
 
-def _jpegsize(stream):
+def _bytes(buf, start, end):
+    '''A copy of buf[start:end], which may be a memoryview or mmap'''
+    return _unpack('%ds' % (end-start), buf, start)[0]
+
+def _head(buf, length):
+    '''At most `length` leading bytes'''
+    return _bytes(buf, 0, min(length, len(buf)))
+
+def _text_header(buf, length=1024):
+    '''The leading bytes of a text format, at most `length` long, and the bytes wanted
+       if it is shorter, 0 once it is full, more data never gets into it then'''
+    header = _head(buf, length)
+    return header, length if len(header) < length else 0
+
+def _jpegsize(buf):
     '''gets the width and height (in pixels) of a JPEG file'''
     x, y = 0, 0
-    # Dummy read to skip header ID
-    stream.read(2)
+    # Skip header ID
+    offset = 2
     while 1:
         # Extract the segment header.
-        (marker, code, length) = unpack('!BBH', stream.read(4))
+        (marker, code) = _unpack('!BB', buf, offset)
         # Verify that it's a valid segment.
         if marker != 0xFF:
             # Was it there?
             raise ValueError('JPEG marker not found')
-        elif code >= 0xC0 and code <= 0xC3:
-            # Segments that contain size info
-            (y, x) = unpack('!xHH', stream.read(5))
+        elif code == 0xFF:
+            # Fill byte
+            offset += 1
+        elif 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            # Start of frame segments contain size info
+            (y, x) = _unpack('!HH', buf, offset+5)
             break
         else:
-            # Dummy read to skip over data
-            stream.read(length - 2)
+            # Skip over data
+            (length,) = _unpack('!H', buf, offset+2)
+            offset += 2 + length
     if x == 0 or y == 0:
         raise ValueError('could not determine JPEG size')
     return 'JPEG', x, y
 
 
-def _bmpsize(stream):
+def _bmpsize(buf):
     '''size a Windows-ish BitMap image'''
-    x, y = 0, 0
-    # Dummy read to skip header data
-    stream.read(18)
-    (x, y) = unpack('<LL', stream.read(8))
+    (header_size,) = _unpack('<L', buf, 14)
+    if header_size == 12:  # OS/2 BITMAPCOREHEADER
+        (x, y) = _unpack('<HH', buf, 18)
+    else:
+        (x, y) = _unpack('<ll', buf, 18)
+    # Negative height means a top-down bitmap
+    x, y = abs(x), abs(y)
     if x == 0 or y == 0:
         raise ValueError('Unable to determine size of BMP data')
     return 'BMP', x, y
 
 
-def _pngsize(stream):
+def _pngsize(buf):
     '''gets the width & height (in pixels) of a png file
     cor this program is on the cutting edge of technology! (pity it's blunt!)'''
-    x, y = 0, 0
-    # Dummy read to skip header data
-    stream.read(12)
-    if stream.read(4) == 'IHDR':
-        x, y = unpack('!LL', stream.read(8))
+    if _bytes(buf, 12, 16) == 'IHDR':
+        x, y = _unpack('!LL', buf, 16)
     else:
         raise ValueError('could not determine PNG size')
     return 'PNG', x, y
 
 
-def _gifsize(stream):
+def _gifsize(buf):
     '''Subroutine gets the size of the specified GIF
     Default behavior for GIFs is to return the "screen" size'''
     # Skip over the identifying string, since we already know this is a GIF
-    type = stream.read(6)
-    buf = stream.read(5)
-    if len(buf) != 5:
-        raise ValueError('Invalid/Corrupted GIF (bad header)')
-    (sw, sh, x) = unpack('<HHB', buf)
+    (sw, sh) = _unpack('<HH', buf, 6)
     return 'GIF', sw, sh
 
-def _ppmsize(stream):
+PPM_MAP = {'P1': 'PBM', 'P2': 'PGM', 'P3': 'PPM',
+           'P4': 'PBM', 'P5': 'PGM', 'P6': 'PPM'}
+
+def _ppmsize(buf):
     '''gets data on the PPM/PGM/PBM family.'''
-    MIME_MAP = {'P1':'PBM', 'P2':'PGM', 'P3':'PPM',
-                'P4':'BPM', 'P5':'PGM', 'P6':'PPM'}
-    mime, x, y = '', 0, 0
-    header = stream.read(1024)
-    # PPM file of some sort
-    re.sub(r'^\#.*', '', header, re.M)
+    header, needed = _text_header(buf)
+    # Strip comments
+    header = re.sub(r'\#[^\n]*', '', header)
     m = re.match(r'^(P[1-6])\s+(\d+)\s+(\d+)', header, re.S)
     if m:
         (n, x, y) = m.group(1, 2, 3)
-        if n == 'P7':
-            mime = 'XV'
-            m = re.match(r'IMGINFO:(\d+)x(\d+)', header, re.S)
-            if m:
-                (x, y) = m.group(1, 2)
-        elif n in MIME_MAP:
-            mime = MIME_MAP[n]
-        else:
-            raise ValueError('Invalid/Corrupted PPM (bad header)')
-        return mime, int(x), int(y)
-    else:
-        raise ValueError('Unable to determine size of PPM/PGM/PBM data')
+        return PPM_MAP[n], int(x), int(y)
+    m = re.match(r'^P7\s.*?IMGINFO:(\d+)x(\d+)', header, re.S)
+    if m:
+        return 'XV', int(m.group(1)), int(m.group(2))
+    m = re.match(r'^P7\s.*?WIDTH\s+(\d+)\s+HEIGHT\s+(\d+)', header, re.S)
+    if m:
+        return 'PAM', int(m.group(1)), int(m.group(2))
+    if needed:
+        raise NeedMoreData(needed)
+    raise ValueError('Unable to determine size of PPM/PGM/PBM data')
 
 
-def _xbmsize(stream):
+def _xbmsize(buf):
     '''size a XBM image'''
-    x, y = 0, 0
-    header = stream.read(1024)
+    header, needed = _text_header(buf)
     m = re.match(r'^\#define\s*\S*\s*(\d+)\s*\n\#define\s*\S*\s*(\d+)', header, re.S|re.I)
     if m:
         x, y = m.group(1, 2)
         return 'XBM', int(x), int(y)
-    else:
-        raise ValueError('could not determine XBM size')
+    if needed:
+        raise NeedMoreData(needed)
+    raise ValueError('could not determine XBM size')
+
 
+xpm_values_patt = re.compile(r'"\s*(\d+)\s+(\d+)(\s+\d+\s+\d+){1,2}\s*"')
 
-def _xpmsize(stream):
+def _xpmsize(buf):
     '''Size an XPM file by looking for the "X Y N W" line, where X and Y are
        dimensions, N is the total number of colors defined, and W is the width of
        a color in the ASCII representation, in characters. We only care about X & Y.'''
-    x, y = 0, 0
-    while True:
-        line = stream.readline()
-        if line == '':
-            break
-        m = re.compile(r'\s*(\d+)\s+(\d+)(\s+\d+\s+\d+){1,2}\s*', re.M).match(line, 1)
-        if m:
-            x, y = map(int, m.group(1, 2))
-            break
-    else:
-        raise ValueError('could not determine XPM size')
-    return 'XPM', x, y
+    header, needed = _text_header(buf, 4096)
+    m = xpm_values_patt.search(header)
+    if m:
+        x, y = map(int, m.group(1, 2))
+        return 'XPM', x, y
+    if needed:
+        raise NeedMoreData(needed)
+    raise ValueError('could not determine XPM size')
 
 
-def _tiffsize(stream):
+def _tiffsize(buf):
     '''size a TIFF image'''
     x, y = 0, 0
 
     be = '!'           # Default to big-endian; I like it better
-    if stream.read(4) == 'II\x2a\x00': # little-endian
+    if _bytes(buf, 0, 4) == 'II\x2a\x00': # little-endian
         be = '<'
 
     # Set up an association between data types and their corresponding
@@ -144,43 +173,37 @@ def _tiffsize(stream):
     # signed numbers; treat them as unsigned because none of the image
     # dimensions should ever be negative.  (I hope.)
     packspec = ( None,      # nothing (shouldn't happen)
-            'Bxxx',    # BYTE (8-bit unsigned integer)
+            'B',       # BYTE (8-bit unsigned integer)
             None,      # ASCII
-            be+'Hxx',  # SHORT (16-bit unsigned integer)
+            be+'H',    # SHORT (16-bit unsigned integer)
             be+'L',    # LONG (32-bit unsigned integer)
             None,      # RATIONAL
-            'bxxx',    # SBYTE (8-bit signed integer)
+            'b',       # SBYTE (8-bit signed integer)
             None,      # UNDEFINED
-            be+'Hxx',  # SSHORT (16-bit unsigned integer)
+            be+'H',    # SSHORT (16-bit unsigned integer)
             be+'L'     # SLONG (32-bit unsigned integer)
             )
 
-    offset = unpack(be+'L', stream.read(4))[0] # Get offset to IFD
-
-    stream.seek(offset)
-    ifd = stream.read(2) # Get number of directory entries
-    num_dirent = unpack(be+'H', ifd)[0] # Make it useful
-    num_dirent = offset + (num_dirent * 12) # Calc. maximum offset of IFD
+    (offset,) = _unpack(be+'L', buf, 4) # Get offset to IFD
+    (num_dirent,) = _unpack(be+'H', buf, offset) # Get number of directory entries
 
     # Do all the work
-    ifd = ''
-    tag = 0
-    type = 0
-    while x == 0 or y == 0:
-        ifd = stream.read(12)  # Get first directory entry
-        if ifd == "" or stream.tell() > num_dirent:
+    entry = offset + 2
+    for _ in xrange(num_dirent):
+        if x and y:
             break
-        tag = unpack(be+'H', ifd[:2])[0] # ...and decode its tag
-        type = unpack(be+'H', ifd[2:2+2])[0] # ...and the data type
+        (tag, type) = _unpack(be+'HH', buf, entry) # decode its tag and the data type
+        value_at = entry + 8
+        entry += 12
         # Check the type for sanity.
-        if type > len(packspec) or packspec[type] is None:
+        if type >= len(packspec) or packspec[type] is None:
             continue
         if tag == 0x0100: # ImageWidth (x)
             # Decode the value
-            x = unpack(packspec[type], ifd[8:4+8])[0]
+            (x,) = _unpack(packspec[type], buf, value_at)
         elif tag == 0x0101: # ImageLength (y)
             # Decode the value
-            y = unpack(packspec[type], ifd[8:4+8])[0]
+            (y,) = _unpack(packspec[type], buf, value_at)
 
     # Decide if we were successful or not
 
@@ -194,11 +217,9 @@ def _tiffsize(stream):
     return 'TIFF', x, y
 
 
-def _psdsize(stream):
+def _psdsize(buf):
     '''determine the size of a PhotoShop save-file (*.PSD)'''
-    x, y = 0, 0
-    stream.read(14)
-    (y, x) = unpack('!LL', stream.read(8))
+    (y, x) = _unpack('!LL', buf, 14)
     if x == 0 or y == 0:
         raise ValueError('could not determine PSD size')
     return 'PSD', x, y
@@ -214,13 +235,11 @@ PCD_MAP = { 'base/16' : ( 192,  128  ),
         'base64'  : ( 6144, 4096 )}
 # Default scale for PCD images
 PCD_SCALE = 'base';
-def _pcdsize(stream):
+def _pcdsize(buf):
     '''determine the size of a file in Kodak photo-CDs'''
-    x, y = 0, 0
-    buff = stream.read(0xf00)
-    if buff[0x800:3+0x800] != 'PCD':
+    if _bytes(buf, 0x800, 0x803) != 'PCD':
         raise ValueError('Invalid/Corrupted PCD (bad header)')
-    orient = ord(buff[0x0e02:1+0x0e02]) & 1 # Clear down to one bit
+    orient = _unpack('B', buf, 0x0e02)[0] & 1 # Clear down to one bit
     if orient:
         (x, y) = PCD_MAP[PCD_SCALE]
     else:
@@ -233,147 +252,300 @@ def _bin(n, count=32):
     return ''.join([str((n >> i) & 1) for i in range(count-1, -1, -1)])
 
 
-def _swfsize(stream):
-    '''determine size of ShockWave/Flash files.'''
-    x, y = 0, 0
-    header = stream.read(33)
-    bs = ''.join([_bin(c, 8) for c in unpack('B'*17, header[8:17+8])])
+def _rect_size(header):
+    '''width and height of a SWF RECT record'''
+    bs = ''.join([_bin(c, 8) for c in header])
     bits = int(bs[:5], 2)
     x = int(bs[(5+bits):bits+(5+bits)], 2)/20
     y = int(bs[(5+bits*3):bits+(5+bits*3)], 2)/20
+    return x, y
+
+
+def _swfsize(buf):
+    '''determine size of ShockWave/Flash files.'''
+    x, y = _rect_size(_unpack('B'*17, buf, 8))
     if x == 0 or y == 0:
         raise ValueError('could not determine SWF size')
     return 'SWF', x, y
 
 
-def _swfmxsize(stream):
+def _swfmxsize(buf):
     '''determine size of Compressed ShockWave/Flash files.'''
-    import zlib
-    x, y = 0, 0
-    stream.read(8)
-    z = zlib.decompressobj()
-    header = z.decompress(stream.read(1024))
-    del z
-    bs = ''.join([_bin(c, 8) for c in unpack('B'*9, header[:9])])
-    bits = int(bs[:5], 2)
-    x = int(bs[(5+bits):bits+(5+bits)], 2)/20
-    y = int(bs[(5+bits*3):bits+(5+bits*3)], 2)/20
+    compressed, needed = _text_header(buf, 8+1024)
+    header = zlib.decompressobj().decompress(compressed[8:])
+    if len(header) < 17:
+        if needed:
+            raise NeedMoreData(needed)
+        raise ValueError('could not determine CWS size')
+    x, y = _rect_size(unpack_from('B'*17, header))
     if x == 0 or y == 0:
         raise ValueError('could not determine CWS size')
     return 'CWS', x, y
 
 
-def _mngsize(stream):
+def _mngsize(buf):
     '''gets the width and height (in pixels) of an MNG file.
        Basically a copy of pngsize.'''
-    x, y = 0, 0
-    stream.read(12)
-    if stream.read(4) == 'MHDR':
+    if _bytes(buf, 12, 16) == 'MHDR':
         # MHDR = Image Header
-        x, y = unpack('!LL', stream.read(8))
+        x, y = _unpack('!LL', buf, 16)
     else:
         raise ValueError('Invalid/Corrupted MNG (bad header)')
     return 'MNG', x, y
 
 
-def _rgbsize(stream):
+def _rgbsize(buf):
     '''gets the width and height (in pixels) of a SGI file.'''
-    x, y = 0, 0
-    stream.read(6)
-    x, y = unpack('!HH', stream.read(4))
+    x, y = _unpack('!HH', buf, 6)
     if x == 0 or y == 0:
         raise ValueError('could not determine SGI size')
     return 'RGB', x, y
 
 
-def _rassize(stream):
+def _rassize(buf):
     '''gets the width and height (in pixels) of a Sun raster file.'''
-    x, y = 0, 0
-    stream.read(4)
-    x, y = unpack('!LL', stream.read(8))
+    x, y = _unpack('!LL', buf, 4)
     if x == 0 or y == 0:
         raise ValueError('could not determine Sun raster size')
     return 'RAS', x, y
 
-def _pcxsize(stream):
+def _pcxsize(buf):
     '''gets the width and height (in pixels) of a ZSoft PCX File.'''
-    x, y = 0, 0
-    stream.read(4)
-    (xmin, ymin, xmax, ymax) = unpack('<HHHH', stream.read(8))
+    (xmin, ymin, xmax, ymax) = _unpack('<HHHH', buf, 4)
     x, y = xmax-xmin+1, ymax-ymin+1
     if x == 0 or y == 0:
         raise ValueError('could not determine ZSoft PCX size')
     return 'PCX', x, y
 
-def _svgsize(stream):
-    '''gets the width and height (in pixels) of a SVG File.'''
-    #TODO add support for other units like: "em", "ex", "px", "in", "cm", "mm", "pt", "pc", "%"
-    header = stream.read(1024)
-    m = re.search(r'''width\s*=\s*(["\'])
-            (\d*\.?\d+) # px maybe a floating-point
-            (?:px)?  # unit maybe omitted too
-            \1
-            '''
-            , header, re.I|re.X)
-    n = re.search(r'''height\s*=\s*(["\'])
+svg_tag_patt = re.compile(r'<svg\s[^>]*>', re.I)
+svg_length_patt = r'''%s\s*=\s*(["\'])
             (\d*\.?\d+) # px maybe a floating-point
             (?:px)?  # unit maybe omitted too
             \1
             '''
-            , header, re.I|re.X)
+svg_width_patt = re.compile(svg_length_patt % 'width', re.I|re.X)
+svg_height_patt = re.compile(svg_length_patt % 'height', re.I|re.X)
+svg_viewbox_patt = re.compile(r'''viewBox\s*=\s*["\'][-\d.]+[\s,]+[-\d.]+[\s,]+(\d*\.?\d+)[\s,]+(\d*\.?\d+)''', re.I)
+
+def _svgsize(buf):
+    '''gets the width and height (in pixels) of a SVG File.'''
+    #TODO add support for other units like: "em", "ex", "px", "in", "cm", "mm", "pt", "pc", "%"
+    header, needed = _text_header(buf, 4096)
+    tag = svg_tag_patt.search(header)
+    if not tag:
+        if needed:
+            raise NeedMoreData(needed)
+        raise ValueError('Unable to determine size of SVG data')
+    tag = tag.group()
+    m = svg_width_patt.search(tag)
+    n = svg_height_patt.search(tag)
     if m and n:
         x = int(m.group(2).split('.')[0])
         y = int(n.group(2).split('.')[0])
         return 'SVG', x, y
+    m = svg_viewbox_patt.search(tag)
+    if m:
+        return 'SVG', int(float(m.group(1))), int(float(m.group(2)))
     raise ValueError('Unable to determine size of SVG data')
 
-# type_map used in function type_map_match
-TYPE_MAP = { re.compile(r'^\xFF\xD8')              : ('JPEG', _jpegsize),
-        re.compile(r'^BM')                         : ('BMP',  _bmpsize),
-        re.compile(r'^\x89PNG\x0d\x0a\x1a\x0a')    : ('PNG',  _pngsize),
-        re.compile(r'^GIF8[7,9]a')                 : ('GIF',  _gifsize),
-        re.compile(r'^P[1-7]')                     : ('PPM',  _ppmsize),
-        re.compile(r'^\#define\s+\S+\s+\d+')        : ('XBM',  _xbmsize),
-        re.compile(r'^\/\* XPM \*\/')               : ('XPM',  _xpmsize),
-        re.compile(r'^MM\x00\x2a')                 : ('TIFF', _tiffsize),
-        re.compile(r'^II\x2a\x00')                 : ('TIFF', _tiffsize),
-        re.compile(r'^8BPS')                       : ('PSD',  _psdsize),
-        re.compile(r'^PCD_OPA')                    : ('PCD',  _pcdsize),
-        re.compile(r'^FWS')                        : ('SWF',  _swfsize),
-        re.compile(r'^CWS')                        : ('SWF',  _swfmxsize),
-        re.compile(r'^\x8aMNG\x0d\x0a\x1a\x0a')    : ('MNG',  _mngsize),
-        re.compile(r'^\x01\xDA[\x01\x00]')         : ('RGB',  _rgbsize),
-        re.compile(r'^\x59\xA6\x6A\x95')           : ('RAS',  _rassize),
-        re.compile(r'^\x0A.\x01')                  : ('PCX',  _pcxsize),
-        re.compile(r'<svg\s')                       : ('SVG',  _svgsize)}
+def _webpsize(buf):
+    '''gets the width and height (in pixels) of a WebP file, lossy, lossless or extended.'''
+    if _bytes(buf, 8, 12) != 'WEBP':
+        raise ValueError('Invalid/Corrupted WEBP (bad header)')
+    chunk = _bytes(buf, 12, 16)
+    if chunk == 'VP8 ':
+        # 3 bytes frame tag, then the start code
+        if _bytes(buf, 23, 26) != '\x9d\x01\x2a':
+            raise ValueError('Invalid/Corrupted WEBP (bad VP8 start code)')
+        x, y = _unpack('<HH', buf, 26)
+        x, y = x & 0x3fff, y & 0x3fff
+    elif chunk == 'VP8L':
+        (signature, b0, b1, b2, b3) = _unpack('5B', buf, 20)
+        if signature != 0x2f:
+            raise ValueError('Invalid/Corrupted WEBP (bad VP8L signature)')
+        x = 1 + (((b1 & 0x3F) << 8) | b0)
+        y = 1 + (((b3 & 0xF) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+    elif chunk == 'VP8X':
+        (w0, w1, w2, h0, h1, h2) = _unpack('6B', buf, 24)
+        x = 1 + (w0 | w1 << 8 | w2 << 16)
+        y = 1 + (h0 | h1 << 8 | h2 << 16)
+    else:
+        raise ValueError('Unknown WEBP chunk %r' % chunk)
+    return 'WEBP', x, y
+
+def _boxes(buf, start, end=None):
+    '''yields (type, payload start, box end) of ISO base media boxes in buf[start:end]'''
+    offset = start
+    while end is None or offset < end:
+        (box_size, box_type) = _unpack('!L4s', buf, offset)
+        header = 8
+        if box_size == 1:
+            (box_size,) = _unpack('!Q', buf, offset+8)
+            header = 16
+        elif box_size == 0:  # extends to the end
+            box_size = (end or len(buf)) - offset
+        if box_size < header:
+            raise ValueError('Invalid/Corrupted box %r' % box_type)
+        yield box_type, offset+header, offset+box_size
+        offset += box_size
+
+def _find_box(buf, path, start=0, end=None):
+    '''payload range of the first box at `path`, e.g. ('meta', 'iprp')'''
+    for box_type, payload, box_end in _boxes(buf, start, end):
+        if box_type == path[0]:
+            if box_type == 'meta':  # a full box, skip version and flags
+                payload += 4
+            if len(path) == 1:
+                return payload, box_end
+            return _find_box(buf, path[1:], payload, box_end)
+    raise ValueError('Box %r not found' % (path,))
+
+def _avifsize(buf):
+    '''gets the width and height (in pixels) of an AVIF/HEIF file from its largest ispe property.'''
+    (ftyp_size,) = _unpack('!L', buf, 0)
+    brands = set(_unpack('4s', buf, o)[0] for o in xrange(8, ftyp_size, 4) if o != 12)
+    if brands & {'avif', 'avis'}:
+        mime = 'AVIF'
+    elif brands & {'heic', 'heix', 'heim', 'heis', 'mif1', 'msf1'}:
+        mime = 'HEIF'
+    else:
+        raise ValueError('Not an AVIF/HEIF file, brands %s' % sorted(brands))
+    start, end = _find_box(buf, ('meta', 'iprp', 'ipco'), ftyp_size)
+    x, y = 0, 0
+    for box_type, payload, _ in _boxes(buf, start, end):
+        if box_type == 'ispe':
+            # skip version and flags
+            (w, h) = _unpack('!LL', buf, payload+4)
+            if w*h > x*y:
+                x, y = w, h
+    if x == 0 or y == 0:
+        raise ValueError('could not determine %s size' % mime)
+    return mime, x, y
+
+def _icosize(buf):
+    '''gets the width and height (in pixels) of the largest image in an ICO/CUR file.'''
+    (_, type, count) = _unpack('<HHH', buf, 0)
+    x, y = 0, 0
+    for i in xrange(count):
+        (w, h) = _unpack('BB', buf, 6+16*i)
+        # 0 means 256
+        w, h = w or 256, h or 256
+        if w*h > x*y:
+            x, y = w, h
+    if x == 0 or y == 0:
+        raise ValueError('could not determine ICO size')
+    return 'ICO' if type == 1 else 'CUR', x, y
+
+# Keyed by the first two (or one) bytes, each entry is
+# ((offset, magic), ...), mime, callback
+TYPE_MAP = {}
+for checks, mime, callback in (
+        (((0, '\xFF\xD8'),),                         'JPEG', _jpegsize),
+        (((0, 'BM'),),                               'BMP',  _bmpsize),
+        (((0, '\x89PNG\x0d\x0a\x1a\x0a'),),          'PNG',  _pngsize),
+        (((0, 'GIF87a'),),                           'GIF',  _gifsize),
+        (((0, 'GIF89a'),),                           'GIF',  _gifsize),
+        (((0, 'P1'),),                               'PPM',  _ppmsize),
+        (((0, 'P2'),),                               'PPM',  _ppmsize),
+        (((0, 'P3'),),                               'PPM',  _ppmsize),
+        (((0, 'P4'),),                               'PPM',  _ppmsize),
+        (((0, 'P5'),),                               'PPM',  _ppmsize),
+        (((0, 'P6'),),                               'PPM',  _ppmsize),
+        (((0, 'P7'),),                               'PPM',  _ppmsize),
+        (((0, '#define'),),                          'XBM',  _xbmsize),
+        (((0, '/* XPM */'),),                        'XPM',  _xpmsize),
+        (((0, 'MM\x00\x2a'),),                       'TIFF', _tiffsize),
+        (((0, 'II\x2a\x00'),),                       'TIFF', _tiffsize),
+        (((0, '8BPS'),),                             'PSD',  _psdsize),
+        (((0, 'PCD_OPA'),),                          'PCD',  _pcdsize),
+        (((0, 'FWS'),),                              'SWF',  _swfsize),
+        (((0, 'CWS'),),                              'SWF',  _swfmxsize),
+        (((0, '\x8aMNG\x0d\x0a\x1a\x0a'),),          'MNG',  _mngsize),
+        (((0, '\x01\xDA\x01'),),                     'RGB',  _rgbsize),
+        (((0, '\x01\xDA\x00'),),                     'RGB',  _rgbsize),
+        (((0, '\x59\xA6\x6A\x95'),),                 'RAS',  _rassize),
+        (((0, '\x0A'), (2, '\x01')),                 'PCX',  _pcxsize),
+        (((0, 'RIFF'), (8, 'WEBP')),                 'WEBP', _webpsize),
+        (((0, '\x00\x00\x01\x00'),),                 'ICO',  _icosize),
+        (((0, '\x00\x00\x02\x00'),),                 'ICO',  _icosize),
+        (((0, '\x00\x00'), (4, 'ftyp')),             'AVIF', _avifsize),
+        (((0, '\x00\x01'), (4, 'ftyp')),             'AVIF', _avifsize),
+        ):
+    TYPE_MAP.setdefault(checks[0][1][:2], []).append((checks, mime, callback))
+
+# Texts may start with whitespaces or a BOM
+SVG_LEADING_CHARS = ' \t\r\n\xef\xbb\xbf'
+MAGIC_LENGTH = 16
 
 def _type_match(data):
     '''type_map_match to get MIME-TYPE and callback function'''
-    for rx in TYPE_MAP:
-        if rx.search(data):
-            return TYPE_MAP[rx]
-    else:
-        raise ValueError('Unable to Recognize image file header')
+    head = _head(data, MAGIC_LENGTH)
+    for key in (head[:2], head[:1]):
+        for checks, mime, callback in TYPE_MAP.get(key, ()):
+            if all(head[o:o+len(magic)] == magic for o, magic in checks):
+                return mime, callback
+    if _head(data, 256).lstrip(SVG_LEADING_CHARS)[:1] == '<':
+        return 'SVG', _svgsize
+    if len(head) < MAGIC_LENGTH:
+        raise NeedMoreData(MAGIC_LENGTH)
+    raise ValueError('Unable to Recognize image file header')
+
+class Prober(object):
+    '''Feed chunks of a stream until the image size is known
+
+    >>> prober = Prober()
+    >>> for chunk in resp.iter_content(4096):
+    ...     if prober.feed(chunk):
+    ...         break
+    >>> prober.result
+    ('PNG', 640, 480)
+    '''
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.needed = 0
+        self.result = None
+
+    @property
+    def data(self):
+        '''All bytes fed so far'''
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0] if self.chunks else ''
+
+    def feed(self, chunk):
+        '''Returns True once the size is known, raises ValueError if the format is unknown'''
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.result or self.size < self.needed:
+            return bool(self.result)
+        try:
+            self.result = fromstring(self.data)
+        except NeedMoreData as e:
+            self.needed = e.needed
+            return False
+        return True
+
+def _fromfile(filename):
+    prober = Prober()
+    with open(filename, 'rb') as stream:
+        while not prober.feed(stream.read(max(prober.needed - prober.size, 4096))):
+            if prober.size < prober.needed and not prober.chunks[-1]:
+                raise ValueError('Unexpected end of %s' % filename)
+    return prober.result
 
 def what(filename):
     '''Recognize image format from file header'''
-    stream = open(filename, 'rb')
-    data = stream.read(512)
-    stream.seek(0, 0)
-    mime, callback = _type_match(data)
+    with open(filename, 'rb') as stream:
+        mime, callback = _type_match(stream.read(512))
     return mime
 
 def size(filename):
     '''size image format'''
-    stream = open(filename, 'rb')
-    data = stream.read(512)
-    stream.seek(0, 0)
-    mime, callback = _type_match(data)
-    mime, x, y = callback(stream)
-    return mime, x, y
+    return _fromfile(filename)
 
 def fromstring(data):
-    '''size image from string'''
+    '''size image from a str or anything with the buffer interface, it's read in place'''
     mime, callback = _type_match(data)
-    mime, x, y = callback(cStringIO.StringIO(data))
-    return mime, x, y
+    return callback(data)
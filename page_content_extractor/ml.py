@@ -0,0 +1,170 @@
+#coding: utf-8
+"""
+Main content extraction using a pre-trained model, see the tutorial notebook
+"How to extract main content from web pages using Machine-Learning".
+
+Every block node becomes one row of a feature matrix, the matrix is scored
+by a linear model in one go and the top scored node wins.
+"""
+import os
+import re
+import json
+import logging
+
+from bs4 import Tag, NavigableString
+
+from .html import HtmlContentExtractor, block_tags, positive_patt, negative_patt
+from .utils import string_inclusion_ratio
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, fall back to the heuristic extractor
+    np = None
+    logger.warning('numpy is not installed, the ml extractor falls back to the heuristic one')
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model.json')
+
+# Tags that get their own one-hot column, keep in sync with the model file
+ONE_HOT_TAGS = ('article', 'section', 'div', 'td', 'p', 'li', 'ul', 'ol',
+                'table', 'form', 'body')
+FEATURES = ('text_ratio', 'alink_text_ratio', 'depth', 'contain_title',
+            'positive_attr', 'negative_attr') + tuple('tag=%s' % t for t in ONE_HOT_TAGS)
+
+
+class LinearModel(object):
+    """
+    A standardized linear model, score = ((X - mean) / scale) . weights + bias
+    The file is a small json dict, so it can be exported from the notebook with
+    `json.dump({'features': ..., 'mean': scaler.mean_.tolist(), ...})`
+    """
+    _cache = {}
+
+    def __init__(self, features, weights, bias=0.0, mean=None, scale=None):
+        if tuple(features) != FEATURES:
+            raise ValueError('Model features %s do not match %s' % (features, FEATURES))
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean if mean is not None else [0.0]*len(FEATURES), dtype=np.float64)
+        self.scale = np.asarray(scale if scale is not None else [1.0]*len(FEATURES), dtype=np.float64)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        if path not in cls._cache:
+            with open(path) as fp:
+                cls._cache[path] = cls(**json.load(fp))
+        return cls._cache[path]
+
+    def decision_function(self, X):
+        return ((X - self.mean) / self.scale).dot(self.weights) + self.bias
+
+
+class MLContentExtractor(HtmlContentExtractor):
+    """
+    Same interface as HtmlContentExtractor, only the way we find the main
+    content differs. Pass `defer=True` and then `score_batch` a list of
+    extractors to score pages of a whole cycle with one matrix product.
+    """
+    available = np is not None
+
+    def __init__(self, html, url='', model=None, defer=False):
+        if np is None:
+            raise ImportError('numpy is required by MLContentExtractor')
+        self.model = model or LinearModel.load()
+        self.defer = defer
+        super(MLContentExtractor, self).__init__(html, url)
+
+    def find_main_content(self):
+        self.nodes, self.features = self.build_features()
+        if self.defer:
+            return
+        self.pick_article(self.model.decision_function(self.features))
+
+    def relative_path2_abs_url(self):
+        if self.defer:
+            return
+        super(MLContentExtractor, self).relative_path2_abs_url()
+
+    def pick_article(self, scores):
+        self.defer = False
+        if len(self.nodes):
+            best = int(np.argmax(scores))
+            self.article = self.nodes[best]
+            self.article.score = float(scores[best])
+        else:
+            self.article = self.doc
+        logger.info('Score of the main content is %s', self.article.score or 0)
+        # Only needed while scoring
+        del self.nodes, self.features
+        self.relative_path2_abs_url()
+
+    @classmethod
+    def score_batch(cls, extractors, model=None):
+        """Score deferred extractors with a single matrix product"""
+        pending = [e for e in extractors if e.defer]
+        if not pending:
+            return extractors
+        model = model or pending[0].model
+        scores = model.decision_function(np.vstack([e.features for e in pending]))
+        offset = 0
+        for e in pending:
+            count = len(e.nodes)
+            e.pick_article(scores[offset:offset+count])
+            offset += count
+        return extractors
+
+    def title_parents(self):
+        if not self.title.strip():
+            return set()
+
+        def is_article_header(node):
+            return bool(re.match(r'h\d+|td', node.name, re.I)) and \
+                string_inclusion_ratio(node.text, self.title) > .85
+
+        parents = set()
+        for node in self.doc.find_all(is_article_header):
+            parents.update(id(p) for p in node.parents)
+        return parents
+
+    def build_features(self):
+        """
+        Walk the tree once, collecting raw measures of every block node,
+        then derive the normalized feature columns with numpy.
+        """
+        nodes, raw = [], []
+        title_parents = self.title_parents()
+        tag_index = dict((t, i) for i, t in enumerate(ONE_HOT_TAGS))
+
+        def walk(node, depth):
+            text_len = link_len = 0
+            for child in node.children:
+                if isinstance(child, Tag):
+                    t, l = walk(child, depth+1)
+                    text_len += t
+                    link_len += t if child.name == 'a' else l
+                # Skip comments, see calc_effective_text_len
+                elif type(child) is NavigableString:
+                    text_len += len(child.strip())
+            if node.name in block_tags:
+                attrs = '%s %s' % (node.get('id', ''), ' '.join(node.get('class', [])))
+                nodes.append(node)
+                raw.append((text_len, link_len, depth, id(node) in title_parents,
+                            len(positive_patt.findall(attrs)), len(negative_patt.findall(attrs)),
+                            tag_index.get(node.name, -1)))
+            return text_len, link_len
+
+        walk(self.doc, 0)
+        features = np.zeros((len(raw), len(FEATURES)))
+        if not raw:
+            return nodes, features
+        raw = np.array(raw, dtype=np.float64)
+        text_len, link_len, depth = raw[:, 0], raw[:, 1], raw[:, 2]
+        features[:, 0] = text_len / max(text_len.max(), 1)
+        features[:, 1] = np.where(text_len > 0, link_len / np.maximum(text_len, 1), 0)
+        features[:, 2] = depth / max(depth.max(), 1)
+        features[:, 3:6] = raw[:, 3:6]
+        tags = raw[:, 6].astype(int)
+        hit = tags >= 0
+        features[np.nonzero(hit)[0], 6 + tags[hit]] = 1
+        return nodes, features
@@ -1,6 +1,7 @@
 #coding: utf-8
 import logging
 
+from time import time
 from urlparse import urljoin
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
@@ -14,31 +15,97 @@ from .utils import tokenize, is_paragraph
 
 logger = logging.getLogger(__name__)
 
+class SummaryTextConverter(TextConverter):
+    """
+    Grouping text boxes into reading order is quadratic to the number of boxes,
+    skip it on crowded pages and keep the boxes in content stream order.
+    """
+
+    def __init__(self, rsrcmgr, outfp, max_layout_objs, **kwargs):
+        TextConverter.__init__(self, rsrcmgr, outfp, **kwargs)
+        self.max_layout_objs = max_layout_objs
+
+    def end_page(self, page):
+        if self.max_layout_objs and len(self.cur_item) > self.max_layout_objs:
+            logger.info('Too many objects(%s) on page %s, skip ordering text boxes',
+                        len(self.cur_item), self.pageno)
+            self.cur_item.group_textboxes = lambda laparams, boxes: []
+        TextConverter.end_page(self, page)
+
 class PdfExtractor(object):
+    # We only need a summary, so stop as early as we can
+    MAX_PAGES = 30
+    MAX_BYTES = 30*1024*1024
+    MAX_LAYOUT_OBJS = 20000
+    MAX_SECONDS = 20
+    # Do not analyze texts in figures, nor detect vertical writings
+    LAPARAMS = LAParams(detect_vertical=False, all_texts=False)
 
-    def __init__(self, raw_data, url=''):
+    def __init__(self, raw_data, url='', max_pages=None, max_bytes=None,
+                 max_layout_objs=None, max_seconds=None):
         # TODO sort text according to their layouts
         self.url = url
+        self.max_pages = max_pages or self.MAX_PAGES
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.max_layout_objs = max_layout_objs or self.MAX_LAYOUT_OBJS
+        self.max_seconds = max_seconds or self.MAX_SECONDS
+        if len(raw_data) > self.max_bytes:
+            raise ParseError('PDF is too large(%s bytes)' % len(raw_data))
         try:
             self.load(raw_data)
         except Exception as e:
             raise ParseError(e)
 
     def load(self, raw_data):
-        pdf_fp = StringIO(raw_data)
+        """Pages are extracted lazily, only the first one is touched here to fail fast"""
+        if hasattr(raw_data, 'read'):  # memory-mapped, see utils.read_body
+            pdf_fp = raw_data
+            pdf_fp.seek(0)
+        else:
+            pdf_fp = StringIO(raw_data)
+        self.rsrcmgr = PDFResourceManager()
+        self.pages = PDFPage.get_pages(pdf_fp, maxpages=self.max_pages)
+        self.page_texts = []
+        self.started_at = None
+        self.extract_next_page()
+
+    def extract_next_page(self):
+        """Returns the text of the next page, or None if no more pages are wanted"""
+        if self.pages is None:
+            return None
+        if self.started_at is None:
+            self.started_at = time()
+        elif time() - self.started_at > self.max_seconds:
+            logger.info('Spent more than %ss on %s, stop at page %s',
+                        self.max_seconds, self.url, len(self.page_texts))
+            self.pages = None
+            return None
+        try:
+            page = next(self.pages)
+        except StopIteration:
+            self.pages = None
+            return None
         output_fp = StringIO()
-        codec = 'utf-8'
-        laparams = LAParams()
-        rsrcmgr = PDFResourceManager()
-        device = TextConverter(rsrcmgr, output_fp, codec=codec, laparams=laparams)
-        # Create a PDF interpreter object.
-        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        device = SummaryTextConverter(self.rsrcmgr, output_fp, self.max_layout_objs,
+                                      codec='utf-8', laparams=self.LAPARAMS)
+        PDFPageInterpreter(self.rsrcmgr, device).process_page(page)
+        text = output_fp.getvalue().decode('utf-8')
+        self.page_texts.append(text)
+        return text
 
-        # Process each page contained in the document.
-        for page in PDFPage.get_pages(pdf_fp):
-            interpreter.process_page(page)
+    def iter_page_texts(self):
+        for text in self.page_texts:
+            yield text
+        while True:
+            text = self.extract_next_page()
+            if text is None:
+                break
+            yield text
 
-        self.article = output_fp.getvalue().decode('utf-8')
+    @property
+    def article(self):
+        """All the text we are allowed to extract"""
+        return u''.join(self.iter_page_texts())
 
     def get_summary(self, max_length=300):
         partial_summaries = []
@@ -58,10 +125,20 @@ class PdfExtractor(object):
                     len_of_summary += len(p)
         return ''.join(partial_summaries) or None
 
+    def iter_lines(self):
+        """Lines of all pages, as if they were split from one big string"""
+        rest = u''
+        for text in self.iter_page_texts():
+            lines = (rest + text).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line
+        yield rest
+
     def get_paragraphs(self):
         p = []
         has_began = False
-        for line in self.article.split('\n'):
+        for line in self.iter_lines():
             if line.strip():
                 has_began = True
                 p.append(line.strip())
@@ -77,4 +154,3 @@ class PdfExtractor(object):
 
     def get_favicon_url(self):
         return urljoin(self.url, '/favicon.ico')
-
@@ -0,0 +1,185 @@
+#coding: utf-8
+"""
+Compressed bodies of fetched pages, so extractors can be re-run on them
+without the network, e.g. to reproduce a bad summary or try a new version.
+
+Every fetch is one file, ROOT/<sha1 of url>[:2]/<sha1 of url>/<fetch time>.<codec>,
+holding a line of json metadata (urls, status, headers) and then the compressed body.
+Bodies are compressed and decompressed chunk by chunk, never held as a whole.
+"""
+import os
+import json
+import zlib
+import errno
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .utils import get_encoding_from_headers
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always there
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y%m%dT%H%M%S.%f'
+CHUNK_SIZE = 64*1024
+
+class ZlibCodec(object):
+    name = 'zlib'
+
+    def compressor(self):
+        return zlib.compressobj(6)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+class ZstdCodec(object):
+    name = 'zst'
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=3).compressobj()
+
+    def decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+codecs = {'zlib': ZlibCodec()}
+if zstandard is not None:
+    codecs['zst'] = ZstdCodec()
+
+class StoredBody(object):
+    """A file-like object decompressing a stored body as it's read"""
+
+    def __init__(self, fp, codec):
+        self.fp = fp
+        self.decompressor = codec.decompressor()
+        self.buf = ''
+        self.pos = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) - self.pos < size:
+            chunk = self.fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            # Drop what has been read before growing the buffer
+            self.buf = self.buf[self.pos:] + self.decompressor.decompress(chunk)
+            self.pos = 0
+        end = len(self.buf) if size < 0 else self.pos + size
+        data = self.buf[self.pos:end]
+        self.pos = min(end, len(self.buf))
+        return data
+
+    def close(self):
+        self.fp.close()
+
+class RawStore(object):
+
+    def __init__(self, root, max_bytes=1024**3, codec=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.codec = codecs[codec] if codec else codecs.get('zst', codecs['zlib'])
+        # Prune once this many bytes are written since the last time
+        self.prune_every = max(max_bytes // 10, 1)
+        self.written = 0
+
+    def url_dir(self, url):
+        key = hashlib.sha1(url.encode('utf-8') if isinstance(url, unicode) else url).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, url, resp, body):
+        """
+        Store the body of a response fetched for `url`, `body` may be a str
+        or anything sliceable like a memory-mapped one. Returns the path.
+        """
+        dirname = self.url_dir(url)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fetched_at = datetime.utcnow()
+        meta = {'url': url, 'final_url': resp.url, 'status': resp.status_code,
+                'headers': dict(resp.headers), 'fetched_at': fetched_at.strftime(TIME_FORMAT),
+                'size': len(body)}
+        path = os.path.join(dirname, '%s.%s' % (fetched_at.strftime(TIME_FORMAT), self.codec.name))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(json.dumps(meta) + '\n')
+                compressor = self.codec.compressor()
+                for offset in xrange(0, len(body), CHUNK_SIZE):
+                    fp.write(compressor.compress(body[offset:offset+CHUNK_SIZE]))
+                fp.write(compressor.flush())
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self.written += os.path.getsize(path)
+        if self.written >= self.prune_every:
+            self.prune()
+        return path
+
+    def fetches(self, url):
+        """Paths of stored fetches of `url`, oldest first"""
+        dirname = self.url_dir(url)
+        try:
+            names = os.listdir(dirname)
+        except OSError:
+            return []
+        return [os.path.join(dirname, name) for name in sorted(names) if not name.startswith('.')]
+
+    def open(self, path):
+        """Returns (metadata, file-like body) of a stored fetch"""
+        codec = codecs[path.rsplit('.', 1)[1]]
+        fp = open(path, 'rb')
+        meta = json.loads(fp.readline())
+        return meta, StoredBody(fp, codec)
+
+    def replay(self, url):
+        """
+        A streamed response of the latest fetch of `url`, as if it were
+        requests.get(url, stream=True). Raises IOError if it was never stored.
+        """
+        paths = self.fetches(url)
+        if not paths:
+            raise IOError('%s is not in the raw store' % url)
+        meta, body = self.open(paths[-1])
+        resp = requests.models.Response()
+        resp.url = meta['final_url']
+        resp.status_code = meta['status']
+        resp.headers = CaseInsensitiveDict(meta['headers'])
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.raw = body
+        return resp
+
+    def prune(self):
+        """Remove the oldest fetches until the store fits in max_bytes"""
+        files = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, name)
+                size = os.path.getsize(path)
+                total += size
+                # Names are fetch times
+                files.append((name, path, size))
+        files.sort()
+        removed = 0
+        for name, path, size in files:
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+            removed += 1
+        self.written = 0
+        if removed:
+            logger.info('Removed %s fetches from %s', removed, self.root)
+        return removed
@@ -0,0 +1,51 @@
+#coding: utf-8
+"""
+Compact results of an extraction, so the parse tree can be thrown away
+as soon as we have got what we want.
+"""
+
+class Illustration(object):
+    """All we need to store a WebImage"""
+    __slots__ = ('url', 'content_type', 'raw_data')
+
+    def __init__(self, url, content_type, raw_data):
+        self.url = url
+        self.content_type = content_type
+        self.raw_data = raw_data
+
+    @classmethod
+    def from_webimage(cls, img):
+        return cls(img.url, img.content_type, img.raw_data)
+
+    def __repr__(self):
+        return '<Illustration %s>' % self.url
+
+class ExtractionResult(object):
+    __slots__ = ('url', 'summary', 'favicon', 'illustration', 'rss_delta',
+                 'memo_key', 'memoized', 'img_id')
+
+    def __init__(self, url, summary=None, favicon=None, illustration=None, rss_delta=0,
+                 memo_key=None, memoized=False, img_id=None):
+        self.url = url
+        self.summary = summary
+        self.favicon = favicon
+        self.illustration = illustration
+        # How much the RSS grew extracting it, in KB, see utils.current_rss
+        self.rss_delta = rss_delta
+        # (digest of the body, extractor version), set if the body was looked up in a memo
+        self.memo_key = memo_key
+        # Memoized results refer to an already stored image instead of an illustration
+        self.memoized = memoized
+        self.img_id = img_id
+
+    def get_summary(self, max_length=None):
+        return self.summary
+
+    def get_favicon_url(self):
+        return self.favicon
+
+    def get_illustration(self):
+        return self.illustration
+
+    def __repr__(self):
+        return '<ExtractionResult %s>' % self.url
@@ -1,6 +1,16 @@
 #coding: utf-8
 import re
+import cgi
+import mmap
+import codecs
+import resource
+import hashlib
+import tempfile
 import requests
+import cchardet
+from time import time
+from functools import wraps
+from collections import OrderedDict
 from backports.functools_lru_cache import lru_cache
 
 # def word_count(s):
@@ -34,21 +44,152 @@ def tokenize(s):  # not using yield just for cache
                 tokens.extend(list(t))
     return tuple(tokens)  # sorry but list is unhashable
 
+# Bodies larger than this are spooled to a temporary file instead of the heap
+SPOOL_THRESHOLD = 1024*1024
+
+class BodyTooLarge(IOError):
+    pass
+
+def read_body(resp, max_size=None, threshold=SPOOL_THRESHOLD, chunk_size=64*1024, head=''):
+    """
+    Read the body of a streamed (`stream=True`) response. Small bodies are returned
+    as a str, larger ones are spooled to a temporary file and returned memory-mapped,
+    which supports `len`, slicing, `read` and `seek` just like a str or a file.
+    `head` is what has already been consumed from the response, e.g. while probing.
+    """
+    chunks, size, spool = [head], len(head), None
+    try:
+        if max_size and size > max_size:
+            raise BodyTooLarge('Body of %s is larger than %s bytes' % (resp.url, max_size))
+        for chunk in resp.iter_content(chunk_size):
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise BodyTooLarge('Body of %s is larger than %s bytes' % (resp.url, max_size))
+            if spool is not None:
+                spool.write(chunk)
+                continue
+            chunks.append(chunk)
+            if size > threshold:
+                spool = tempfile.TemporaryFile()
+                spool.writelines(chunks)
+                chunks = None
+    finally:
+        resp.close()
+    if spool is None:
+        return ''.join(chunks)
+    try:
+        spool.flush()
+        # The mapping stays valid after the file is closed
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        spool.close()
+
+whitespaces_patt = re.compile(r'\s+', re.U)
+
+def body_digest(body, url=None):
+    """
+    Hex digest of a page body, unicode ones are normalized first so that
+    changes in whitespaces only do not make a difference.
+    Memory-mapped bodies are hashed in place. The `url` it was fetched from
+    is hashed in too if given, e.g. favicons are resolved against it.
+    """
+    if isinstance(body, unicode):
+        body = whitespaces_patt.sub(u' ', body).strip().encode('utf-8')
+    digest = hashlib.sha1(body)
+    if url is not None:
+        digest.update('\0' + (url.encode('utf-8') if isinstance(url, unicode) else url))
+    return digest.hexdigest()
+
+def peak_rss():
+    """Peak resident set size of this process so far, in KB on linux"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+PAGE_KB = resource.getpagesize() // 1024
+
+def current_rss():
+    """
+    Resident set size of this process right now, in KB, so the memory taken by
+    a single step can be told. Falls back to the peak without /proc, e.g. on OS X
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_KB
+    except (IOError, IndexError, ValueError):
+        return peak_rss()
+
 def my_default_user_agent(name="python-requests"):
     return 'Twitterbot/1.0'
     # return "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_0) AppleWebKit/537.36 " \
     #        "(KHTML, like Gecko) Chrome/45.0.2454.101 Safari/537.36"
 
+# Where to look for the charset of a page, in bytes
+CHARSET_META_BYTES = 16*1024
+CHARDET_SAMPLE_BYTES = 64*1024
+
+# UTF-32 goes first, as its little-endian BOM starts with the one of UTF-16
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+meta_charset_patt = re.compile(r"""<meta[^>]+charset\s*=\s*["']?\s*([-\w.:]+)""", re.I)
+xml_encoding_patt = re.compile(r"""^<\?xml[^>]+encoding\s*=\s*["']([-\w.:]+)""", re.I)
+
+def valid_encoding(name):
+    """Returns the name if python knows how to decode it"""
+    if not name:
+        return None
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return name
+
+def get_encoding_from_headers(headers):
+    """Only the charset set explicitly, requests falls back to ISO-8859-1 for all texts"""
+    content_type = headers.get('content-type')
+    if not content_type:
+        return None
+    return valid_encoding(cgi.parse_header(content_type)[1].get('charset', '').strip('\'"'))
+
+def detect_encoding(headers, body):
+    """
+    Guess the charset of a page by looking, in order, at the BOM, the
+    content-type header, <meta> tags in the first CHARSET_META_BYTES and
+    finally cchardet on a sample of the first CHARDET_SAMPLE_BYTES.
+    The body is never scanned or decoded as a whole here.
+    """
+    for bom, encoding in BOMS:
+        if body[:len(bom)] == bom:
+            return encoding
+    encoding = get_encoding_from_headers(headers)
+    if encoding:
+        return encoding
+    head = body[:CHARSET_META_BYTES]
+    for patt in (xml_encoding_patt, meta_charset_patt):
+        m = patt.search(head)
+        if m and valid_encoding(m.group(1)):
+            return m.group(1)
+    encoding = valid_encoding(cchardet.detect(body[:CHARDET_SAMPLE_BYTES])['encoding'])
+    if not encoding:
+        return 'ISO-8859-1'
+    # An ascii sample may well be followed by some non-ascii utf-8 bytes
+    return 'utf-8' if codecs.lookup(encoding).name == 'ascii' else encoding
+
 origin_build_response = requests.adapters.HTTPAdapter.build_response.im_func
 
 def my_build_response(self, req, resp):
-    """Get encoding from html content instead of setting it blindly to ISO-8859-1"""
+    """Leave the encoding unset instead of setting it blindly to ISO-8859-1, it is detected
+    only when `resp.text` is asked for, see my_apparent_encoding. Reading the content here
+    would read streamed bodies as a whole, before read_body could cap them"""
     r = origin_build_response(self, req, resp)
-    if r.encoding == 'ISO-8859-1':
-        r.encoding = (requests.utils.get_encodings_from_content(r.content) \
-                    or ['ISO-8859-1'])[-1]  # the last one overwrites the first one
+    if r.encoding == 'ISO-8859-1' and not get_encoding_from_headers(r.headers):
+        r.encoding = None
     return r
 
+def my_apparent_encoding(self):
+    """Get encoding from the head of the content instead of running chardet on all of it,
+    so `resp.text` decodes the body exactly once"""
+    return detect_encoding(self.headers, self.content)
+
 origin_send = requests.adapters.HTTPAdapter.send.im_func
 
 def send_with_default_args(*args, **kwargs):
@@ -60,8 +201,37 @@ def monkey_patch_requests():
     # A monkey patch to impersonate my chrome
     requests.utils.default_user_agent = my_default_user_agent
     requests.adapters.HTTPAdapter.build_response = my_build_response
+    requests.models.Response.apparent_encoding = property(my_apparent_encoding)
     requests.adapters.HTTPAdapter.send = send_with_default_args
 
+def ttl_cache(maxsize=128, ttl=60*60, keep=None):
+    """
+    Like lru_cache, but entries expire `ttl` seconds after they are computed,
+    exceptions are not cached, nor values `keep(value)` is false for
+    """
+    def decorating(func):
+        cache = OrderedDict()
+
+        @wraps(func)
+        def wrapper(*args):
+            now = time()
+            if args in cache:
+                value, expires_at = cache.pop(args)
+                if expires_at > now:
+                    cache[args] = value, expires_at  # the most recently used goes last
+                    return value
+            value = func(*args)
+            if keep is not None and not keep(value):
+                return value
+            cache[args] = value, now + ttl
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorating
+
 @lru_cache(maxsize=128)
 def LCS_length(x, y):
     """
@@ -4,14 +4,20 @@ from urlparse import urlparse, urljoin
 
 import requests
 import imgsz
+from .utils import read_body, BodyTooLarge
 from backports.functools_lru_cache import lru_cache
 
 logger = logging.getLogger(__name__)
 
 class WebImage(object):
+    __slots__ = ('url', 'referrer', 'attrs', 'content_type', '_raw_data', '_is_candidate',
+                 '_resp', '_head')
     MIN_PX = 100
     MIN_BYTES_SIZE = 4000
     MAX_BYTES_SIZE = 2.5*1024*1024
+    # Give up probing the size if the header is not found in these bytes
+    PROBE_MAX_BYTES = 256*1024
+    PROBE_CHUNK_SIZE = 4096
     SCALE_FROM_IMG_TO_TEXT = 22*22
 
     def __init__(self, src='', referrer='', **attrs):
@@ -42,9 +48,11 @@ class WebImage(object):
         # self.img_area_px = self.equivalent_text_len()
         if not (width and height):
             logger.info('Failed on determining the image size of %s', self.url)
+            self.release()
             return False
         if not self.check_dimension(width, height):
             logger.info('Failed on dimension check(width=%s height=%s) %s', width, height, self.url)
+            self.release()
             return False
         if not self.check_image_bytesize():
             logger.info('Failed on image bytesize check, size is %s, %s', len(self.raw_data), self.url)
@@ -59,23 +67,72 @@ class WebImage(object):
         if width.isdigit() and height.isdigit():
             return int(width), int(height)
 
+        if hasattr(self, '_raw_data'):
+            data = self._raw_data
+        else:
+            data = self.probe()
         try:
-            return imgsz.fromstring(self.raw_data)[1:]
+            return imgsz.fromstring(data)[1:]
         except ValueError as e:
             logger.error('Error while determing the size of %s, %s', self.url, e)
         return 0, 0
 
+    def fetch(self):
+        resp = requests.get(self.url, headers={'Referer': self.referrer}, stream=True)
+        # meta info
+        self.url = resp.url
+        self.content_type = resp.headers['Content-Type']
+        return resp
+
+    def probe(self):
+        """
+        Download just enough bytes to tell the size, the rest is left
+        in the response, to be read only if we want this image.
+        """
+        try:
+            resp = self.fetch()
+        except (IOError, KeyError) as e:
+            logger.info('Failed to fetch img(%s), %s', self.url, e)
+            return ''
+        prober = imgsz.Prober()
+        try:
+            for chunk in resp.iter_content(self.PROBE_CHUNK_SIZE):
+                if prober.feed(chunk) or prober.size > self.PROBE_MAX_BYTES:
+                    self._resp, self._head = resp, prober.data
+                    break
+            else:  # all downloaded
+                self._raw_data = prober.data
+        except ValueError:  # unknown format
+            self._resp, self._head = resp, prober.data
+        except IOError as e:
+            logger.info('Failed to fetch img(%s), %s', self.url, e)
+        if not hasattr(self, '_resp'):
+            resp.close()
+        return prober.data
+
+    def release(self):
+        """Drop the pending download"""
+        if getattr(self, '_resp', None) is not None:
+            self._resp.close()
+            self._resp = self._head = None
+
     @property
     def raw_data(self):
         if hasattr(self, '_raw_data'):
             return self._raw_data
         try:
-            resp = requests.get(self.url, headers={'Referer': self.referrer})
-            # meta info
-            self.url = resp.url
-            self._raw_data = resp.content
-            self.content_type = resp.headers['Content-Type']
-            return resp.content
+            if getattr(self, '_resp', None) is not None:
+                resp, head = self._resp, self._head
+                self._resp = self._head = None
+            else:
+                resp, head = self.fetch(), ''
+            # Large ones are memory-mapped, see read_body
+            self._raw_data = read_body(resp, max_size=self.MAX_BYTES_SIZE, head=head)
+            return self._raw_data
+        except BodyTooLarge as e:
+            logger.info('Image is too large(%s), %s', self.url, e)
+            self._raw_data = ''
+            return ''
         except (IOError, KeyError) as e:
             # if anything goes wrong, do not set self._raw_data
             # so it will try again the next time.
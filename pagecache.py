@@ -0,0 +1,96 @@
+"""
+Rendered front pages with their gzip and brotli variants, kept until the site
+is updated again, so a page is rendered and compressed once per update instead
+of once per request. Brotli is used only when the brotli module is installed.
+"""
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, pages are only gzipped then
+    brotli = None
+    logger.warning('brotli is not installed, front pages are sent gzipped only')
+
+# Preferred first when the client accepts them equally
+ENCODINGS = ('br', 'gzip', 'identity')
+
+def gzip_compress(data, level=9):
+    # No file name or mtime in the header, the same page always compresses the same
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+class Page(object):
+    __slots__ = ('generation', 'etag', 'bodies')
+
+    def __init__(self, generation, html, brotli_quality=11):
+        body = html.encode('utf-8') if isinstance(html, unicode) else html
+        self.generation = generation
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.bodies = {'identity': body, 'gzip': gzip_compress(body)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=brotli_quality)
+
+    def negotiate(self, accept_encodings):
+        """The best encoding of the werkzeug Accept-Encoding header"""
+        return accept_encodings.best_match([e for e in ENCODINGS if e in self.bodies], 'identity')
+
+    def etag_of(self, encoding):
+        """Strong ETags differ by encoding, the bytes sent differ"""
+        return self.etag if encoding == 'identity' else '%s-%s' % (self.etag, encoding)
+
+class PageCache(object):
+
+    def __init__(self, max_pages=8, brotli_quality=11):
+        # Oldest rendered first, keys come from requests, e.g. their Host, so they are capped
+        self.pages = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.max_pages = max_pages
+        # 11 is the smallest but slowest, fine for a page rendered once per update
+        self.brotli_quality = brotli_quality
+
+    def lock_of(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def peek(self, key, generation):
+        page = self.pages.get(key)
+        if page is not None and page.generation == generation:
+            return page
+        return None
+
+    def put(self, key, generation, html):
+        page = Page(generation, html, self.brotli_quality)
+        with self.lock:
+            self.pages.pop(key, None)
+            self.pages[key] = page
+            while len(self.pages) > self.max_pages:
+                oldest, _ = self.pages.popitem(last=False)
+                self.locks.pop(oldest, None)
+        logger.info('Rendered %s of %s, %s', key, generation,
+                    dict((e, len(b)) for e, b in page.bodies.iteritems()))
+        return page
+
+    def get(self, key, generation, render):
+        """
+        The page of `key` rendered for `generation`, e.g. when the site was last
+        updated. Concurrent misses wait for the first one to render it.
+        """
+        page = self.peek(key, generation)
+        if page is not None:
+            return page
+        with self.lock_of(key):
+            page = self.peek(key, generation)
+            if page is None:
+                page = self.put(key, generation, render())
+        return page
+
+    def keys(self):
+        with self.lock:
+            return self.pages.keys()
@@ -0,0 +1,171 @@
+"""
+In-process inverted index of titles and summaries of items, live and archived,
+so searching is intersecting a few sets instead of scanning every title with ILIKE.
+
+Terms come from page_content_extractor.utils.tokenize, ascii words and single CJK
+characters, so CJK queries match items having all their characters. Each worker
+keeps its own index of a site and catches up whenever the generation of the site
+moves, see index.search_index: only new or changed texts are tokenized again.
+"""
+import os
+import zlib
+import string
+import threading
+from collections import namedtuple
+
+from page_content_extractor.utils import tokenize
+
+# key is ('item', url) or ('archive', id), the same url may be in both
+Doc = namedtuple('Doc', 'key url title score submit_time comment_url checksum')
+
+def terms(text):
+    """Distinct lowercase terms of `text`, punctuation around words dropped"""
+    if not text:
+        return frozenset()
+    found = set()
+    for token in tokenize(text.lower()):
+        token = token.strip().strip(string.punctuation)
+        if token:
+            found.add(token)
+    return frozenset(found)
+
+def checksum(title, summary):
+    return zlib.crc32((title or u'').encode('utf-8')) ^ zlib.crc32((summary or u'').encode('utf-8'))
+
+class WorkerLock(object):
+    """
+    A lock made when first taken in a process. The app is preloaded before gunicorn
+    forks workers and gevent patches them, a threading.Lock made at import would
+    block the whole worker instead of only the greenlet waiting for it.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.lock = None
+
+    def __enter__(self):
+        if self.pid != os.getpid():
+            self.lock, self.pid = threading.Lock(), os.getpid()
+        return self.lock.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.lock.__exit__(*exc_info)
+
+class SearchIndex(object):
+    """Rows are taken as lists, no query is ever run while the lock is held"""
+
+    def __init__(self):
+        self.docs = {}
+        self.terms = {}  # key -> terms, to remove it from postings
+        self.postings = {}  # term -> set of keys
+        self.lock = WorkerLock()
+        self.generation = None
+        # Archived rows after this are not indexed yet
+        self.archived_until = None
+        # Keys of all docs, newest first, sorted again after docs are added or removed
+        self.newest = None
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, key, url, title, summary, score, submit_time, comment_url):
+        """Index a new or changed item, texts are tokenized only if they changed"""
+        digest = checksum(title, summary)
+        old = self.docs.get(key)
+        self.docs[key] = Doc(key, url, title, score, submit_time, comment_url, digest)
+        if old is None or old.submit_time != submit_time:
+            self.newest = None
+        if old is not None and old.checksum == digest:
+            return False
+        self.unindex(key)
+        found = terms(title) | terms(summary)
+        # A tuple takes a fraction of a set
+        self.terms[key] = tuple(found)
+        for term in found:
+            self.postings.setdefault(term, set()).add(key)
+        return True
+
+    def unindex(self, key):
+        for term in self.terms.pop(key, ()):
+            keys = self.postings[term]
+            keys.discard(key)
+            if not keys:
+                del self.postings[term]
+
+    def remove(self, key):
+        if self.docs.pop(key, None) is not None:
+            self.newest = None
+        self.unindex(key)
+
+    def sync_items(self, rows):
+        """
+        `rows` of (url, title, summary, score, submit_time, comment_url) are all
+        the live items of the site, those gone from it are removed
+        """
+        with self.lock:
+            seen, changed = set(), 0
+            for url, title, summary, score, submit_time, comment_url in rows:
+                key = ('item', url)
+                seen.add(key)
+                changed += self.add(key, url, title, summary, score, submit_time, comment_url)
+            gone = [key for key in self.docs if key[0] == 'item' and key not in seen]
+            for key in gone:
+                self.remove(key)
+        return changed, len(gone)
+
+    def add_archived(self, rows, expired_before=None):
+        """
+        `rows` of (id, url, title, summary, score, submit_time, comment_url, archived_at)
+        archived since the last call, those submitted before `expired_before` are removed
+        """
+        with self.lock:
+            added = 0
+            for id, url, title, summary, score, submit_time, comment_url, archived_at in rows:
+                added += self.add(('archive', id), url, title, summary, score, submit_time, comment_url)
+                if self.archived_until is None or archived_at > self.archived_until:
+                    self.archived_until = archived_at
+            expired = []
+            if expired_before is not None:
+                expired = [key for key, doc in self.docs.iteritems()
+                           if key[0] == 'archive' and doc.submit_time < expired_before]
+                for key in expired:
+                    self.remove(key)
+        return added, len(expired)
+
+    def search(self, query, gte=0, limit=30):
+        """Docs having every term of `query` and a score of at least `gte`, newest first"""
+        wanted = terms(query)
+        if not wanted:
+            return []
+        with self.lock:
+            # Rarest first, the intersection only gets smaller
+            postings = sorted((self.postings.get(term, ()) for term in wanted), key=len)
+            if len(postings[0]) * 8 > len(self.docs):
+                # Even the rarest is common, matches are met soon going from the newest
+                candidates = (self.docs[key] for key in self.newest_keys()
+                              if all(key in keys for keys in postings))
+            else:
+                keys = set(postings[0]).intersection(*postings[1:])
+                self.newest_keys()
+                candidates = (self.docs[key] for key in sorted(keys, key=self.positions.__getitem__))
+            found, urls = [], set()
+            for doc in candidates:
+                if (doc.score or 0) >= gte and doc.url not in urls:
+                    urls.add(doc.url)
+                    found.append(doc)
+                    if len(found) == limit:
+                        break
+            return found
+
+    @staticmethod
+    def recency(doc):
+        # Live items before their archived copies of the same time
+        return doc.submit_time, doc.key[0] == 'item'
+
+    def newest_keys(self):
+        if self.newest is None:
+            self.newest = [doc.key for doc in sorted(self.docs.itervalues(), key=self.recency, reverse=True)]
+            # Ints sort much faster than datetimes
+            self.positions = dict((key, i) for i, key in enumerate(self.newest))
+        return self.newest
@@ -0,0 +1,76 @@
+#coding: utf-8
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import zlib
+from unittest import TestCase
+
+from page_content_extractor import batch
+
+HTML = '<html><head><link rel="icon" href="/me.ico"></head><body><p>%s</p></body></html>' % ('word '*100)
+
+def warc_record(warc_type, uri, block, content_type='application/http; msgtype=response'):
+    return ('WARC/1.0\r\nWARC-Type: %s\r\nWARC-Record-ID: <urn:uuid:%s>\r\nWARC-Target-URI: %s\r\n'
+            'Content-Type: %s\r\nContent-Length: %d\r\n\r\n%s\r\n\r\n') % (
+        warc_type, abs(hash((warc_type, uri))), uri, content_type, len(block), block)
+
+class BatchTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.output = os.path.join(self.root, 'out.jsonl')
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        return path
+
+    def records(self):
+        with open(self.output) as fp:
+            return [json.loads(line) for line in fp if not line.startswith('{"source": "trunc')]
+
+    def test_local_files_resumed(self):
+        first = self.write('first.html', HTML)
+        self.assertEqual(batch.run([first], self.output, workers=1), (1, 0, 0))
+        record, = self.records()
+        self.assertEqual(record['source'], first)
+        self.assertIsNone(record['error'])
+        self.assertTrue(record['summary'].startswith('word word'))
+        self.assertEqual(record['favicon'], 'file:///me.ico')
+        self.assertEqual(record['extractor'], 'HtmlContentExtractor')
+        self.assertItemsEqual(record['timings'], ['fetch', 'parse', 'summary', 'favicon', 'illustration'])
+
+        # Interrupted while writing
+        with open(self.output, 'ab') as fp:
+            fp.write('{"source": "trunc')
+        second = self.write('second.htm', HTML)
+        missing = os.path.join(self.root, 'missing.pdf')
+        self.assertEqual(batch.run([self.root, missing], self.output, workers=1), (2, 1, 1))
+        self.assertEqual([r['source'] for r in self.records()], [first, second, missing])
+        self.assertIn(' in parse: ', self.records()[-1]['error'])
+
+    def test_warc(self):
+        gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = gz.compress(HTML) + gz.flush()
+        chunked = '%x\r\n%s\r\n0\r\n\r\n' % (len(body), body)
+        response = ('HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                    'Content-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n' + chunked)
+        path = os.path.join(self.root, 'pages.warc.gz')
+        fp = gzip.open(path, 'wb')
+        fp.write(warc_record('warcinfo', '', 'software: test', 'application/warc-fields'))
+        fp.write(warc_record('request', 'http://local.host/', 'GET / HTTP/1.1\r\n\r\n',
+                             'application/http; msgtype=request'))
+        fp.write(warc_record('response', 'http://local.host/', response))
+        fp.close()
+
+        # Only responses are extracted
+        self.assertEqual(len(list(batch.expand_sources([path]))), 1)
+        self.assertEqual(batch.run([path], self.output, workers=2), (1, 0, 0))
+        record, = self.records()
+        self.assertEqual(record['url'], 'http://local.host/')
+        self.assertEqual(record['favicon'], 'http://local.host/me.ico')
+        self.assertTrue(record['summary'].startswith('word word'))
@@ -1,9 +1,12 @@
 import random
 from unittest import TestCase
-from models import StartupNews, Image
+import mock
+from datetime import datetime
+from models import HackerNews, StartupNews, Image, Archive, ItemHistory, session
 
 class DataBaseTestCase(TestCase):
 
+    @mock.patch('models.archive_retention_days', 0)
     def test_image_deleted(self):
         img_id = Image.add(content_type='image/jpeg', raw_data='010101')
         news = dict(
@@ -30,8 +33,125 @@ class DataBaseTestCase(TestCase):
         StartupNews.remove_except(existing_keys)
         # Ensure removed
         self.assertIsNone(StartupNews.query.get(pk))
+        Image.collect_garbage()
         self.assertIsNone(Image.query.get(img_id))
 
+    @mock.patch('models.archive_retention_days', 0)
+    def test_shared_image_kept(self):
+        img_id = Image.add(url='http://localhost/img', content_type='image/jpeg',
+                           raw_data=str(random.random()))
+        url = 'http://localhost/%s' % random.random()
+        existing_keys = [n.url for n in StartupNews.query.all()]
+        StartupNews.add(url=url, title='title', img_id=img_id)
+        HackerNews.add(url=url, title='title', img_id=img_id)
+
+        StartupNews.remove_except(existing_keys)
+        Image.collect_garbage(batch_size=1)
+        # Still referred to by hackernews
+        self.assertEqual(Image.query.get(img_id).id, img_id)
+
+        HackerNews.query.filter_by(url=url).delete()
+        Image.collect_garbage(batch_size=1)
+        self.assertIsNone(Image.query.get(img_id))
+
+    def test_diff(self):
+        stored = dict(rank=1, title='title', score=100, submit_time=datetime(2015, 1, 1))
+        self.assertEqual(StartupNews.diff(dict(rank=1, title='title', score='100',
+                                               submit_time=datetime.utcnow()), stored), {})
+        self.assertEqual(StartupNews.diff(dict(rank=2, title='title', score='101'), stored),
+                         dict(rank=2, score=101))
+
+    def test_sync(self):
+        url = 'http://localhost/%s' % random.random()
+        news = dict(rank=1, title='title', url=url, score='100', summary='Hello world!')
+        existing_keys = [n.url for n in StartupNews.query.all()]
+        stats = StartupNews.sync([news], remove_stale=False)
+        self.assertEqual((stats['added'], stats['updated']), (1, 0))
+
+        stats = StartupNews.sync([dict(news, rank=2), dict(news, url=None)], remove_stale=False)
+        self.assertEqual((stats['added'], stats['updated']), (0, 1))
+        # Errors are reported row by row
+        self.assertEqual(len(stats['errors']), 1)
+        self.assertEqual(StartupNews.query.get(url).rank, 2)
+
+        stats = StartupNews.sync([dict(news, rank=2)], remove_stale=False)
+        self.assertEqual((stats['updated'], stats['unchanged']), (0, 1))
+        StartupNews.remove_except(existing_keys)
+
+    def test_staged_with_sync(self):
+        url = 'http://localhost/%s' % random.random()
+        raw_data = str(random.random())
+        existing_keys = [n.url for n in StartupNews.query.all()]
+        img_id = Image.stage(None, 'image/jpeg', raw_data)
+        # Staged twice in a cycle, stored once
+        self.assertEqual(Image.stage(None, 'image/jpeg', raw_data), img_id)
+        session.rollback()
+        self.assertIsNone(Image.query.get(img_id))
+
+        Image.stage(None, 'image/jpeg', raw_data)
+        StartupNews.sync([dict(rank=1, title='title', url=url, img_id=img_id)], remove_stale=False)
+        session.rollback()
+        self.assertEqual(Image.query.get(img_id).id, img_id)
+        StartupNews.remove_except(existing_keys)
+
+    def test_sites_kept_apart(self):
+        url = 'http://localhost/%s' % random.random()
+        existing_keys = [n.url for n in StartupNews.query.all()]
+        StartupNews.add(url=url, title='startup')
+        HackerNews.add(url=url, title='hacker')
+        self.assertEqual(StartupNews.query.get(url).title, 'startup')
+        self.assertEqual(HackerNews.query.get(url).title, 'hacker')
+
+        StartupNews.remove_except(existing_keys)
+        self.assertIsNone(StartupNews.query.get(url))
+        self.assertEqual(HackerNews.query.get(url).title, 'hacker')
+        HackerNews.delete(url)
+        self.assertIsNone(HackerNews.query.get(url))
+
+    def test_archived(self):
+        url = 'http://localhost/%s' % random.random()
+        submit_time = datetime(2015, 1, 1, 12)
+        existing_keys = [n.url for n in HackerNews.query.all()]
+        HackerNews.add(url=url, title='title', submit_time=submit_time)
+        HackerNews.remove_except(existing_keys)
+        self.assertIsNone(HackerNews.query.get(url))
+        self.assertIn('archive_20150101', Archive.partitions())
+
+        # Back on the page and off it again
+        HackerNews.add(url=url, title='title', submit_time=submit_time)
+        HackerNews.remove_except(existing_keys)
+        items = Archive.browse('hackernews', datetime(2015, 1, 1))
+        self.assertEqual([item.url for item in items].count(url), 1)
+        last = items[-1]
+        self.assertNotIn(last.id, [item.id for item in Archive.browse(
+            'hackernews', datetime(2015, 1, 1), (last.submit_time, last.id))])
+
+        # Archived as submitted when it was moved
+        undated = 'http://localhost/%s' % random.random()
+        HackerNews.add(url=undated, title='title')
+        HackerNews.remove_except(existing_keys)
+        self.assertIsNone(HackerNews.query.get(undated))
+        self.assertIn(undated, [item.url for item in Archive.browse(
+            'hackernews', datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))])
+
+        self.assertIn('archive_20150101', Archive.drop_expired())
+        # Today's is never dropped
+        with mock.patch('models.archive_retention_days', 0):
+            self.assertNotIn(Archive.partition_name(datetime.utcnow()), Archive.drop_expired())
+        self.assertEqual(Archive.browse('hackernews', datetime(2015, 1, 1)), [])
+
     # def test_remove_on_empty_keys(self):
     #     # How to test a warning?
     #     self.storage.remove_except([])
+
+    def test_history(self):
+        url = 'http://localhost/%s' % random.random()
+        HackerNews.sync([dict(url=url, title='title', score='10', comment_cnt='1', rank=3)],
+                        remove_stale=False)
+        HackerNews.sync([dict(url=url, title='title', score='25', comment_cnt='discuss', rank=1)],
+                        remove_stale=False)
+        series = ItemHistory.series('hackernews', [url, 'http://localhost/never'])
+        self.assertEqual([sample[1:] for sample in series[url]], [(10, 1, 3), (25, None, 1)])
+        self.assertEqual(ItemHistory.series('startupnews', [url]), {})
+        HackerNews.query.filter_by(url=url).delete()
+        ItemHistory.query.filter_by(url=url).delete()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from flask import Flask, g
+from sqlalchemy import exc, text
+
+import dbpool
+
+class PoolTestCase(TestCase):
+
+    def setUp(self):
+        dbpool.stats.reset()
+
+    def test_pool_size(self):
+        # 18 connections left for 3 workers
+        self.assertEqual(dbpool.pool_size(20, 3), (3, 3))
+        self.assertEqual(dbpool.pool_size(20, 1), (9, 9))
+        # Never starved
+        self.assertEqual(dbpool.pool_size(5, 10), (1, 1))
+
+    def test_checkout_metrics(self):
+        pool = dbpool.MeteredQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1,
+                                       max_overflow=1, timeout=0.05)
+        first, second = pool.connect(), pool.connect()
+        stats = dbpool.stats.snapshot(pool)
+        self.assertEqual((stats['in_use'], stats['overflow'], stats['checkouts']), (2, 1, 2))
+
+        self.assertRaises(exc.TimeoutError, pool.connect)
+        stats = dbpool.stats.snapshot(pool)
+        self.assertEqual((stats['checkouts'], stats['timeouts']), (3, 1))
+        self.assertGreaterEqual(stats['wait_max_ms'], 50)
+
+        first.close()
+        second.close()
+        self.assertEqual(dbpool.stats.snapshot(pool)['in_use'], 0)
+
+class ReplicaTestCase(TestCase):
+    """
+    Two sqlite files stand in for the primary and the replica, set
+    REPLICA_TEST_DATABASES='<primary url> <replica url>' to use two postgres instead
+    """
+
+    def setUp(self):
+        if os.environ.get('REPLICA_TEST_DATABASES'):
+            primary, replica = os.environ['REPLICA_TEST_DATABASES'].split()
+        else:
+            root = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, root)
+            primary = 'sqlite:///' + os.path.join(root, 'primary.db')
+            replica = 'sqlite:///' + os.path.join(root, 'replica.db')
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = primary
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': replica}
+        self.app.config['REPLICA_CHECK_INTERVAL'] = 0
+        self.db = db = dbpool.MeteredSQLAlchemy(self.app)
+
+        class Note(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            text = db.Column(db.String)
+        self.Note = Note
+        self.now = datetime.utcnow()
+        for bind in (None, 'replica'):
+            engine = db.get_engine(self.app, bind)
+            Note.__table__.create(engine)
+            self.addCleanup(Note.__table__.drop, engine)
+            engine.execute('CREATE TABLE last_updated (table_name VARCHAR PRIMARY KEY, time_stamp TIMESTAMP)')
+            self.addCleanup(engine.execute, 'DROP TABLE last_updated')
+            engine.execute(text('INSERT INTO last_updated VALUES (:name, :ts)'), name='hackernews', ts=self.now)
+            engine.execute(text('INSERT INTO note (text) VALUES (:text)'), text=bind or 'primary')
+
+    def set_last_updated(self, bind, ts):
+        self.db.get_engine(self.app, bind).execute(text('UPDATE last_updated SET time_stamp = :ts'), ts=ts)
+
+    def test_reads_routed(self):
+        with self.app.test_request_context('/'):
+            self.assertTrue(self.db.use_replica())
+            self.assertEqual(self.Note.query.one().text, 'replica')
+            # Writes always go to the primary
+            self.db.session.add(self.Note(text='new'))
+            self.db.session.commit()
+            self.Note.query.filter_by(text='primary').delete()
+            self.db.session.commit()
+            g.use_replica = False
+            self.assertEqual([n.text for n in self.Note.query], ['new'])
+        with self.app.test_request_context('/'):
+            self.assertEqual(self.Note.query.one().text, 'new')
+
+    def test_stale_replica(self):
+        self.set_last_updated(None, self.now + timedelta(minutes=10))
+        with self.app.test_request_context('/'):
+            self.assertFalse(self.db.use_replica())
+            self.assertEqual(self.Note.query.one().text, 'primary')
+        # Replayed
+        self.set_last_updated('replica', self.now + timedelta(minutes=10))
+        with self.app.test_request_context('/'):
+            self.assertTrue(self.db.use_replica())
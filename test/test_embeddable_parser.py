@@ -1,6 +1,8 @@
 from unittest import TestCase
 import requests
+import mock
 
+from page_content_extractor import legendary_parser_factory
 from page_content_extractor.embeddable import *
 
 class EmbeddableParserTestCase(TestCase):
@@ -64,3 +66,30 @@ class EmbeddableParserTestCase(TestCase):
         self.assertEqual(parser.get_summary(),
                          '<script src="https://gist.github.com/polyrabbit/5693787.js"></script>')
         self.assertRaises(ParseError, EmbeddableExtractor, 'whatever', 'https://gist.github.com/')
+
+    @mock.patch('page_content_extractor.embeddable.requests')
+    def test_favicon_cached_per_host(self, mock_requests):
+        EmbeddableExtractor.favicon_cache.clear()
+        self.addCleanup(EmbeddableExtractor.favicon_cache.clear)
+        mock_requests.get.return_value.text = '<head><link rel="icon" href="/yt.ico"></head>'
+        mock_requests.get.return_value.url = 'https://www.youtube.com/watch?v=db-7J5OaSag'
+        for vid in ('db-7J5OaSag', 'abc'):
+            parser = EmbeddableExtractor(None, 'https://www.youtube.com/watch?v=%s' % vid)
+            self.assertEqual(parser.get_favicon_url(), 'https://www.youtube.com/yt.ico')
+        self.assertEqual(mock_requests.get.call_count, 1)
+
+    @mock.patch('page_content_extractor.requests')
+    def test_embeddable_not_fetched(self, mock_requests):
+        parser = legendary_parser_factory('https://vimeo.com/105196878')
+        self.assertIsInstance(parser, EmbeddableExtractor)
+        self.assertFalse(mock_requests.get.called)
+
+    @mock.patch('page_content_extractor.embeddable.requests')
+    def test_oembed_cached(self, mock_requests):
+        fetch_oembed.cache_clear()
+        self.addCleanup(fetch_oembed.cache_clear)
+        mock_requests.get.return_value.json.return_value = {'html': '<iframe></iframe>'}
+        for _ in xrange(3):
+            parser = EmbeddableExtractor(None, 'http://www.slideshare.net/earnestagency/the-yes-factor')
+            self.assertEqual(parser.get_summary(), '<iframe></iframe>')
+        self.assertEqual(mock_requests.get.call_count, 1)
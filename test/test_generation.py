@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import multiprocessing
+from datetime import timedelta
+from unittest import TestCase
+
+from generation import SharedGenerations, EPOCH, SEQ
+
+WRITERS = 4
+BUMPS = 300
+
+def write(path, n):
+    generations = SharedGenerations(path)
+    for i in xrange(BUMPS):
+        generations.bump('hackernews', EPOCH + timedelta(microseconds=n * 10**7 + i + 1))
+
+def read(path, errors):
+    generations = SharedGenerations(path)
+    last_generation, last_seen = 0, {}
+    for _ in xrange(20000):
+        record = generations.read('hackernews')
+        if record is None:
+            continue
+        micros = int((record.updated_at - EPOCH).total_seconds() * 10**6)
+        n, i = divmod(micros, 10**7)
+        if record.generation < last_generation or n >= WRITERS or not 0 < i <= BUMPS \
+                or i < last_seen.get(n, 0):
+            errors.put(record)
+            return
+        last_generation, last_seen[n] = record.generation, i
+        if record.generation == WRITERS * BUMPS:
+            return
+
+class SharedGenerationsTestCase(TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.path = os.path.join(root, 'generations')
+
+    def test_across_processes(self):
+        errors = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=read, args=(self.path, errors)) for _ in range(2)]
+        procs += [multiprocessing.Process(target=write, args=(self.path, n)) for n in range(WRITERS)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        self.assertTrue(errors.empty())
+        self.assertEqual(SharedGenerations(self.path).read('hackernews').generation, WRITERS * BUMPS)
+
+    def test_sync(self):
+        generations = SharedGenerations(self.path)
+        self.assertIsNone(generations.read('hackernews'))
+        self.assertIsNone(generations.read('unknown'))
+        ts = EPOCH + timedelta(days=1, microseconds=1)
+        self.assertEqual(generations.sync('hackernews', ts), 1)
+        # Nothing new
+        self.assertEqual(generations.sync('hackernews', ts), 1)
+        self.assertEqual(generations.read('hackernews').updated_at, ts)
+        self.assertIsNone(generations.read('startupnews'))
+
+    def test_writer_killed(self):
+        generations = SharedGenerations(self.path)
+        generations.bump('hackernews', EPOCH + timedelta(days=1))
+        SEQ.pack_into(generations.map, 0, 3)
+        generations.MAX_RETRIES = 10
+        self.assertIsNone(generations.read('hackernews'))
+        self.assertEqual(generations.bump('hackernews', EPOCH + timedelta(days=2)), 2)
+        self.assertEqual(generations.read('hackernews').updated_at, EPOCH + timedelta(days=2))
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import history
+
+class HistoryTestCase(TestCase):
+
+    def test_round_trip(self):
+        start = datetime(2015, 1, 1)
+        samples = [(start, 1, None, 30), (start + timedelta(minutes=10), 5, 0, 12),
+                   (start + timedelta(minutes=20), 4, 300, 1), (start + timedelta(days=3), None, 2**40, None)]
+        self.assertEqual(history.decode(history.encode(samples)), samples)
+        # Appended to an existing series
+        data = history.encode(samples[:2]) + history.encode(samples[2:], last=samples[1])
+        self.assertEqual(history.decode(data), samples)
+
+    def test_compact(self):
+        start = datetime(2015, 1, 1)
+        samples = [(start + timedelta(minutes=10*i), 100 + i, 20 + i//3, 30 - i//10) for i in range(100)]
+        data = history.encode(samples)
+        # 2 bytes of 600 seconds and a byte of each change, after the first one
+        self.assertLessEqual(len(data), 10 + 99*5)
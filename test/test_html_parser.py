@@ -2,6 +2,7 @@
 import os.path
 import logging
 import unittest
+import mock
 from unittest import TestCase
 
 from bs4 import BeautifulSoup as BS
@@ -204,6 +205,54 @@ class PageContentExtractorTestCase(TestCase):
         except AttributeError as e:
             self.fail('%s, maybe delete something while looping.' % e)
 
+    def test_cap_html(self):
+        html_doc = '<p>%s</p>' % ('a'*100) * 10
+        self.assertEqual(cap_html(html_doc, max_chars=10), html_doc[:10])
+        self.assertEqual(cap_html(html_doc, max_nodes=4), '<p>%s</p>' % ('a'*100) * 2)
+        self.assertEqual(cap_html(html_doc), html_doc)
+
+    @mock.patch('page_content_extractor.legendary_parser_factory')
+    def test_extract_low_memory(self, mock_factory):
+        mock_factory.return_value = HtmlContentExtractor('<p>%s</p>' % ('a '*200), 'http://local.host')
+        result = extract('http://local.host', 10, low_memory=True)
+        self.assertTrue(result.summary.endswith('...'))
+        self.assertEqual(result.favicon, 'http://local.host/favicon.ico')
+        self.assertIsNone(result.illustration)
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertIsInstance(result.rss_delta, (int, long))
+        # The tree is torn down
+        self.assertIsNone(mock_factory.return_value.doc.find('p'))
+
+    @mock.patch('page_content_extractor.requests')
+    def test_extract_memoized(self, mock_requests):
+        resp = mock_requests.get.return_value
+        resp.url = 'http://local.host/'
+        resp.headers = {'content-type': 'text/html'}
+        resp.text = u'<p>%s</p>' % ('a '*200)
+        memo = mock.Mock()
+        memo.lookup.return_value = None
+        result = extract('http://local.host/', 10, memo=memo)
+        self.assertFalse(result.memoized)
+        digest, version = result.memo_key
+        memo.lookup.assert_called_once_with(digest, version)
+
+        # Only whitespaces changed
+        resp.text = u'<p>%s</p>\n' % ('a  '*200)
+        memo.lookup.return_value = ExtractionResult(None, 'memoized', memo_key=result.memo_key,
+                                                    memoized=True, img_id='img')
+        result = extract('http://local.host/', 10, memo=memo)
+        self.assertTrue(result.memoized)
+        self.assertEqual(result.summary, 'memoized')
+        self.assertEqual(result.url, 'http://local.host/')
+        memo.lookup.assert_called_with(digest, version)
+        # A different summary length is never a hit
+        extract('http://local.host/', 20, memo=memo)
+        self.assertNotEqual(memo.lookup.call_args[0][1], version)
+        # Nor the same bytes from another url
+        resp.url = 'http://parked.domain/'
+        extract('http://parked.domain/', 10, memo=memo)
+        self.assertNotEqual(memo.lookup.call_args[0][0], digest)
+
     def test_CJK(self):
         html_doc = u'我'*1000
         self.assertLess(len(HtmlContentExtractor(html_doc).get_summary()), 1000)
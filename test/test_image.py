@@ -1,5 +1,6 @@
 #coding: utf-8
 import os
+from struct import pack
 from unittest import TestCase
 import mock
 
@@ -12,11 +13,76 @@ class SvgSizeTestCase(TestCase):
         fpath = os.path.join(os.path.dirname(__file__), 'fixtures/no-px-floating-point.svg')
         self.assertEqual(size(fpath), ('SVG', 90, 20))
 
+def box(box_type, payload):
+    return pack('!L', len(payload)+8) + box_type + payload
+
+class ModernFormatsTestCase(TestCase):
+
+    def test_webp(self):
+        vp8 = 'RIFF\x00\x00\x00\x00WEBPVP8 \x00\x00\x00\x00\x00\x00\x00\x9d\x01\x2a' + pack('<HH', 640, 480)
+        self.assertEqual(fromstring(vp8), ('WEBP', 640, 480))
+        vp8l = 'RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00\x2f' + pack('<L', 639 | 479 << 14)
+        self.assertEqual(fromstring(vp8l), ('WEBP', 640, 480))
+        vp8x = 'RIFF\x00\x00\x00\x00WEBPVP8X\x00\x00\x00\x00\x00\x00\x00\x00' + \
+                pack('<L', 1999)[:3] + pack('<L', 999)[:3]
+        self.assertEqual(fromstring(vp8x), ('WEBP', 2000, 1000))
+
+    def test_avif(self):
+        ispe = lambda w, h: box('ispe', '\x00'*4 + pack('!LL', w, h))
+        meta = box('meta', '\x00'*4 + box('hdlr', '\x00'*20) +
+                   box('iprp', box('ipco', ispe(320, 240) + ispe(1280, 720))))
+        data = box('ftyp', 'avif\x00\x00\x00\x00mif1miaf') + meta
+        self.assertEqual(fromstring(data), ('AVIF', 1280, 720))
+        self.assertEqual(fromstring(memoryview(data)), ('AVIF', 1280, 720))
+
+    def test_ico(self):
+        entry = lambda w, h: pack('<BBBBHHLL', w, h, 0, 0, 1, 32, 0, 0)
+        data = pack('<HHH', 0, 1, 2) + entry(16, 16) + entry(0, 0)
+        self.assertEqual(fromstring(data), ('ICO', 256, 256))
+
+    def test_need_more_data(self):
+        data = 'RIFF\x00\x00\x00\x00WEBPVP8X\x00\x00\x00\x00'
+        with self.assertRaises(NeedMoreData) as cm:
+            fromstring(data)
+        self.assertEqual(cm.exception.needed, 30)
+        self.assertRaises(NeedMoreData, fromstring, '\xFF')
+
+    def test_text_header_window(self):
+        self.assertEqual(fromstring('<svg width="90" height="20">'), ('SVG', 90, 20))
+        with self.assertRaises(NeedMoreData) as cm:
+            fromstring('<?xml version="1.0"?>\n<sv')
+        self.assertEqual(cm.exception.needed, 4096)
+        # A full window without the tag is not going to get one
+        malformed = '<?xml version="1.0"?>\n<!--' + ' '*8192 + '-->'
+        self.assertRaises(NeedMoreData, fromstring, malformed[:100])
+        with self.assertRaises(ValueError) as cm:
+            fromstring(malformed)
+        self.assertNotIsInstance(cm.exception, NeedMoreData)
+        prober = Prober()
+        with self.assertRaises(ValueError) as cm:
+            for i in xrange(0, len(malformed), 1000):
+                prober.feed(malformed[i:i+1000])
+        self.assertNotIsInstance(cm.exception, NeedMoreData)
+        self.assertLess(prober.size, 8192)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, fromstring, 'not an image at all')
+
+    def test_prober(self):
+        data = '\xFF\xD8' + '\xFF\xE0' + pack('!H', 100) + '\x00'*98 + \
+                '\xFF\xC2\x00\x11\x08' + pack('!HH', 480, 640) + '\x00'*1000
+        prober = Prober()
+        fed = 0
+        while not prober.feed(data[fed:fed+7]):
+            fed += 7
+        self.assertEqual(prober.result, ('JPEG', 640, 480))
+        self.assertLess(prober.size, 120)
+
 class WebImageTestCase(TestCase):
 
     @mock.patch('page_content_extractor.webimage.requests')
     def test_fetched_only_once(self, mock_requests):
-        mock_requests.get.return_value.content = ''
+        mock_requests.get.return_value.iter_content.return_value = []
         node = mock.Mock()
         node.attrs = {'src': 'https://avatars1.githubusercontent.com/u/2657334',
                      'whatever': 'whatever'}
@@ -25,6 +91,27 @@ class WebImageTestCase(TestCase):
             WebImage.from_node('https://github.com/polyrabbit/', node).is_candidate
         self.assertEquals(mock_requests.get.call_count, 1)
 
+    @mock.patch('page_content_extractor.webimage.requests')
+    def test_stop_after_header(self, mock_requests):
+        header = '\x89PNG\x0d\x0a\x1a\x0a\x00\x00\x00\x0dIHDR' + pack('!LL', 50, 50)
+        resp = mock_requests.get.return_value
+        resp.iter_content.return_value = iter([header, 'x'*4096, 'x'*4096])
+        img = WebImage('/small.png', 'http://example.com/')
+        self.assertFalse(img.is_candidate)
+        self.assertTrue(resp.close.called)
+        self.assertEqual(resp.iter_content.call_count, 1)
+
+    @mock.patch('page_content_extractor.webimage.requests')
+    def test_resume_after_probe(self, mock_requests):
+        header = '\x89PNG\x0d\x0a\x1a\x0a\x00\x00\x00\x0dIHDR' + pack('!LL', 500, 500)
+        chunks = iter([header, 'x'*4096, 'x'*4096])
+        resp = mock_requests.get.return_value
+        resp.iter_content.side_effect = lambda size: chunks
+        img = WebImage('/large.png', 'http://example.com/')
+        self.assertTrue(img.is_candidate)
+        self.assertEqual(img.raw_data, header + 'x'*8192)
+        self.assertEqual(mock_requests.get.call_count, 1)
+
     @mock.patch('page_content_extractor.webimage.urljoin', autospec=True)
     def test_no_src(self, mock_urljoin):
         import logging
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from imagecache import ImageCache, ENTRY_OVERHEAD
+
+class ImageCacheTestCase(TestCase):
+
+    def test_lru(self):
+        cache = ImageCache(max_bytes=3 * (ENTRY_OVERHEAD + 100))
+        for img_id in 'abc':
+            self.assertTrue(cache.put(img_id, 'image/png', img_id * 100))
+        # a is used, b is the least recently used now
+        self.assertEqual(cache.get('a').body, 'a' * 100)
+        cache.put('d', 'image/png', 'd' * 100)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c').content_type, 'image/png')
+        self.assertEqual(cache.stats()['bytes'], 3 * (ENTRY_OVERHEAD + 100))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (2, 1))
+
+    def test_budget(self):
+        cache = ImageCache(max_bytes=8000)
+        self.assertFalse(cache.put('large', 'image/png', 'x' * 1001))
+        self.assertIsNone(cache.get('large'))
+        # Only the content type
+        self.assertTrue(cache.put('stored', 'image/jpeg', None))
+        self.assertIsNone(cache.get('stored').body)
+        cache.put('stored', 'image/jpeg', 'x' * 1000)
+        self.assertEqual(cache.stats()['bytes'], ENTRY_OVERHEAD + 1000)
@@ -0,0 +1,39 @@
+import os
+import time
+import shutil
+import tempfile
+from hashlib import md5
+from unittest import TestCase
+
+import imagestore
+
+class ImageStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_content_addressed(self):
+        raw_data = '010101'
+        img_id = md5(raw_data).hexdigest()
+        path = imagestore.save(img_id, raw_data, self.root)
+        self.assertEqual(path, os.path.join(self.root, img_id[:2], img_id[2:4], img_id))
+        self.assertTrue(imagestore.exists(img_id, self.root))
+        self.assertEqual(imagestore.load(img_id, self.root), raw_data)
+        # Saved only once
+        self.assertEqual(imagestore.save(img_id, 'whatever', self.root), path)
+        self.assertEqual(imagestore.load(img_id, self.root), raw_data)
+        # No temporary files left
+        self.assertEqual(os.listdir(os.path.dirname(path)), [img_id])
+
+    def test_delete(self):
+        img_id = md5('010101').hexdigest()
+        imagestore.save(img_id, '010101', self.root)
+        self.assertEqual(imagestore.delete([img_id, 'd41d8cd98f00b204e9800998ecf8427e'], self.root), 1)
+        self.assertFalse(imagestore.exists(img_id, self.root))
+
+    def test_stored_before(self):
+        old, new = md5('old').hexdigest(), md5('new').hexdigest()
+        os.utime(imagestore.save(old, 'old', self.root), (time.time() - 7200,) * 2)
+        imagestore.save(new, 'new', self.root)
+        self.assertEqual(list(imagestore.stored_before(3600, self.root)), [old])
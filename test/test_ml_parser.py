@@ -0,0 +1,80 @@
+#coding: utf-8
+import os
+import re
+import json
+import codecs
+import unittest
+from io import BytesIO
+from unittest import TestCase
+
+import mock
+
+from page_content_extractor import get_html_extractor, extract_batch
+from page_content_extractor.batch import make_response
+from page_content_extractor.html import HtmlContentExtractor
+from page_content_extractor.ml import *
+
+LABELLED_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'labelled')
+
+@unittest.skipUnless(MLContentExtractor.available, 'numpy is not installed')
+class MLContentExtractorTestCase(TestCase):
+
+    def test_model_matches_features(self):
+        self.assertEqual(len(LinearModel.load().weights), len(FEATURES))
+
+    def test_parsing_empty_response(self):
+        self.assertEqual(MLContentExtractor(u'').article.text, '')
+
+    def test_link_intensive_node_loses(self):
+        html_doc = '<div class="menu"><ul>%s</ul></div><div><p>%s</p><p>%s</p></div>' % (
+            '<li><a href="#">link</a></li>'*50, 'a '*200, 'b '*200)
+        article = MLContentExtractor(html_doc).article
+        self.assertEqual(article.name, 'div')
+        self.assertNotIn('link', article.text)
+
+    def test_score_batch(self):
+        docs = ['<article><p>%s</p></article>' % ('a '*200), '', '<p>good</p>']
+        extractors = MLContentExtractor.score_batch([MLContentExtractor(d, defer=True) for d in docs])
+        self.assertEqual([e.article.name for e in extractors], ['article', u'[document]', 'p'])
+        self.assertTrue(extractors[0].get_summary().startswith('a a'))
+
+    def test_get_html_extractor(self):
+        self.assertIs(get_html_extractor('ml'), MLContentExtractor)
+        self.assertIs(get_html_extractor('whatever'), HtmlContentExtractor)
+
+    def test_extract_batch(self):
+        pages = {
+            'http://a.com/': '<article><p>%s</p></article>' % ('a '*200),
+            'http://b.com/': '<div><p>%s</p></div>' % ('b '*200),
+        }
+
+        def fetch(url):
+            if url not in pages:
+                raise IOError('not found')
+            return make_response(url, 200, {'Content-Type': 'text/html; charset=utf-8'}, BytesIO(pages[url]))
+        with mock.patch.object(MLContentExtractor, 'score_batch',
+                               wraps=MLContentExtractor.score_batch) as score_batch:
+            results = extract_batch(['http://a.com/', 'http://c.com/', 'http://b.com/'], 100, 'ml', fetch=fetch)
+        # Once for the whole cycle
+        self.assertEqual(score_batch.call_count, 1)
+        self.assertEqual(len(score_batch.call_args[0][0]), 2)
+        self.assertTrue(results[0].summary.startswith('a a'))
+        self.assertIsInstance(results[1], IOError)
+        self.assertTrue(results[2].summary.startswith('b b'))
+
+    def test_extract_batch_low_memory(self):
+        fetch = lambda url: make_response(url, 200, {'Content-Type': 'text/html'},
+                                          BytesIO('<p>%s</p>' % ('a '*200)))
+        with mock.patch.object(MLContentExtractor, 'score_batch') as score_batch:
+            results = extract_batch(['http://a.com/'], 100, 'ml', low_memory=True, fetch=fetch)
+        self.assertFalse(score_batch.called)
+        self.assertTrue(results[0].summary.startswith('a a'))
+
+    def test_labelled_pages(self):
+        with codecs.open(os.path.join(LABELLED_DIR, 'labels.json'), encoding='utf-8') as fp:
+            labels = json.load(fp)
+        for name, label in labels.iteritems():
+            html = codecs.open(os.path.join(LABELLED_DIR, name), encoding='utf-8').read()
+            for extractor in (HtmlContentExtractor, MLContentExtractor):
+                summary = re.sub(r'\s+', ' ', extractor(html).get_summary())
+                self.assertIn(label, summary, '%s of %s' % (extractor.__name__, name))
@@ -0,0 +1,61 @@
+#coding: utf-8
+import zlib
+import threading
+import time
+from unittest import TestCase
+
+from werkzeug.datastructures import Accept
+
+import pagecache
+from pagecache import PageCache, Page
+
+class PageCacheTestCase(TestCase):
+
+    def test_variants(self):
+        page = Page(1, u'<p>我</p>' * 100)
+        self.assertEqual(zlib.decompress(page.bodies['gzip'], 16 + zlib.MAX_WBITS), page.bodies['identity'])
+        self.assertEqual(page.negotiate(Accept([('gzip', 1), ('deflate', 1)])), 'gzip')
+        self.assertEqual(page.negotiate(Accept([('gzip', 0.5), ('identity', 1)])), 'identity')
+        self.assertEqual(page.negotiate(Accept()), 'identity')
+        self.assertNotEqual(page.etag_of('gzip'), page.etag_of('identity'))
+        # Same page, same bytes
+        self.assertEqual(Page(2, u'<p>我</p>' * 100).bodies['gzip'], page.bodies['gzip'])
+
+    def test_misses_coalesced(self):
+        cache = PageCache()
+        renders = []
+
+        def render():
+            renders.append(1)
+            time.sleep(0.05)
+            return u'page %s' % len(renders)
+        threads = [threading.Thread(target=cache.get, args=('hackernews', 1, render)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(cache.get('hackernews', 1, render).bodies['identity'], 'page 1')
+        # A new generation after an update
+        self.assertEqual(cache.get('hackernews', 2, render).bodies['identity'], 'page 2')
+
+    def test_capped(self):
+        cache = PageCache(max_pages=2)
+        for host in ('a', 'b', 'c'):
+            cache.get(('hackernews', host), 1, lambda: u'page')
+        self.assertEqual(sorted(cache.keys()), [('hackernews', 'b'), ('hackernews', 'c')])
+
+    def test_peek_put(self):
+        cache = PageCache()
+        self.assertIsNone(cache.peek('feed', 1))
+        cache.put('feed', 1, u'<feed/>')
+        self.assertEqual(cache.peek('feed', 1).bodies['identity'], '<feed/>')
+        # Stale once the site is updated
+        self.assertIsNone(cache.peek('feed', 2))
+
+    def test_brotli_quality(self):
+        if pagecache.brotli is None:
+            self.skipTest('brotli is not installed')
+        html = u'<p>我</p>' * 100
+        page = PageCache(brotli_quality=5).put('feed', 1, html)
+        self.assertEqual(pagecache.brotli.decompress(page.bodies['br']), page.bodies['identity'])
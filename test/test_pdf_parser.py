@@ -15,6 +15,21 @@ class PdfParserTestCase(TestCase):
             'Systems code is often written in low-level languages like C/C++, which offer'
         ))  # Should be no errors
 
+    def test_stop_once_summary_is_filled(self):
+        fpath = os.path.join(os.path.dirname(__file__), 'fixtures/cpi.pdf')
+        parser = PdfExtractor(open(fpath, 'rb').read())
+        parser.get_summary()
+        self.assertEqual(len(parser.page_texts), 1)
+
+    def test_max_pages(self):
+        fpath = os.path.join(os.path.dirname(__file__), 'fixtures/cpi.pdf')
+        parser = PdfExtractor(open(fpath, 'rb').read(), max_pages=2)
+        parser.article
+        self.assertEqual(len(parser.page_texts), 2)
+
+    def test_max_bytes(self):
+        self.assertRaises(ParseError, PdfExtractor, '%PDF-1.4' + ' '*100, max_bytes=10)
+
     # def test_text_order(self):
     #     parser = PdfExtractor(open('/tmp/fm_21-76_us_army_survival_manual_2006.pdf', 'rb').read())
     #     self.assertIsNone(parser.get_illustration())
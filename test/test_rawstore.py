@@ -0,0 +1,54 @@
+#coding: utf-8
+import os
+import shutil
+import tempfile
+import mock
+from unittest import TestCase
+
+from page_content_extractor import legendary_parser_factory, RawStore
+
+class RawStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def response(self, url, body, ct='text/html; charset=utf-8'):
+        resp = mock.Mock()
+        resp.url = url
+        resp.status_code = 200
+        resp.headers = {'content-type': ct}
+        resp.encoding = 'utf-8'
+        resp.content = body
+        resp.text = body.decode('utf-8')
+        return resp
+
+    def test_replay(self):
+        store = RawStore(self.root, codec='zlib')
+        url = 'http://local.host/'
+        body = (u'<html><p>%s</p></html>' % (u'我 '*500)).encode('utf-8')
+        with mock.patch('page_content_extractor.requests') as mock_requests:
+            mock_requests.get.return_value = self.response(url, body)
+            online = legendary_parser_factory(url, store=store)
+        self.assertEqual(len(store.fetches(url)), 1)
+
+        resp = store.replay(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Type'], 'text/html; charset=utf-8')
+        # Streamed in small reads
+        self.assertEqual(''.join(iter(lambda: resp.raw.read(100), '')), body)
+
+        offline = legendary_parser_factory(url, fetch=store.replay)
+        self.assertEqual(offline.get_summary(), online.get_summary())
+        self.assertRaises(IOError, store.replay, 'http://never.fetched/')
+
+    def test_prune(self):
+        store = RawStore(self.root, max_bytes=10**9, codec='zlib')
+        for i in range(3):
+            url = 'http://local.host/%s' % i
+            store.put(url, self.response(url, ''), os.urandom(1000))
+        store.max_bytes = 2500
+        self.assertEqual(store.prune(), 1)
+        # The oldest goes first
+        self.assertEqual(store.fetches('http://local.host/0'), [])
+        self.assertEqual(len(store.fetches('http://local.host/2')), 1)
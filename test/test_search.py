@@ -0,0 +1,76 @@
+#coding: utf-8
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import mock
+
+from search import SearchIndex, WorkerLock, terms
+
+class SearchIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2015, 1, 2)
+        self.index = SearchIndex()
+        self.index.sync_items([
+            ('http://a.com/', u'Python, the language', u'Why we love it', 100, self.now, None),
+            ('http://b.com/', u'Rust vs Python', None, 10, self.now - timedelta(hours=1), None),
+            ('http://c.com/', u'我的 Python 笔记', u'学习', 50, self.now - timedelta(hours=2), None),
+        ])
+
+    def urls(self, *args):
+        return [doc.url for doc in self.index.search(*args)]
+
+    def test_terms(self):
+        self.assertEqual(terms(u'Python, the language!'), frozenset([u'python', u'the', u'language']))
+        self.assertEqual(terms(u'我的'), frozenset([u'我', u'的']))
+        self.assertEqual(terms(None), frozenset())
+
+    def test_search(self):
+        self.assertEqual(self.urls(u'python'), ['http://a.com/', 'http://b.com/', 'http://c.com/'])
+        self.assertEqual(self.urls(u'PYTHON rust'), ['http://b.com/'])
+        self.assertEqual(self.urls(u'python', 50), ['http://a.com/', 'http://c.com/'])
+        self.assertEqual(self.urls(u'python', 0, 1), ['http://a.com/'])
+        # Summaries and CJK
+        self.assertEqual(self.urls(u'love'), ['http://a.com/'])
+        self.assertEqual(self.urls(u'学习'), ['http://c.com/'])
+        self.assertEqual(self.urls(u'java'), [])
+        self.assertEqual(self.urls(u''), [])
+
+    def test_incremental(self):
+        changed, gone = self.index.sync_items([
+            ('http://a.com/', u'Python, the language', u'Why we love it', 120, self.now, None),
+            ('http://b.com/', u'Rust vs Go', None, 10, self.now, None),
+        ])
+        self.assertEqual((changed, gone), (1, 1))
+        self.assertEqual(self.urls(u'python'), ['http://a.com/'])
+        self.assertEqual(self.index.search(u'python')[0].score, 120)
+        self.assertNotIn(u'笔', self.index.postings)
+
+    def test_archived(self):
+        day = timedelta(days=1)
+        self.index.add_archived([
+            (1, 'http://a.com/', u'Python, the language', None, 90, self.now, None, self.now),
+            (2, 'http://d.com/', u'Old python', None, 5, self.now - 3*day, None, self.now),
+        ])
+        self.assertEqual(self.index.archived_until, self.now)
+        # The live item is preferred to its archived copy
+        docs = self.index.search(u'python')
+        self.assertEqual([doc.url for doc in docs],
+                         ['http://a.com/', 'http://b.com/', 'http://c.com/', 'http://d.com/'])
+        self.assertEqual(docs[0].key, ('item', 'http://a.com/'))
+        self.assertEqual(self.index.add_archived([], self.now - day), (0, 1))
+        self.assertEqual(self.urls(u'old'), [])
+
+class WorkerLockTestCase(TestCase):
+
+    def test_made_in_every_process(self):
+        lock = WorkerLock()
+        with lock:
+            first = lock.lock
+            self.assertTrue(first.locked())
+        self.assertFalse(first.locked())
+        # As in a worker forked after the lock was taken
+        with mock.patch('search.os.getpid', return_value=-1):
+            with lock:
+                self.assertIsNot(lock.lock, first)
+                self.assertTrue(lock.lock.locked())
@@ -0,0 +1,38 @@
+import unittest
+from io import BytesIO
+from unittest import TestCase
+
+import thumbnail
+
+@unittest.skipUnless(thumbnail.enabled, 'Pillow is not installed')
+class ThumbnailTestCase(TestCase):
+
+    def image(self, mode, size, format):
+        from PIL import Image, ImageDraw
+        img = Image.new(mode, size)
+        draw = ImageDraw.Draw(img)
+        for i in range(0, size[0], 40):
+            draw.ellipse((i, i // 2, i + 200, i // 2 + 150), fill=(i % 256, 100, 200, 200)[:len(mode)])
+        out = BytesIO()
+        img.save(out, format, quality=95)
+        return out.getvalue()
+
+    def open(self, data):
+        from PIL import Image
+        return Image.open(BytesIO(data))
+
+    def test_photo(self):
+        raw_data = self.image('RGB', (1600, 1000), 'JPEG')
+        derivatives = dict(thumbnail.make(raw_data))
+        self.assertEqual(set(derivatives), {'image/webp', 'image/jpeg'})
+        for data in derivatives.values():
+            self.assertEqual(self.open(data).size, (thumbnail.WIDTH, 275))
+            self.assertLess(len(data), len(raw_data))
+
+    def test_transparent(self):
+        derivatives = dict(thumbnail.make(self.image('RGBA', (1600, 1000), 'PNG')))
+        self.assertIn('image/png', derivatives)
+        self.assertEqual(self.open(derivatives['image/png']).mode, 'RGBA')
+
+    def test_unreadable(self):
+        self.assertEqual(thumbnail.make('not an image'), [])
@@ -1,5 +1,16 @@
+#coding: utf-8
+import os
+from io import BytesIO
 from unittest import TestCase
+
+import mock
+import requests
+from requests.packages.urllib3.response import HTTPResponse
+
 import index
+from page_content_extractor.utils import read_body, BodyTooLarge, detect_encoding, current_rss, peak_rss, \
+    ttl_cache
+from page_content_extractor.pdf import PdfExtractor
 
 # class UtilsTestCase(TestCase):
 
@@ -9,3 +20,88 @@ import index
     #     15 views. Download as:. PDF. Embed:. gedanken.pdf. 15 views. Download this document. Free, no registration necessary!. Format:. PDF. Embed this document. Show toolbar. Hide toolbar.
     #     <iFrame src="//pdf.yt/d/jHuhj9FsOC-o9Uap/embed?sparse=0" style="width: 100%; height: 700px; border: 0px;" allowfullscreen></iframe>
     #     """, length=10).endswith('...'))
+
+class ReadBodyTestCase(TestCase):
+
+    def fake_response(self, body):
+        resp = mock.Mock()
+        resp.iter_content.side_effect = lambda size: (body[i:i+size] for i in xrange(0, len(body), size))
+        return resp
+
+    def test_small_body_in_memory(self):
+        resp = self.fake_response('a'*100)
+        self.assertEqual(read_body(resp, threshold=1024), 'a'*100)
+        self.assertTrue(resp.close.called)
+
+    def test_large_body_memory_mapped(self):
+        body = ''.join(chr(i % 256) for i in xrange(10000))
+        data = read_body(self.fake_response(body), threshold=1024, chunk_size=1000)
+        self.assertNotIsInstance(data, basestring)
+        self.assertEqual(len(data), len(body))
+        self.assertEqual(data[:], body)
+
+    def test_max_size(self):
+        self.assertRaises(BodyTooLarge, read_body, self.fake_response('a'*100), max_size=10)
+
+    def test_pdf_from_memory_mapped_body(self):
+        fpath = os.path.join(os.path.dirname(__file__), 'fixtures/cpi.pdf')
+        data = read_body(self.fake_response(open(fpath, 'rb').read()), threshold=1024)
+        self.assertTrue(PdfExtractor(data).get_summary().startswith('Systems code'))
+
+class DetectEncodingTestCase(TestCase):
+
+    def test_bom(self):
+        self.assertEqual(detect_encoding({}, '\xef\xbb\xbf<html>'), 'utf-8-sig')
+        self.assertEqual(detect_encoding({'content-type': 'text/html; charset=gbk'}, '\xff\xfe<\x00'), 'utf-16')
+
+    def test_header(self):
+        self.assertEqual(detect_encoding({'content-type': 'text/html; charset="GBK"'}, '<meta charset="utf-8">'), 'GBK')
+
+    def test_meta_in_head_only(self):
+        self.assertEqual(detect_encoding({'content-type': 'text/html'}, '<meta charset="gb2312">'), 'gb2312')
+        self.assertEqual(detect_encoding({}, '<meta http-equiv="Content-Type" content="text/html; charset=big5" />'), 'big5')
+        body = ' '*(1024*1024) + '<meta charset="gb2312">'
+        self.assertEqual(detect_encoding({}, body), 'utf-8')
+
+    def test_unknown_meta_charset(self):
+        self.assertEqual(detect_encoding({}, '<meta charset="whatever">'), 'utf-8')
+
+    def test_chardet_fallback(self):
+        body = u'你好，世界。'.encode('gbk')*20
+        self.assertEqual(detect_encoding({}, body).lower(), 'gb18030')
+
+    def test_detected_when_text_is_read(self):
+        body = u'<meta charset="gbk"><p>你好</p>'.encode('gbk')
+        raw = HTTPResponse(BytesIO(body), headers={'content-type': 'text/html'}, status=200,
+                           preload_content=False)
+        req = requests.Request('GET', 'http://local.host/').prepare()
+        resp = requests.adapters.HTTPAdapter().build_response(req, raw)
+        self.assertIsNone(resp.encoding)
+        # Not read yet, read_body may still cap it
+        self.assertEqual(raw.tell(), 0)
+        self.assertEqual(resp.text, u'<meta charset="gbk"><p>你好</p>')
+
+class CurrentRssTestCase(TestCase):
+
+    def test_grows_and_shrinks(self):
+        before = current_rss()
+        data = 'a' * 64 * 1024 * 1024
+        self.assertGreater(current_rss() - before, 32 * 1024)
+        del data
+        self.assertLess(current_rss() - before, 32 * 1024)
+
+    @mock.patch('__builtin__.open', side_effect=IOError)
+    def test_peak_without_proc(self, mock_open):
+        self.assertEqual(current_rss(), peak_rss())
+
+class TtlCacheTestCase(TestCase):
+
+    def test_keep(self):
+        lookup = mock.Mock(side_effect=[{}, {}, {'image/webp': 'b'}, {'image/webp': 'c'}])
+        cached = ttl_cache(keep=bool)(lambda img_id: lookup(img_id))
+        # Empty results are looked up again, until there is something
+        self.assertEqual(cached('a'), {})
+        self.assertEqual(cached('a'), {})
+        self.assertEqual(cached('a'), {'image/webp': 'b'})
+        self.assertEqual(cached('a'), {'image/webp': 'b'})
+        self.assertEqual(lookup.call_count, 3)
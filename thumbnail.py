@@ -0,0 +1,61 @@
+"""
+Display-sized derivatives of illustrations, which pages and feeds show about
+220px wide: a WebP, and a JPEG, or a PNG if the image is transparent, for
+clients without WebP. They are made only when Pillow is installed, see models.Thumbnail
+"""
+import logging
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, originals are sent then
+    Image = None
+    logger.warning('Pillow is not installed, no thumbnails are made, originals are sent instead')
+
+enabled = Image is not None
+# Twice the width shown, for high density screens
+WIDTH = 440
+QUALITY = 80
+
+def is_transparent(img):
+    return img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+
+def make(raw_data, width=WIDTH):
+    """
+    Derivatives of (content_type, bytes) smaller than `raw_data`, WebP first,
+    none if it cannot be read, or is animated
+    """
+    if not enabled:
+        return []
+    try:
+        img = Image.open(BytesIO(raw_data))
+        img.load()
+    except Exception as e:
+        logger.info('Cannot make thumbnails, %s', e)
+        return []
+    if getattr(img, 'is_animated', False):
+        return []
+    transparent = is_transparent(img)
+    img = img.convert('RGBA' if transparent else 'RGB')
+    if img.size[0] > width:
+        img.thumbnail((width, img.size[1]), getattr(Image, 'LANCZOS', Image.ANTIALIAS))
+    if transparent:
+        fallback = ('image/png', 'PNG', {'optimize': True})
+    else:
+        fallback = ('image/jpeg', 'JPEG', {'quality': QUALITY, 'optimize': True, 'progressive': True})
+    derivatives = []
+    for content_type, format, options in (('image/webp', 'WEBP', {'quality': QUALITY, 'method': 6}),
+                                          fallback):
+        out = BytesIO()
+        try:
+            img.save(out, format, **options)
+        except (IOError, KeyError) as e:
+            # e.g. Pillow built without libwebp
+            logger.info('Cannot save %s, %s', format, e)
+            continue
+        data = out.getvalue()
+        if len(data) < len(raw_data):
+            derivatives.append((content_type, data))
+    return derivatives